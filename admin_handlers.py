@@ -1,16 +1,36 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile
 from aiogram.filters import Command
 from datetime import datetime, date
+import asyncio
+import html
+import io
 import logging
+import tempfile
+from typing import Coroutine, Set
 
 from database import db
-from config import TIMEZONE, POINTS_TO_MONEY_RATE, ADMIN_IDS
-from utils import format_points, get_user_display_name, MonthNames
+from config import TIMEZONE, POINTS_TO_MONEY_RATE, ADMIN_IDS, EXPORT_SPOOL_MAX_SIZE, PROFILE_MAX_SECONDS
+from utils import format_points, format_tenths, get_user_display_name, MonthNames, POINTS_SCALE
+from exporter import export_month, parquet_available, EXPORT_FORMATS
+from importer import import_csv, ImportValidationError
+from middleware import update_ordering
+from profiler import profiler, format_summary
+from ratelimit import outbound_limiter, broadcast_priority
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+# Strong references to fire-and-forget tasks, the event loop only keeps weak ones
+_background_tasks: Set[asyncio.Task] = set()
+
+def run_in_background(coro: Coroutine) -> asyncio.Task:
+    """Start a task that outlives the update handling it"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
 async def is_admin(user_id: int) -> bool:
     """Check if user is admin (from config or database)"""
     return user_id in ADMIN_IDS or await db.is_admin(user_id)
@@ -65,9 +85,9 @@ async def admin_show_users(callback: CallbackQuery):
             except:
                 name = f"User{user_id}"
             
-            points = await db.get_user_points_for_month(user_id, now.year, now.month)
+            points = await db.get_user_points_for_month(user_id, now.year, now.month, allow_stale=True)
             text += f"👤 {name} (ID: {user_id})\\n"
-            text += f"   💎 {format_points(points)} баллов за месяц\\n\\n"
+            text += f"   💎 {format_tenths(points)} баллов за месяц\\n\\n"
         
         if len(users) > 20:
             text += f"... и еще {len(users) - 20} пользователей"
@@ -100,8 +120,8 @@ async def admin_show_stats(callback: CallbackQuery):
         active_users = len(leaderboard)
         
         # Calculate total points for current month
-        total_points = sum(float(entry['total_points']) for entry in leaderboard)
-        total_money = total_points * POINTS_TO_MONEY_RATE
+        total_tenths = sum(entry['total_points_tenths'] for entry in leaderboard)
+        total_money = total_tenths * POINTS_TO_MONEY_RATE / POINTS_SCALE
         
         # Get modules info
         modules = await db.get_modules()
@@ -112,12 +132,43 @@ async def admin_show_stats(callback: CallbackQuery):
             f"👥 Всего пользователей: {total_users}\\n"
             f"🔥 Активных в месяце: {active_users}\\n"
             f"📚 Доступно модулей: {len(modules)}\\n\\n"
-            f"💎 Общий баланс баллов: {format_points(total_points)}\\n"
+            f"💎 Общий баланс баллов: {format_tenths(total_tenths)}\\n"
             f"💰 Общий денежный эквивалент: {format_points(total_money)} ₽\\n\\n"
             f"📈 Средние баллы на активного пользователя: "
-            f"{format_points(total_points / active_users) if active_users > 0 else 0}"
+            f"{format_points(total_tenths / POINTS_SCALE / active_users) if active_users > 0 else 0}"
+        )
+        
+        cache_info = db.user_stats_info()
+        text += (
+            f"\n\n🗄 Кэш статистики: {cache_info['size']} записей, "
+            f"попаданий {cache_info['hit_ratio']:.0%} ({cache_info['hits']}/{cache_info['hits'] + cache_info['misses']})"
+        )
+        
+        queue = update_ordering.stats()
+        text += (
+            f"\n⏳ Обработка: {queue['in_flight']} в работе, {db.waiting} ждут соединения с БД, "
+            f"ожидание p50 {queue['delay_p50'] * 1000:.0f} мс, p95 {queue['delay_p95'] * 1000:.0f} мс, "
+            f"макс. {queue['delay_max'] * 1000:.0f} мс"
+        )
+        
+        outbound = outbound_limiter.stats()
+        text += (
+            f"\n📤 Bot API: в очереди {outbound['queued']}, отправлено {outbound['interactive']} ответов "
+            f"и {outbound['broadcast']} рассылок, повторов после RetryAfter {outbound['retries']}"
         )
         
+        breaker = db.breaker.stats()
+        text += (
+            f"\n🛡 БД: цепь {breaker['state']}, ошибок подряд {breaker['failures']}, "
+            f"отклонено {breaker['rejected']}, ожидают записи {len(db.pending_writes)}"
+        )
+        
+        if db.replica_pool is not None:
+            if db.replica_lag is None:
+                text += "\n🪞 Реплика: недоступна, чтение с основной БД"
+            else:
+                text += f"\n🪞 Реплика: отставание {db.replica_lag:.1f} с"
+        
         back_keyboard = InlineKeyboardMarkup(
             inline_keyboard=[[
                 InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_back")
@@ -136,7 +187,17 @@ async def admin_send_reports(callback: CallbackQuery):
     if not await is_admin(callback.from_user.id):
         await callback.answer("❌ Нет прав доступа!", show_alert=True)
         return
+    if any(task.get_name() == "admin_reports" for task in _background_tasks):
+        await callback.answer("⏳ Отчеты уже отправляются, дождитесь результата.", show_alert=True)
+        return
     
+    await callback.answer("📧 Рассылка отчетов запущена")
+    await callback.message.edit_text("⏳ Отчеты отправляются, результат появится здесь.")
+    # Runs in the background so this update does not hold its user's queue meanwhile
+    run_in_background(_send_reports(callback)).set_name("admin_reports")
+
+async def _send_reports(callback: CallbackQuery):
+    """Send last month's report to every active user and show the totals"""
     try:
         users = await db.get_all_users()
         now = datetime.now(TIMEZONE)
@@ -150,26 +211,28 @@ async def admin_send_reports(callback: CallbackQuery):
         
         for user_id in users:
             try:
-                points = await db.get_user_points_for_month(user_id, prev_year, prev_month)
+                points = await db.get_user_points_for_month(user_id, prev_year, prev_month, allow_stale=True)
                 
                 if points > 0:  # Send report only to users with activity
-                    money = points * POINTS_TO_MONEY_RATE
+                    money = points * POINTS_TO_MONEY_RATE / POINTS_SCALE
                     
-                    try:
-                        user_info = await callback.bot.get_chat(user_id)
-                        name = get_user_display_name(user_info)
-                    except:
-                        name = "Пользователь"
+                    with broadcast_priority():
+                        try:
+                            user_info = await callback.bot.get_chat(user_id)
+                            name = get_user_display_name(user_info)
+                        except:
+                            name = "Пользователь"
                     
                     report_text = (
                         f"📊 Отчет за {MonthNames.get_full_month_name(prev_month)} {prev_year}\\n\\n"
                         f"👤 {name}\\n"
-                        f"💎 Набрано баллов: {format_points(points)}\\n"
+                        f"💎 Набрано баллов: {format_tenths(points)}\\n"
                         f"💰 Денежный эквивалент: {format_points(money)} ₽\\n\\n"
                         f"Спасибо за активность! 🎉"
                     )
                     
-                    await callback.bot.send_message(user_id, report_text)
+                    with broadcast_priority():
+                        await callback.bot.send_message(user_id, report_text)
                     sent_count += 1
                     
             except Exception as e:
@@ -192,7 +255,10 @@ async def admin_send_reports(callback: CallbackQuery):
         
     except Exception as e:
         logger.error(f"Error in admin_send_reports: {e}")
-        await callback.answer("❌ Ошибка при отправке отчетов!", show_alert=True)
+        try:
+            await callback.message.edit_text("❌ Ошибка при отправке отчетов!")
+        except Exception as e:
+            logger.warning(f"Could not report the failed broadcast: {e}")
 
 @router.callback_query(F.data == "admin_manage")
 async def admin_manage(callback: CallbackQuery):
@@ -232,7 +298,7 @@ async def admin_show_modules(callback: CallbackQuery):
         text = f"📚 Управление модулями ({len(modules)} шт.)\\n\\n"
         
         for module in modules:
-            text += f"• {module['name']} - {format_points(module['points'])} баллов\\n"
+            text += f"• {module['name']} - {format_tenths(module['points_tenths'])} баллов\\n"
         
         text += "\\n💡 Для добавления/изменения модулей используйте прямые SQL-запросы к базе данных."
         
@@ -277,34 +343,32 @@ async def cmd_admin_user(message: Message):
         except:
             name = f"User{user_id}"
         
-        # Get current month stats
-        current_points = await db.get_user_points_for_month(user_id, now.year, now.month)
-        daily_stats = await db.get_user_daily_stats(user_id, now.year, now.month)
-        
-        # Get previous month stats
-        prev_month = now.month - 1 if now.month > 1 else 12
-        prev_year = now.year if now.month > 1 else now.year - 1
-        prev_points = await db.get_user_points_for_month(user_id, prev_year, prev_month)
+        # Get current and previous month stats
+        current, previous = await db.get_user_summary(user_id, 2, now.year, now.month, allow_stale=True)
+        current_points = current['points_tenths']
+        prev_points = previous['points_tenths']
+        prev_year, prev_month = previous['year'], previous['month']
         
-        active_days = len(daily_stats)
-        money = current_points * POINTS_TO_MONEY_RATE
+        active_days = len(current['daily'])
+        money = current_points * POINTS_TO_MONEY_RATE / POINTS_SCALE
         
         text = (
             f"👤 Статистика пользователя\\n\\n"
             f"Имя: {name}\\n"
             f"ID: {user_id}\\n\\n"
             f"📅 {MonthNames.get_full_month_name(now.month)} {now.year}:\\n"
-            f"💎 Баллы: {format_points(current_points)}\\n"
+            f"💎 Баллы: {format_tenths(current_points)}\\n"
             f"💰 Деньги: {format_points(money)} ₽\\n"
-            f"📈 Активных дней: {active_days}\\n\\n"
+            f"📈 Активных дней: {active_days}\\n"
+            f"✅ Модулей: {current['completions']}\\n\\n"
             f"📅 {MonthNames.get_full_month_name(prev_month)} {prev_year}:\\n"
-            f"💎 Баллы: {format_points(prev_points)}\\n\\n"
+            f"💎 Баллы: {format_tenths(prev_points)}\\n\\n"
         )
         
         if prev_points > 0:
             change = current_points - prev_points
             change_percent = (change / prev_points) * 100
-            text += f"📊 Изменение: {'+' if change > 0 else ''}{format_points(change)} баллов ({change_percent:+.1f}%)"
+            text += f"📊 Изменение: {'+' if change > 0 else ''}{format_tenths(change)} баллов ({change_percent:+.1f}%)"
         
         await message.answer(text)
         
@@ -313,3 +377,132 @@ async def cmd_admin_user(message: Message):
     except Exception as e:
         logger.error(f"Error in cmd_admin_user: {e}")
         await message.answer("❌ Произошла ошибка при получении статистики пользователя.")
+
+@router.message(Command("admin_export"))
+async def cmd_admin_export(message: Message):
+    """Export month logs and payroll: /admin_export <year> <month> [csv|parquet]"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора.")
+        return
+    
+    try:
+        args = message.text.split()[1:]
+        if len(args) < 2:
+            await message.answer("📝 Использование: /admin_export <год> <месяц> [csv|parquet]")
+            return
+        
+        year, month = int(args[0]), int(args[1])
+        if not 1 <= month <= 12:
+            raise ValueError(month)
+        
+        fmt = args[2].lower() if len(args) > 2 else 'csv'
+        if fmt not in EXPORT_FORMATS:
+            await message.answer("❌ Формат должен быть csv или parquet.")
+            return
+        if fmt == 'parquet' and not parquet_available():
+            await message.answer("❌ Parquet недоступен: не установлен pyarrow.")
+            return
+        
+        files = await export_month(year, month, fmt)
+        if not files:
+            await message.answer(f"📭 Нет данных за {MonthNames.get_full_month_name(month)} {year}.")
+            return
+        
+        try:
+            for file in files:
+                await message.answer_document(
+                    file,
+                    caption=f"📤 {file.filename}: {file.rows} строк"
+                )
+        finally:
+            for file in files:
+                file.close()
+        
+    except ValueError:
+        await message.answer("❌ Неверный формат года или месяца.")
+    except Exception as e:
+        logger.error(f"Error in cmd_admin_export: {e}")
+        await message.answer("❌ Произошла ошибка при экспорте.")
+
+@router.message(Command("admin_import"))
+async def cmd_admin_import(message: Message):
+    """Bulk import completions from CSV sent with caption /admin_import or replied to"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора.")
+        return
+    
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if not document:
+        await message.answer(
+            "📝 Отправьте CSV-файл с подписью /admin_import или ответьте командой на файл.\n\n"
+            "Формат строк: user_id, module_name, date, count\n"
+            "Дата: 2025-01-31 или 31.01.2025, count необязателен."
+        )
+        return
+    
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE) as spool:
+            await message.bot.download(document, destination=spool)
+            spool.seek(0)
+            stream = io.TextIOWrapper(spool, encoding='utf-8-sig', newline='')
+            result = await import_csv(stream)
+        
+        await message.answer(
+            f"📥 Импорт завершен!\n\n"
+            f"📄 Строк: {result.rows}\n"
+            f"✅ Добавлено выполнений: {result.records}\n"
+            f"📅 Месяцев затронуто: {len(result.months)}"
+        )
+        
+    except ImportValidationError as e:
+        errors = "\n".join(e.result.errors)
+        more = e.result.error_count - len(e.result.errors)
+        await message.answer(
+            f"❌ Импорт отменен: {e.result.error_count} ошибок, ничего не добавлено.\n\n{errors}"
+            + (f"\n... и еще {more}" if more > 0 else "")
+        )
+    except UnicodeDecodeError:
+        await message.answer("❌ Файл должен быть в кодировке UTF-8.")
+    except Exception as e:
+        logger.error(f"Error in cmd_admin_import: {e}")
+        await message.answer("❌ Произошла ошибка при импорте.")
+
+@router.message(Command("admin_profile"))
+async def cmd_admin_profile(message: Message):
+    """Sample the running bot for N seconds: /admin_profile <seconds>"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора.")
+        return
+    
+    args = message.text.split()[1:]
+    if len(args) != 1 or not args[0].isdigit() or not 1 <= int(args[0]) <= PROFILE_MAX_SECONDS:
+        await message.answer(f"📝 Использование: /admin_profile <секунды от 1 до {PROFILE_MAX_SECONDS}>")
+        return
+    if profiler.running:
+        await message.answer("⏳ Профилирование уже идет, дождитесь результата.")
+        return
+    
+    seconds = int(args[0])
+    profiler.start()
+    await message.answer(f"🔬 Профилирование запущено на {seconds} с.")
+    # Runs in the background so this update does not hold its user's queue meanwhile
+    run_in_background(_finish_profile(message, seconds))
+
+async def _finish_profile(message: Message, seconds: int):
+    """Stop the profiler after the given time and send the results"""
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        result = profiler.stop()
+    
+    try:
+        summary = format_summary(result)
+        stamp = datetime.now(TIMEZONE).strftime('%Y%m%d_%H%M%S')
+        await message.answer_document(
+            BufferedInputFile(result.collapsed().encode(), filename=f"profile_{stamp}.collapsed.txt"),
+            caption="🔥 Стеки в формате collapsed (flamegraph.pl, speedscope.app)"
+        )
+        await message.answer(f"<pre>{html.escape(summary)}</pre>")
+    except Exception as e:
+        logger.error(f"Error in cmd_admin_profile: {e}")
+        await message.answer("❌ Не удалось отправить результаты профилирования.")
@@ -1,65 +1,106 @@
 from aiogram import Router, F
-from aiogram.types import Message, BufferedInputFile
+from aiogram.types import Message, CallbackQuery, BufferedInputFile, Chat
 from aiogram.filters import Command
 from datetime import datetime, date
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+from typing import Optional
 from io import BytesIO
+import asyncio
 import calendar
 import logging
 
 from database import db
-from config import TIMEZONE, POINTS_TO_MONEY_RATE, ADMIN_IDS
+from config import TIMEZONE, ADMIN_IDS
 from utils import (
-    format_points, get_user_display_name, get_rank_emoji,
-    generate_progress_insights, MonthNames
+    get_user_display_name, generate_progress_insights,
+    MonthNames, shift_month, month_bounds
 )
+from charts import render_month_bars, build_year_grid, render_year_heatmap, render_points_trend
+from analytics import get_cohort
+from leaderboard import leaderboards, parse_period, PERIODS
+from catalog import catalog
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+def leaderboard_chat(chat: Chat) -> Optional[int]:
+    """Chat whose members are ranked: groups get their own leaderboard, private chats the global one"""
+    return chat.id if chat.type in ("group", "supergroup") else None
+
 @router.message(Command("leaderboard"))
 async def cmd_leaderboard(message: Message):
-    """Show leaderboard for current month"""
+    """Show leaderboard: /leaderboard [week|month|year|all], of the group when used in one"""
     try:
-        now = datetime.now(TIMEZONE)
-        leaderboard = await db.get_leaderboard(now.year, now.month)
-        
-        if not leaderboard:
-            await message.answer("📊 Пока нет данных для лидерборда за этот месяц.")
+        args = message.text.split()[1:]
+        period = parse_period(args[0] if args else None)
+        if period is None:
+            await message.answer("📝 Использование: /leaderboard [week|month|year|all]")
             return
         
-        text = f"🏆 Лидерборд за {MonthNames.get_full_month_name(now.month)} {now.year}\\n\\n"
-        
-        for i, entry in enumerate(leaderboard, 1):
-            user_id = entry['user_id']
-            points = float(entry['total_points'])
-            money = points * POINTS_TO_MONEY_RATE
-            
-            # Try to get user info (this is simplified - in real bot you'd cache this)
-            try:
-                user_info = await message.bot.get_chat(user_id)
-                name = get_user_display_name(user_info)
-            except:
-                name = f"User{user_id}"
-            
-            rank_emoji = get_rank_emoji(i)
-            text += f"{rank_emoji} {name}\\n"
-            text += f"   💎 {format_points(points)} баллов\\n"
-            text += f"   💰 {format_points(money)} ₽\\n\\n"
-        
-        await message.answer(text)
+        text, keyboard = await leaderboards.render_page(message.bot, period, 0, leaderboard_chat(message.chat))
+        await message.answer(text, reply_markup=keyboard)
         
     except Exception as e:
         logger.error(f"Error in cmd_leaderboard: {e}")
         await message.answer("❌ Произошла ошибка при загрузке лидерборда.")
 
+@router.callback_query(F.data.startswith("lb_me_"))
+async def handle_leaderboard_my_position(callback: CallbackQuery):
+    """Jump to the page with the caller's position"""
+    try:
+        period = callback.data.split("_")[2]
+        chat_id = leaderboard_chat(callback.message.chat)
+        snapshot = await leaderboards.get_snapshot(period, chat_id)
+        found = await leaderboards.find_user(snapshot, callback.from_user.id)
+        
+        if found is None:
+            await callback.answer("📭 Вас пока нет в этом лидерборде.", show_alert=True)
+            return
+        
+        page, rank = found
+        text, keyboard = await leaderboards.render_page(callback.bot, period, page, chat_id)
+        if text != callback.message.text:
+            await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer(f"📍 Ваше место: {rank}")
+        
+    except Exception as e:
+        logger.error(f"Error in handle_leaderboard_my_position: {e}")
+        await callback.answer("❌ Ошибка при загрузке лидерборда!", show_alert=True)
+
+@router.callback_query(F.data.startswith("lb_"))
+async def handle_leaderboard_page(callback: CallbackQuery):
+    """Handle leaderboard paging and period switching"""
+    try:
+        _, period, page = callback.data.split("_")
+        if period not in PERIODS:
+            await callback.answer()
+            return
+        
+        text, keyboard = await leaderboards.render_page(
+            callback.bot, period, int(page), leaderboard_chat(callback.message.chat)
+        )
+        if text != callback.message.text:
+            await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer()
+        
+    except Exception as e:
+        logger.error(f"Error in handle_leaderboard_page: {e}")
+        await callback.answer("❌ Ошибка при загрузке лидерборда!", show_alert=True)
+
 @router.message(Command("graph"))
 async def cmd_graph(message: Message):
-    """Generate and send user's progress graph"""
+    """Generate and send user's progress graph: /graph [year|trend]"""
     try:
         user_id = message.from_user.id
         now = datetime.now(TIMEZONE)
+        args = message.text.split()[1:]
+        mode = args[0].lower() if args else "month"
+        
+        if mode == "year":
+            await send_year_graph(message, now)
+            return
+        if mode == "trend":
+            await send_trend_graph(message, now)
+            return
         
         # Get daily stats for current month
         daily_stats = await db.get_user_daily_stats(user_id, now.year, now.month)
@@ -78,7 +119,7 @@ async def cmd_graph(message: Message):
         )
         
         user_name = get_user_display_name(message.from_user)
-        caption = f"📈 График выполнения модулей\\n👤 {user_name}\\n📅 {MonthNames.get_full_month_name(now.month)} {now.year}"
+        caption = f"📈 График выполнения модулей\n👤 {user_name}\n📅 {MonthNames.get_full_month_name(now.month)} {now.year}"
         
         await message.answer_photo(graph_file, caption=caption)
         
@@ -86,67 +127,49 @@ async def cmd_graph(message: Message):
         logger.error(f"Error in cmd_graph: {e}")
         await message.answer("❌ Произошла ошибка при создании графика.")
 
-async def generate_progress_graph(daily_stats: dict, year: int, month: int) -> BytesIO:
-    """Generate progress graph for user"""
-    
-    # Set up Russian font (if available) and style
-    plt.style.use('default')
-    plt.rcParams['figure.facecolor'] = 'white'
-    plt.rcParams['axes.facecolor'] = 'white'
-    
-    # Create figure
-    fig, ax = plt.subplots(figsize=(12, 6))
-    
-    # Get days in month
-    days_in_month = calendar.monthrange(year, month)[1]
-    
-    # Prepare data
-    days = list(range(1, days_in_month + 1))
-    points = [daily_stats.get(day, 0) for day in days]
-    
-    # Create bar chart
-    bars = ax.bar(days, points, color='#4CAF50', alpha=0.8, edgecolor='#2E7D32', linewidth=1)
-    
-    # Customize appearance
-    ax.set_xlabel('День месяца', fontsize=12)
-    ax.set_ylabel('Баллы', fontsize=12)
-    ax.set_title(f'График выполнения модулей - {MonthNames.get_full_month_name(month)} {year}', 
-                fontsize=14, fontweight='bold')
-    
-    # Set x-axis ticks
-    ax.set_xticks(range(1, days_in_month + 1, max(1, days_in_month // 10)))
-    ax.set_xlim(0.5, days_in_month + 0.5)
+async def send_year_graph(message: Message, now: datetime):
+    """Send year-at-a-glance activity heatmap"""
+    user_id = message.from_user.id
+    daily_points = await db.get_user_daily_points_range(
+        user_id, date(now.year, 1, 1), date(now.year + 1, 1, 1)
+    )
     
-    # Add grid
-    ax.grid(True, axis='y', alpha=0.3)
-    ax.set_axisbelow(True)
+    if not daily_points:
+        await message.answer("📈 Пока нет данных за этот год.")
+        return
     
-    # Add value labels on bars (only for non-zero values)
-    for bar, point in zip(bars, points):
-        if point > 0:
-            height = bar.get_height()
-            ax.text(bar.get_x() + bar.get_width()/2., height + 0.5,
-                   f'{format_points(point)}',
-                   ha='center', va='bottom', fontsize=8)
+    grid = build_year_grid(now.year, daily_points)
+    buffer = await asyncio.to_thread(render_year_heatmap, grid, now.year)
     
-    # Add statistics
-    total_points = sum(points)
-    active_days = len([p for p in points if p > 0])
-    avg_points = total_points / active_days if active_days > 0 else 0
-    
-    stats_text = f'Всего баллов: {format_points(total_points)} | Активных дней: {active_days} | Среднее: {format_points(avg_points)}'
-    ax.text(0.02, 0.98, stats_text, transform=ax.transAxes, 
-           verticalalignment='top', bbox=dict(boxstyle='round', facecolor='lightblue', alpha=0.8))
+    user_name = get_user_display_name(message.from_user)
+    await message.answer_photo(
+        BufferedInputFile(buffer.getvalue(), filename=f"year_{user_id}_{now.year}.png"),
+        caption=f"🗓 Активность за год\n👤 {user_name}\n📅 {now.year}"
+    )
+
+async def send_trend_graph(message: Message, now: datetime, months: int = 12):
+    """Send monthly points trend for the last months"""
+    user_id = message.from_user.id
+    start = month_bounds(*shift_month(now.year, now.month, -(months - 1)))[0]
+    end = month_bounds(now.year, now.month)[1]
+    monthly_points = await db.get_user_monthly_points(user_id, start, end)
     
-    plt.tight_layout()
+    if not monthly_points:
+        await message.answer("📈 Пока нет данных для построения тренда.")
+        return
     
-    # Save to buffer
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight')
-    buffer.seek(0)
-    plt.close()
+    buffer = await asyncio.to_thread(render_points_trend, monthly_points, now.year, now.month, months)
     
-    return buffer
+    user_name = get_user_display_name(message.from_user)
+    await message.answer_photo(
+        BufferedInputFile(buffer.getvalue(), filename=f"trend_{user_id}_{now.year}_{now.month}.png"),
+        caption=f"📊 Баллы за {months} месяцев\n👤 {user_name}"
+    )
+
+async def generate_progress_graph(daily_stats: dict, year: int, month: int) -> BytesIO:
+    """Generate progress graph for user"""
+    # Rendering is CPU-bound, keep it off the event loop
+    return await asyncio.to_thread(render_month_bars, daily_stats, year, month)
 
 @router.message(Command("insight"))
 async def cmd_insight(message: Message):
@@ -157,14 +180,11 @@ async def cmd_insight(message: Message):
         current_day = now.day
         days_in_month = calendar.monthrange(now.year, now.month)[1]
         
-        # Get current month stats
-        current_points = await db.get_user_points_for_month(user_id, now.year, now.month)
-        daily_stats = await db.get_user_daily_stats(user_id, now.year, now.month)
-        
-        # Get previous month stats
-        prev_month = now.month - 1 if now.month > 1 else 12
-        prev_year = now.year if now.month > 1 else now.year - 1
-        prev_points = await db.get_user_points_for_month(user_id, prev_year, prev_month)
+        # Get current and previous month stats
+        current, previous = await db.get_user_summary(user_id, 2, now.year, now.month)
+        current_points = current['points_tenths']
+        daily_stats = current['daily']
+        prev_points = previous['points_tenths']
         
         if current_points == 0 and len(daily_stats) == 0:
             await message.answer(
@@ -174,9 +194,13 @@ async def cmd_insight(message: Message):
             )
             return
         
+        # Compare with this month's cohort
+        cohort = await get_cohort(now.year, now.month)
+        
         # Generate insights
         insights = generate_progress_insights(
-            user_id, current_points, prev_points, daily_stats, days_in_month, current_day
+            user_id, current_points, prev_points, daily_stats, days_in_month, current_day,
+            cohort=cohort
         )
         
         user_name = get_user_display_name(message.from_user)
@@ -195,17 +219,22 @@ async def cmd_insight(message: Message):
 async def handle_modules_pagination(callback: CallbackQuery):
     """Handle pagination for modules keyboard"""
     try:
-        page = int(callback.data.split("_")[2])
-        modules = await db.get_modules()
+        # modules_page_<version>_<page>; keyboards sent before versioning have no version part
+        parts = callback.data.split("_")
+        version = int(parts[2]) if len(parts) > 3 else None
+        page = int(parts[-1])
         
-        from utils import create_modules_keyboard
-        keyboard = create_modules_keyboard(modules, page)
+        await catalog.ensure_fresh()
+        keyboard = catalog.keyboard(page)
         
         await callback.message.edit_text(
             "📚 Выберите модуль для добавления:",
             reply_markup=keyboard
         )
-        await callback.answer()
+        if version != catalog.version:
+            await callback.answer("🔄 Список модулей обновлен")
+        else:
+            await callback.answer()
         
     except Exception as e:
         logger.error(f"Error in handle_modules_pagination: {e}")
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from database import db
+from cache import TTLCache
+from config import COHORT_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+COHORT_METRICS = ('points_tenths', 'active_days', 'longest_streak')
+
+class CohortDistribution:
+    """Sorted per-metric arrays of a month's cohort for O(log n) rank lookups"""
+
+    def __init__(self, rows: List[Dict]):
+        self.size = len(rows)
+        self.sorted: Dict[str, np.ndarray] = {}
+        self.mean: Dict[str, float] = {}
+        self.std: Dict[str, float] = {}
+
+        for metric in COHORT_METRICS:
+            values = np.sort(np.fromiter((row[metric] for row in rows), dtype=np.float64, count=self.size))
+            self.sorted[metric] = values
+            self.mean[metric] = float(values.mean()) if self.size else 0.0
+            self.std[metric] = float(values.std()) if self.size else 0.0
+
+    def percentile(self, metric: str, value: float) -> float:
+        """Share of the cohort (0-100) at or below the value"""
+        if not self.size:
+            return 0.0
+        position = np.searchsorted(self.sorted[metric], value, side='right')
+        return float(position) / self.size * 100
+
+    def z_score(self, metric: str, value: float) -> float:
+        """Standard score of the value within the cohort"""
+        std = self.std[metric]
+        return (value - self.mean[metric]) / std if std > 0 else 0.0
+
+_cohort_cache = TTLCache(maxsize=24, ttl=COHORT_CACHE_TTL)
+_cohort_lock: Optional[asyncio.Lock] = None  # Created on first use, inside the running loop
+
+async def get_cohort(year: int, month: int) -> CohortDistribution:
+    """Get the cached cohort distribution for a month, computing it once per interval"""
+    global _cohort_lock
+    cohort = _cohort_cache.get((year, month))
+    if cohort is not None:
+        return cohort
+
+    if _cohort_lock is None:
+        _cohort_lock = asyncio.Lock()
+    async with _cohort_lock:
+        # Another request may have filled the cache while we waited
+        if (year, month) in _cohort_cache:
+            return _cohort_cache.get((year, month))
+
+        rows = await db.get_cohort_stats(year, month)
+        cohort = CohortDistribution(rows)
+        _cohort_cache.set((year, month), cohort)
+        logger.info(f"Cohort for {year}-{month:02d} computed: {cohort.size} users")
+        return cohort
@@ -0,0 +1,116 @@
+"""Event loop lag under a log storm: direct file handler vs the queue pipeline
+
+Usage: python bench_logging.py [--records 20000] [--producers 8] [--write-delay 0.0005]
+--write-delay emulates a slow disk by sleeping in every file write.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from logging_setup import TEXT_FORMAT, LogListener, setup_logging
+
+logger = logging.getLogger("bench")
+
+class SlowFileHandler(logging.FileHandler):
+    """File handler with an artificial delay per record"""
+
+    def __init__(self, filename: str, delay: float):
+        super().__init__(filename, encoding='utf-8')
+        self.write_delay = delay
+
+    def emit(self, record: logging.LogRecord):
+        if self.write_delay:
+            time.sleep(self.write_delay)
+        super().emit(record)
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+async def measure_lag(stop: asyncio.Event, interval: float, lags: List[float]):
+    """Record how late the loop wakes a sleeper, the latency every other task sees too"""
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+async def produce(count: int):
+    for index in range(count):
+        if index % 100 == 0:
+            try:
+                raise ValueError("storm")
+            except ValueError:
+                logger.exception(f"Failed record {index}")
+        else:
+            logger.info(f"Record {index} user=%s points=%s", index * 7, index % 10 / 2)
+        if index % 50 == 0:
+            await asyncio.sleep(0)
+
+async def storm(records: int, producers: int) -> Dict:
+    stop = asyncio.Event()
+    lags: List[float] = []
+    monitor = asyncio.create_task(measure_lag(stop, 0.001, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(produce(records // producers) for _ in range(producers)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+    return {
+        'elapsed': elapsed,
+        'rate': records / elapsed,
+        'lag_p50': percentile(lags, 0.5),
+        'lag_p99': percentile(lags, 0.99),
+        'lag_max': max(lags, default=0.0),
+    }
+
+def run_mode(mode: str, path: str, records: int, producers: int, write_delay: float) -> Dict:
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = SlowFileHandler(path, write_delay)
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    listener: Optional[LogListener] = None
+    if mode == 'queue':
+        listener = setup_logging([handler], level='INFO')
+    else:
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+
+    result = asyncio.run(storm(records, producers))
+    flush_started = time.perf_counter()
+    if listener:
+        result['dropped'] = root.handlers[0].dropped
+        listener.stop()
+    result['drain'] = time.perf_counter() - flush_started
+    handler.close()
+    return result
+
+def format_report(mode: str, result: Dict) -> str:
+    line = (
+        f"{mode:>5}: {result['rate']:>9.0f} records/s, loop lag p50 {result['lag_p50'] * 1000:.2f} ms, "
+        f"p99 {result['lag_p99'] * 1000:.2f} ms, max {result['lag_max'] * 1000:.2f} ms"
+    )
+    if mode == 'queue':
+        line += f", writer drain {result['drain']:.2f}s, dropped {result['dropped']}"
+    return line
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare event loop lag of logging setups under a log storm")
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--producers", type=int, default=8)
+    parser.add_argument("--write-delay", type=float, default=0.0, help="seconds slept per file write")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ('sync', 'queue'):
+            path = os.path.join(directory, f"{mode}.log")
+            result = run_mode(mode, path, args.records, args.producers, args.write_delay)
+            print(format_report(mode, result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from typing import Any, Iterator, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from config import CAPTURE_SALT, CAPTURE_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+ID_PARENTS = {'from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat'}
+QUERY_PARENTS = {'inline_query', 'chosen_inline_result'}
+NAME_FIELDS = {'first_name', 'last_name', 'username', 'title', 'phone_number', 'bio', 'description'}
+FILE_FIELDS = {'file_id', 'file_unique_id', 'file_name'}
+# Command arguments kept as is: counts, hours and dates, no run of more than four digits
+PLAIN_ARGUMENT_RE = re.compile(r"[\d:.\-]+")
+TELEGRAM_ID_RE = re.compile(r"-?\d{5,}")
+
+def pseudonymize_id(value: int, salt: str = CAPTURE_SALT) -> int:
+    """Stable keyed replacement of a Telegram id, keeping its sign (groups are negative)"""
+    digest = hmac.new(salt.encode(), str(abs(value)).encode(), hashlib.sha256).digest()
+    pseudonym = int.from_bytes(digest[:6], 'big') % 10 ** 12 + 1
+    return -pseudonym if value < 0 else pseudonym
+
+def anonymize_argument(token: str) -> str:
+    """Pseudonymize an id-like command argument, mask free text, keep small numbers"""
+    if TELEGRAM_ID_RE.fullmatch(token):
+        return str(pseudonymize_id(int(token)))
+    if PLAIN_ARGUMENT_RE.fullmatch(token) and all(len(run) <= 4 for run in re.findall(r"\d+", token)):
+        return token
+    return "x" * len(token)
+
+def anonymize_command(text: str) -> str:
+    """Keep the command token of a message, anonymizing its arguments one by one"""
+    command, arguments = re.match(r"(\S*)(.*)", text, re.DOTALL).groups()
+    return command + re.sub(r"\S+", lambda match: anonymize_argument(match.group()), arguments)
+
+def anonymize(value: Any, parent: str = '') -> Any:
+    """Replace ids, names and files in a serialized update, keeping its shape
+    
+    Command names and callback data are kept as they drive the handlers, and
+    so are small numeric command arguments; id-like arguments are
+    pseudonymized like the ids themselves. Other free text, inline queries
+    included, is replaced by a placeholder of the same length.
+    """
+    if isinstance(value, list):
+        return [anonymize(item, parent) for item in value]
+    if not isinstance(value, dict):
+        return value
+    
+    result = {}
+    for key, item in value.items():
+        if key == 'id' and parent in ID_PARENTS and isinstance(item, int):
+            result[key] = pseudonymize_id(item)
+        elif key in ('user_id', 'chat_id') and isinstance(item, int):
+            result[key] = pseudonymize_id(item)
+        elif key in NAME_FIELDS or key in FILE_FIELDS:
+            result[key] = f"{key}_redacted"
+        elif key in ('text', 'caption') and isinstance(item, str):
+            result[key] = anonymize_command(item) if item.startswith('/') else "x" * len(item)
+        elif key == 'query' and parent in QUERY_PARENTS and isinstance(item, str):
+            result[key] = "x" * len(item)
+        elif key in ('entities', 'caption_entities'):
+            result[key] = [entity for entity in item if entity.get('type') == 'bot_command']
+        else:
+            result[key] = anonymize(item, key)
+    return result
+
+class UpdateCaptureMiddleware(BaseMiddleware):
+    """Outer update middleware appending anonymized updates to a gzip JSONL file
+    
+    Each line is {"t": unix receive time, "update": {...}}. Registered first, so
+    the timestamp is taken before any queueing in later middlewares. Compression
+    and writes run on a writer thread; when its queue is full updates are
+    dropped from the capture, never waited for.
+    """
+    
+    def __init__(self, path: str, flush_every: int = 100):
+        super().__init__()
+        if not CAPTURE_SALT:
+            # Without a secret key the pseudonyms could be reversed by hashing known ids
+            raise ValueError("CAPTURE_SALT must be set to capture updates")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.flush_every = flush_every
+        self.captured = 0
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(CAPTURE_QUEUE_SIZE)
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._thread = threading.Thread(target=self._write_lines, name="update-capture", daemon=True)
+        self._thread.start()
+    
+    async def __call__(self, handler, event, data):
+        if isinstance(event, Update):
+            try:
+                record = {'t': time.time(), 'update': anonymize(event.model_dump(mode='json', exclude_none=True, by_alias=True))}
+                self._queue.put_nowait(json.dumps(record, ensure_ascii=False) + "\n")
+            except queue.Full:
+                self.dropped += 1
+            except Exception as e:
+                logger.error(f"Error capturing update: {e}")
+        return await handler(event, data)
+    
+    def _write_lines(self):
+        """Writer thread: drain the queue into the file until the None marker"""
+        while True:
+            line = self._queue.get()
+            if line is None:
+                break
+            try:
+                self._file.write(line)
+                self.captured += 1
+                if self.captured % self.flush_every == 0:
+                    self._file.flush()
+            except Exception as e:
+                logger.error(f"Error writing captured update: {e}")
+    
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._file.close()
+        logger.info(f"Captured {self.captured} updates to {self.path}, dropped {self.dropped}")
+
+def read_capture(path: str) -> Iterator[Tuple[float, dict]]:
+    """Yield (timestamp, update dict) from a capture file"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record['t'], record['update']
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import math
+import re
+import time
+from typing import List, Dict, Optional, Tuple, Set
+
+from aiogram.types import InlineKeyboardMarkup
+
+from database import db
+from config import CATALOG_REFRESH_INTERVAL
+from utils import create_modules_keyboard
+
+logger = logging.getLogger(__name__)
+
+NON_ALNUM_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+def normalize_module_name(name: str) -> str:
+    """Normalize module name for lookups: lowercase, no spaces or punctuation"""
+    return NON_ALNUM_RE.sub("", name.casefold())
+
+def trigrams(key: str) -> Set[str]:
+    """Character trigrams of a normalized key, padded to catch prefixes and suffixes"""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance between two strings"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        previous = current
+    return previous[-1]
+
+class ModuleIndex:
+    """In-memory index of modules by id, normalized name and name trigrams"""
+
+    MIN_SIMILARITY = 0.3
+
+    def __init__(self, modules: List[Dict]):
+        self.modules = modules
+        self.by_id = {module['id']: module for module in modules}
+        self.by_key = {normalize_module_name(module['name']): module for module in modules}
+        self.grams: Dict[str, Set[str]] = {key: trigrams(key) for key in self.by_key}
+        self.by_gram: Dict[str, List[str]] = {}
+        for key, grams in self.grams.items():
+            for gram in grams:
+                self.by_gram.setdefault(gram, []).append(key)
+
+    def get(self, module_id: int) -> Optional[Dict]:
+        """Get module by id"""
+        return self.by_id.get(module_id)
+
+    def lookup(self, name: str) -> Optional[Dict]:
+        """Get module by exact normalized name"""
+        return self.by_key.get(normalize_module_name(name))
+
+    def suggest(self, name: str, limit: int = 3) -> List[Tuple[Dict, float, int]]:
+        """Get (module, similarity, edit distance) of the closest names, best first"""
+        key = normalize_module_name(name)
+        if not key:
+            return []
+
+        query_grams = trigrams(key)
+        shared: Dict[str, int] = {}
+        for gram in query_grams:
+            for candidate in self.by_gram.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        # Dice coefficient on trigrams shortlists candidates, edit distance ranks them
+        similar = []
+        for candidate, count in shared.items():
+            similarity = 2 * count / (len(query_grams) + len(self.grams[candidate]))
+            if similarity >= self.MIN_SIMILARITY:
+                similar.append((similarity, candidate))
+        similar.sort(reverse=True)
+
+        scored = [
+            (self.by_key[candidate], similarity, edit_distance(key, candidate))
+            for similarity, candidate in similar[:limit * 3]
+        ]
+        scored.sort(key=lambda item: (item[2], -item[1], item[0]['name']))
+        return scored[:limit]
+
+    def search(self, query: str, limit: int = 20) -> List[Dict]:
+        """Modules matching a typed query: exact name, then name prefixes, then similar names
+
+        An empty query lists the catalog in name order.
+        """
+        key = normalize_module_name(query)
+        if not key:
+            return self.modules[:limit]
+
+        found = {}
+        exact = self.by_key.get(key)
+        if exact:
+            found[exact['id']] = exact
+        # A linear scan is fine for a catalog of a few dozen modules
+        for candidate in sorted(candidate for candidate in self.by_key if candidate.startswith(key)):
+            found.setdefault(self.by_key[candidate]['id'], self.by_key[candidate])
+        for module, _, _ in self.suggest(query, limit):
+            found.setdefault(module['id'], module)
+        return list(found.values())[:limit]
+
+    def resolve(self, name: str, limit: int = 3) -> Tuple[Optional[Dict], List[Dict]]:
+        """Resolve a typed name to (module, []) or (None, suggestions)
+
+        Exact normalized matches win; a single candidate one edit away is accepted
+        as a typo, anything less certain is returned as suggestions.
+        """
+        module = self.lookup(name)
+        if module:
+            return module, []
+
+        candidates = self.suggest(name, limit)
+        if candidates and candidates[0][2] <= 1 and (len(candidates) == 1 or candidates[1][2] > 1):
+            return candidates[0][0], []
+        return None, [module for module, _, _ in candidates]
+
+class ModuleCatalog:
+    """In-memory module catalog with keyboards precomputed per catalog version"""
+
+    def __init__(self, per_page_options: Tuple[int, ...] = (8,)):
+        self.per_page_options = per_page_options
+        self.index = ModuleIndex([])
+        self.version = 0
+        self._signature: Tuple = ()
+        self._keyboards: Dict[Tuple[int, int], InlineKeyboardMarkup] = {}
+        self._loaded_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None  # Created on first use, inside the running loop
+        self.stale = False  # Last reload failed, modules are from an earlier load
+
+    @property
+    def modules(self) -> List[Dict]:
+        return self.index.modules
+
+    async def load(self) -> bool:
+        """Reload modules from the database, bumping the version if anything changed"""
+        modules = await db.get_modules()
+        self._loaded_at = time.monotonic()
+        self.stale = False
+        signature = tuple((m['id'], m['name'], m['points']) for m in modules)
+        if signature == self._signature:
+            return False
+
+        self._signature = signature
+        self.index = ModuleIndex(modules)
+        self.version += 1
+        self._keyboards = {
+            (page, per_page): create_modules_keyboard(modules, page, per_page, self.version)
+            for per_page in self.per_page_options
+            for page in range(self.total_pages(per_page))
+        }
+        logger.info(f"Module catalog v{self.version} loaded: {len(modules)} modules")
+        return True
+
+    async def ensure_fresh(self):
+        """Reload the catalog if it is older than the refresh interval
+
+        If the reload fails, the modules already loaded are kept and marked stale.
+        """
+        if time.monotonic() - self._loaded_at < CATALOG_REFRESH_INTERVAL:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if time.monotonic() - self._loaded_at >= CATALOG_REFRESH_INTERVAL:
+                try:
+                    await self.load()
+                except Exception as e:
+                    if not self.modules:
+                        raise
+                    # Retried after the next interval rather than by every waiting request
+                    self._loaded_at = time.monotonic()
+                    self.stale = True
+                    logger.warning(f"Module catalog reload failed, serving v{self.version}: {e}")
+
+    def invalidate(self):
+        """Force a reload on next access, e.g. after modules were edited"""
+        self._loaded_at = 0.0
+
+    def total_pages(self, per_page: int = 8) -> int:
+        return max(1, math.ceil(len(self.modules) / per_page))
+
+    def keyboard(self, page: int = 0, per_page: int = 8) -> InlineKeyboardMarkup:
+        """Get the keyboard of a page, clamped to the available pages"""
+        page = max(0, min(page, self.total_pages(per_page) - 1))
+        key = (page, per_page)
+        keyboard = self._keyboards.get(key)
+        if keyboard is None:
+            keyboard = create_modules_keyboard(self.modules, page, per_page, self.version)
+            self._keyboards[key] = keyboard
+        return keyboard
+
+# Global module catalog instance
+catalog = ModuleCatalog()
@@ -0,0 +1,144 @@
+import calendar
+from datetime import date
+from io import BytesIO
+from typing import Dict, List, Tuple
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from utils import format_points, format_tenths, shift_month, MonthNames, POINTS_SCALE
+
+# Renderers use the object-oriented Figure API (no pyplot state) so they can run in worker threads.
+# They take points as integer tenths and only scale them to points for plotting.
+
+WEEKDAY_LABELS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+def _to_png(fig: Figure) -> BytesIO:
+    """Save figure to PNG buffer"""
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', dpi=150, bbox_inches='tight')
+    buffer.seek(0)
+    return buffer
+
+def render_month_bars(daily_stats: Dict[int, int], year: int, month: int) -> BytesIO:
+    """Render daily points bar chart for one month from {day: tenths}"""
+    fig = Figure(figsize=(12, 6), facecolor='white')
+    ax = fig.subplots()
+    ax.set_facecolor('white')
+
+    # Prepare data
+    days_in_month = calendar.monthrange(year, month)[1]
+    days = list(range(1, days_in_month + 1))
+    tenths = [daily_stats.get(day, 0) for day in days]
+    points = [value / POINTS_SCALE for value in tenths]
+
+    # Create bar chart
+    bars = ax.bar(days, points, color='#4CAF50', alpha=0.8, edgecolor='#2E7D32', linewidth=1)
+
+    # Customize appearance
+    ax.set_xlabel('День месяца', fontsize=12)
+    ax.set_ylabel('Баллы', fontsize=12)
+    ax.set_title(f'График выполнения модулей - {MonthNames.get_full_month_name(month)} {year}',
+                 fontsize=14, fontweight='bold')
+    ax.set_xticks(range(1, days_in_month + 1, max(1, days_in_month // 10)))
+    ax.set_xlim(0.5, days_in_month + 0.5)
+    ax.grid(True, axis='y', alpha=0.3)
+    ax.set_axisbelow(True)
+
+    # Add value labels on bars (only for non-zero values)
+    for bar, value in zip(bars, tenths):
+        if value > 0:
+            ax.text(bar.get_x() + bar.get_width() / 2., bar.get_height() + 0.5,
+                    f'{format_tenths(value)}', ha='center', va='bottom', fontsize=8)
+
+    # Add statistics
+    total_tenths = sum(tenths)
+    active_days = len([value for value in tenths if value > 0])
+    avg_points = total_tenths / POINTS_SCALE / active_days if active_days > 0 else 0
+
+    stats_text = f'Всего баллов: {format_tenths(total_tenths)} | Активных дней: {active_days} | Среднее: {format_points(avg_points)}'
+    ax.text(0.02, 0.98, stats_text, transform=ax.transAxes,
+            verticalalignment='top', bbox=dict(boxstyle='round', facecolor='lightblue', alpha=0.8))
+
+    fig.tight_layout()
+    return _to_png(fig)
+
+def build_year_grid(year: int, daily_points: List[Tuple[date, int]]) -> np.ndarray:
+    """Build a dense weekday x week grid of daily points from (date, tenths), NaN outside the year"""
+    start = date(year, 1, 1)
+    n_days = 366 if calendar.isleap(year) else 365
+    offset = start.weekday()
+    n_weeks = -(-(offset + n_days) // 7)
+
+    values = np.zeros(n_days)
+    if daily_points:
+        index = np.fromiter(((d - start).days for d, _ in daily_points), dtype=np.int64, count=len(daily_points))
+        points = np.fromiter((p for _, p in daily_points), dtype=np.float64, count=len(daily_points))
+        np.add.at(values, index, points / POINTS_SCALE)
+
+    grid = np.full(n_weeks * 7, np.nan)
+    grid[offset:offset + n_days] = values
+    return grid.reshape(n_weeks, 7).T
+
+def render_year_heatmap(grid: np.ndarray, year: int) -> BytesIO:
+    """Render year-at-a-glance activity heatmap"""
+    fig = Figure(figsize=(14, 3.6), facecolor='white')
+    ax = fig.subplots()
+
+    masked = np.ma.masked_invalid(grid)
+    vmax = float(masked.max()) if masked.count() and masked.max() > 0 else 1.0
+    image = ax.imshow(masked, cmap='Greens', aspect='equal', vmin=0, vmax=vmax, interpolation='nearest')
+
+    # Month labels at the week of each month's first day
+    offset = date(year, 1, 1).weekday()
+    month_weeks = [(offset + date(year, m, 1).timetuple().tm_yday - 1) // 7 for m in range(1, 13)]
+    ax.set_xticks(month_weeks)
+    ax.set_xticklabels([MonthNames.get_full_month_name(m)[:3] for m in range(1, 13)], fontsize=9)
+    ax.set_yticks(range(7))
+    ax.set_yticklabels(WEEKDAY_LABELS, fontsize=8)
+    ax.tick_params(length=0)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+
+    values = np.nan_to_num(grid)
+    total_points = float(values.sum())
+    active_days = int((values > 0).sum())
+    ax.set_title(f'Активность за {year} год — {format_points(total_points)} баллов, '
+                 f'активных дней: {active_days}', fontsize=12, fontweight='bold')
+    fig.colorbar(image, ax=ax, fraction=0.015, pad=0.01)
+
+    fig.tight_layout()
+    return _to_png(fig)
+
+def render_points_trend(monthly_points: Dict[Tuple[int, int], int], end_year: int, end_month: int,
+                        months: int = 12) -> BytesIO:
+    """Render monthly points trend ({(year, month): tenths}) for the last N months ending with the given one"""
+    keys = [shift_month(end_year, end_month, offset) for offset in range(-(months - 1), 1)]
+    values = np.array([monthly_points.get(key, 0) / POINTS_SCALE for key in keys])
+    labels = [f"{MonthNames.get_full_month_name(m)[:3]} {y % 100:02d}" for y, m in keys]
+    positions = np.arange(len(keys))
+
+    fig = Figure(figsize=(12, 6), facecolor='white')
+    ax = fig.subplots()
+    ax.bar(positions, values, color='#90CAF9', edgecolor='#1565C0', linewidth=1, alpha=0.8)
+    ax.plot(positions, values, color='#1565C0', marker='o', linewidth=2)
+
+    # Moving average over three months to show the direction
+    if len(values) >= 3:
+        window = np.convolve(values, np.ones(3) / 3, mode='valid')
+        ax.plot(positions[2:], window, color='#FF7043', linestyle='--', linewidth=1.5, label='Среднее за 3 мес.')
+        ax.legend(loc='upper left')
+
+    for position, value in zip(positions, values):
+        if value > 0:
+            ax.text(position, value, format_points(value), ha='center', va='bottom', fontsize=8)
+
+    ax.set_xticks(positions)
+    ax.set_xticklabels(labels, rotation=45, ha='right')
+    ax.set_ylabel('Баллы', fontsize=12)
+    ax.set_title(f'Баллы по месяцам за последние {months} мес.', fontsize=14, fontweight='bold')
+    ax.grid(True, axis='y', alpha=0.3)
+    ax.set_axisbelow(True)
+
+    fig.tight_layout()
+    return _to_png(fig)
@@ -0,0 +1,58 @@
+import logging
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """Fail fast after repeated failures, probing again after a cool-down
+
+    Closed: calls pass, consecutive failures are counted. Open: calls are
+    refused until reset_timeout passes. Half-open: one probe call passes;
+    its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.open = False
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now"""
+        if not self.open:
+            return True
+        now = time.monotonic()
+        # A probe that never reported back (cancelled) does not block the next one forever
+        if now - self.opened_at >= self.reset_timeout and now - self.probe_started >= self.reset_timeout:
+            self.probe_started = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.open:
+            logger.info(f"Circuit {self.name} closed")
+        self.open = False
+        self.failures = 0
+        self.probe_started = 0.0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.open or self.failures >= self.failure_threshold:
+            if not self.open:
+                logger.error(f"Circuit {self.name} opened after {self.failures} failures")
+            self.open = True
+            self.opened_at = time.monotonic()
+            self.probe_started = 0.0
+
+    def stats(self) -> Dict:
+        return {
+            'state': ('half-open' if self.probe_started else 'open') if self.open else 'closed',
+            'failures': self.failures,
+            'rejected': self.rejected,
+        }
@@ -1,4 +1,5 @@
 import os
+from datetime import time
 from dotenv import load_dotenv
 import pytz
 
@@ -27,3 +28,98 @@ DEFAULT_MODULES = [
     ("Теория", 8.0),
     ("Дополнительный модуль", 12.5),
 ]
+
+# Log partitioning and archival
+LOGS_RETENTION_MONTHS = int(os.getenv("LOGS_RETENTION_MONTHS", "6"))  # Months kept as raw logs
+LOGS_PARTITIONS_AHEAD = 2  # Future monthly partitions created in advance
+ARCHIVE_DROP_PARTITIONS = os.getenv("ARCHIVE_DROP_PARTITIONS", "true").lower() == "true"
+
+# Exports
+EXPORT_SPOOL_MAX_SIZE = 8 * 1024 * 1024  # Bytes kept in memory before spilling to disk
+
+# Cohort insights
+COHORT_CACHE_TTL = 600  # Seconds a month's cohort distribution is reused
+
+# Leaderboards
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_REFRESH_INTERVAL = 300  # Seconds between snapshot refreshes
+
+# Module catalog
+CATALOG_REFRESH_INTERVAL = 60  # Seconds between module catalog reloads
+
+# Reminders
+REMINDER_WINDOW_START = time(18, 0)  # Default reminders are spread across this window
+REMINDER_WINDOW_END = time(20, 0)
+REMINDER_BATCH_SIZE = 25  # Due reminders popped from the heap at once
+REMINDER_AUDIENCE_BUILD_AT = time(17, 55)  # Audience is selected shortly before the first reminders
+REMINDER_ACTIVE_DAYS = 30  # Only users active within this many days are reminded
+
+# Per-user month stats cache
+USER_STATS_CACHE_SIZE = 2048  # (user, month) entries
+USER_STATS_CACHE_TTL = 900  # Seconds; writes patch entries, so this only bounds drift
+
+# Database pool and update processing
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+QUEUE_DELAY_WARNING = 2.0  # Seconds an update may wait for its turn before a warning is logged
+
+# Duplicate callback suppression
+IDEMPOTENCY_TTL = 3600  # Seconds a processed callback or tapped message is remembered
+IDEMPOTENCY_MAX_KEYS = 20000
+
+# Completion history
+HISTORY_PAGE_SIZE = 8
+UNDO_MAX_COUNT = 20  # Most completions /undo removes at once
+
+# Schema migrations
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "true").lower() == "true"  # Apply pending migrations on boot
+
+# Sampling profiler (/admin_profile)
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+PROFILE_MAX_SECONDS = 120
+
+# Update capture for replay (opt-in)
+CAPTURE_UPDATES_PATH = os.getenv("CAPTURE_UPDATES_PATH")  # e.g. captures/updates.jsonl.gz, unset = off
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "")  # Keyed hashing of user and chat ids, required for capture
+CAPTURE_QUEUE_SIZE = 10000  # Updates waiting for the capture writer thread before new ones are dropped
+REPLAY_DATABASE_URL = os.getenv("REPLAY_DATABASE_URL")  # Scratch database for replay.py, never DATABASE_URL
+
+# Read replica for analytic queries (optional)
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+REPLICA_MAX_LAG = 30  # Seconds of replication lag tolerated before reads fall back to the primary
+REPLICA_CHECK_INTERVAL = 15  # Seconds between replica lag checks
+
+# Logging (written by a background thread, see logging_setup.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text or json (one object per line)
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")  # Empty = stdout only
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # Size-based rotation
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN")  # e.g. midnight: time-based rotation instead of size
+LOG_QUEUE_SIZE = 10000  # Records buffered for the writer thread; more are dropped and counted
+SLOW_UPDATE_WARNING = 1.0  # Seconds of handling after which an update is logged as slow
+
+# Outbound Bot API pacing (ratelimit.py), kept below Telegram's flood limits
+TELEGRAM_GLOBAL_RATE = 25  # API calls per second for the whole bot
+TELEGRAM_CHAT_RATE = 1.0  # Messages per second to one private chat
+TELEGRAM_GROUP_RATE = 20 / 60  # Messages per second to one group
+TELEGRAM_CHAT_BURST = 3  # Messages a chat may receive at once before pacing starts
+TELEGRAM_RETRY_ATTEMPTS = 3  # Resends after RetryAfter before the error reaches the caller
+TELEGRAM_MAX_RETRY_AFTER = 60  # Longer flood waits are not waited out
+
+# Database deadlines and failure handling
+DB_ACQUIRE_TIMEOUT = 5  # Seconds to wait for a pool connection
+DB_COMMAND_TIMEOUT = 10  # Seconds per statement
+DB_MAINTENANCE_TIMEOUT = 600  # Seconds per statement of archiving, partitioning, imports and exports
+DB_BREAKER_FAILURES = 5  # Consecutive connection failures or timeouts that open the circuit
+DB_BREAKER_RESET = 30  # Seconds before a request probes a failed database again
+WRITE_RETRY_QUEUE_SIZE = 1000  # Completions held in memory while the database is unavailable
+WRITE_RETRY_PATH = os.getenv("WRITE_RETRY_PATH", "pending_writes.jsonl")  # Queued completions kept across restarts
+WRITE_RETRY_INTERVAL = 10  # Seconds between retries of queued completions
+
+# Group leaderboards
+CHAT_LEADERBOARD_TTL = 60  # Seconds a group ranking is reused before it is queried again
+
+# Inline mode (@bot <module>)
+INLINE_CACHE_TIME = 300  # Seconds Telegram may reuse an answer for the same query, for all users
+INLINE_RESULTS_LIMIT = 20
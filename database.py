@@ -1,197 +1,1008 @@
+import asyncio
 import asyncpg
+import json
 import logging
-from typing import List, Dict, Optional, Tuple
-from datetime import datetime, date
-from config import DATABASE_URL, DEFAULT_MODULES
+import os
+import re
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import (
+    List, Dict, Optional, Tuple, Set, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Deque,
+    TypeVar, Union
+)
+from datetime import datetime, date, time
+from config import (
+    DATABASE_URL, TIMEZONE, POINTS_TO_MONEY_RATE,
+    LOGS_RETENTION_MONTHS, LOGS_PARTITIONS_AHEAD, ARCHIVE_DROP_PARTITIONS,
+    USER_STATS_CACHE_SIZE, USER_STATS_CACHE_TTL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, AUTO_MIGRATE,
+    DATABASE_REPLICA_URL, REPLICA_MAX_LAG, DB_ACQUIRE_TIMEOUT, DB_COMMAND_TIMEOUT, DB_MAINTENANCE_TIMEOUT,
+    DB_BREAKER_FAILURES, DB_BREAKER_RESET, WRITE_RETRY_QUEUE_SIZE, WRITE_RETRY_PATH
+)
+from utils import shift_month, month_bounds
+from cache import TTLCache
+from circuit import CircuitBreaker
+from migrations import LATEST_VERSION, current_version, migrate
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
+PARTITION_NAME_RE = re.compile(r"^user_module_logs_y(\d{4})m(\d{2})$")
+
+class DatabaseUnavailable(Exception):
+    """Raised instead of waiting when the database is known to be down"""
+
+# Errors that say nothing about the query, only that the database did not answer in time
+TRANSIENT_ERRORS = (
+    DatabaseUnavailable, OSError, asyncio.TimeoutError, asyncpg.InterfaceError,
+    asyncpg.PostgresConnectionError, asyncpg.QueryCanceledError, asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError
+)
+
+# Statement deadlines; on a long maintenance or import statement they say nothing about the database's health
+STATEMENT_TIMEOUTS = (asyncio.TimeoutError, asyncpg.QueryCanceledError)
+
+def partition_name(year: int, month: int) -> str:
+    """Name of the monthly partition of user_module_logs"""
+    return f"user_module_logs_y{year}m{month:02d}"
+
+async def create_partition(conn, year: int, month: int):
+    """Create the partition for a month, moving matching rows out of the default partition"""
+    name = partition_name(year, month)
+    if await conn.fetchval("SELECT to_regclass($1)", name):
+        return
+    
+    start, end = month_bounds(year, month)
+    async with conn.transaction():
+        await conn.execute(f"CREATE TABLE {name} (LIKE user_module_logs INCLUDING DEFAULTS)")
+        # The default partition may hold a whole month of rows by now
+        await conn.execute(f"""
+            WITH moved AS (
+                DELETE FROM user_module_logs_default
+                WHERE date >= $1 AND date < $2
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """, start, end, timeout=DB_MAINTENANCE_TIMEOUT)
+        await conn.execute(
+            f"ALTER TABLE user_module_logs ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')",
+            timeout=DB_MAINTENANCE_TIMEOUT
+        )
+    logger.info(f"Created partition {name}")
+
 class Database:
     def __init__(self):
         self.pool = None
+        self.dsn = DATABASE_URL
+        # Optional hot standby for reads that tolerate replication lag (allow_stale=True)
+        self.replica_pool = None
+        # Only database work is bounded by the pool size, other handlers run freely.
+        # Created in init(): on Python 3.9 asyncio primitives bind to the loop current at creation
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.replica_slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.replica_lag: Optional[float] = None
+        self.archived_months: Set[Tuple[int, int]] = set()
+        # (user_id, year, month) -> {'points': tenths, 'completions': int, 'daily': {day: tenths}}
+        self.user_stats = TTLCache(maxsize=USER_STATS_CACHE_SIZE, ttl=USER_STATS_CACHE_TTL)
+        self._stats_writes: Dict[int, int] = {}
+        # Users with a write between its statement and the cache patch; their reads are not cached
+        self._stats_writing: Dict[int, int] = {}
+        self.breaker = CircuitBreaker("database", DB_BREAKER_FAILURES, DB_BREAKER_RESET)
+        # (user_id, module_id, date, request_id, chat_id) of completions waiting for the database to recover
+        self.pending_writes: Deque[Tuple[int, int, date, str, Optional[int]]] = deque()
+        # Mirror of pending_writes on disk, so queued completions survive a restart
+        self.pending_path: Optional[str] = None
+        self._pending_lock: Optional[asyncio.Lock] = None
     
-    async def init(self):
-        """Initialize database connection pool"""
+    async def init(self, dsn: Optional[str] = DATABASE_URL, replica_dsn: Optional[str] = DATABASE_REPLICA_URL,
+                   pending_path: Optional[str] = WRITE_RETRY_PATH):
+        """Initialize database connection pool (replay.py points it at a scratch database)"""
+        self.dsn = dsn
+        self.slots = asyncio.Semaphore(DB_POOL_MAX_SIZE)
+        self.replica_slots = asyncio.Semaphore(DB_POOL_MAX_SIZE)
+        self._pending_lock = asyncio.Lock()
+        self.pending_path = pending_path
+        self.load_pending_writes()
         try:
-            self.pool = await asyncpg.create_pool(DATABASE_URL)
-            await self.create_tables()
-            await self.populate_default_modules()
+            self.pool = await asyncpg.create_pool(
+                dsn, min_size=min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE), max_size=DB_POOL_MAX_SIZE,
+                command_timeout=DB_COMMAND_TIMEOUT
+            )
+            await self.check_schema()
+            await self.load_archived_months()
             logger.info("Database initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize database: {e}")
             raise
+        
+        if replica_dsn:
+            try:
+                self.replica_pool = await asyncpg.create_pool(
+                    replica_dsn, min_size=min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE), max_size=DB_POOL_MAX_SIZE,
+                    command_timeout=DB_COMMAND_TIMEOUT
+                )
+                await self.check_replica_lag()
+                logger.info(f"Read replica connected, lag {self.replica_lag}s")
+            except Exception as e:
+                # Reads stay on the primary, the bot works without the replica
+                logger.error(f"Failed to connect to read replica: {e}")
+                self.replica_pool = None
+    
+    async def check_schema(self):
+        """Check the schema version with one query, migrating only if it is behind"""
+        async with self.acquire() as conn:
+            version = await current_version(conn)
+            if version == LATEST_VERSION:
+                return
+            if version > LATEST_VERSION:
+                logger.warning(f"Database schema v{version} is newer than this code (v{LATEST_VERSION})")
+                return
+            if not AUTO_MIGRATE:
+                raise RuntimeError(
+                    f"Database schema is at v{version}, v{LATEST_VERSION} required: run python migrate.py"
+                )
+        
+        # Own connection without the pool's statement deadline: index builds may take minutes
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            applied = await migrate(conn)
+        finally:
+            await conn.close()
+        logger.info(f"Database schema migrated to v{LATEST_VERSION}, applied: {applied}")
     
     async def close(self):
         """Close database connection pool"""
+        if self.pending_writes:
+            if self.pending_path:
+                logger.warning(f"{len(self.pending_writes)} queued completions left in {self.pending_path} for the next start")
+            else:
+                logger.error(f"{len(self.pending_writes)} queued completions were never written")
         if self.pool:
             await self.pool.close()
+        if self.replica_pool:
+            await self.replica_pool.close()
     
-    async def create_tables(self):
-        """Create all necessary tables"""
-        async with self.pool.acquire() as conn:
-            # Modules table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS modules (
-                    id SERIAL PRIMARY KEY,
-                    name TEXT UNIQUE NOT NULL,
-                    points NUMERIC NOT NULL
-                )
-            """)
-            
-            # User module logs table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_module_logs (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    module_id INT NOT NULL REFERENCES modules(id),
-                    date DATE NOT NULL DEFAULT CURRENT_DATE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Admins table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS admins (
-                    user_id BIGINT PRIMARY KEY
-                )
-            """)
-            
-            # Monthly summary table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS monthly_summary (
-                    user_id BIGINT,
-                    year INT,
-                    month INT,
-                    total_points NUMERIC,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(user_id, year, month)
-                )
+    async def check_replica_lag(self) -> Optional[float]:
+        """Measure replica lag in seconds; None marks the replica unusable"""
+        if self.replica_pool is None:
+            return None
+        try:
+            async with self.replica_pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+                # An idle primary sends no WAL, so a fully replayed standby counts as current,
+                # but only while it streams: a disconnected one has replayed all it received too.
+                # The receiver status needs pg_read_all_stats (pg_monitor) on the replica role.
+                self.replica_lag = await conn.fetchval("""
+                    SELECT CASE
+                        WHEN NOT pg_is_in_recovery() THEN 0
+                        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                    END::FLOAT8
+                """, timeout=5)
+        except Exception as e:
+            logger.warning(f"Read replica check failed: {e}")
+            self.replica_lag = None
+        return self.replica_lag
+    
+    @asynccontextmanager
+    async def acquire(self, pool=None, maintenance: bool = False):
+        """Connection from a pool (the primary by default) with a deadline, guarded by the circuit breaker
+        
+        Callers beyond the pool size wait for a slot without a deadline, so
+        load alone never times out; the deadline then only catches a pool
+        that cannot hand out connections. Statements get the pool's command
+        timeout. Failures to reach the primary open the breaker, after which
+        calls fail at once with DatabaseUnavailable instead of queueing
+        behind a stalled pool. With maintenance=True (imports, partitioning,
+        archiving, exports) a statement running past its own deadline is not
+        counted as a failure of the database.
+        """
+        pool = pool or self.pool
+        guarded = pool is self.pool
+        if guarded and not self.breaker.allow():
+            raise DatabaseUnavailable("Database circuit is open")
+        # Let through while open: this call is the breaker's probe
+        probe = guarded and self.breaker.open
+        slots = self.slots if guarded else self.replica_slots
+        self.waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            self.waiting -= 1
+        # The breaker may have opened while this caller was queued behind a stalled pool
+        if guarded and not probe and self.breaker.open and not self.breaker.allow():
+            slots.release()
+            raise DatabaseUnavailable("Database circuit is open")
+        connected = False
+        try:
+            async with pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+                connected = True
+                yield conn
+        except TRANSIENT_ERRORS as e:
+            if guarded and not (maintenance and connected and isinstance(e, STATEMENT_TIMEOUTS)):
+                self.breaker.record_failure()
+            raise
+        except Exception:
+            # The database answered, the query was wrong
+            if guarded:
+                self.breaker.record_success()
+            raise
+        else:
+            if guarded:
+                self.breaker.record_success()
+        finally:
+            slots.release()
+    
+    def _read_pool(self, allow_stale: bool):
+        """Pool for a read: the replica if the caller tolerates lag and the replica is current enough
+        
+        Reads that must see the caller's own writes (points after /add, undo,
+        anything that fills the stats cache) pass allow_stale=False.
+        """
+        if (allow_stale and self.replica_pool is not None
+                and self.replica_lag is not None and self.replica_lag <= REPLICA_MAX_LAG):
+            return self.replica_pool
+        return self.pool
+    
+    def _replica_failed(self, error: BaseException):
+        """Send reads to the primary until the replica monitor finds the replica current again"""
+        logger.warning(f"Read replica failed, reading from the primary: {error!r}")
+        self.replica_lag = None
+    
+    def _falls_back(self, error: BaseException, maintenance: bool) -> bool:
+        """Whether a replica read failing with this error is retried on the primary"""
+        # A long export that ran out of time on the replica would only do the same on the primary
+        if maintenance and isinstance(error, STATEMENT_TIMEOUTS):
+            return False
+        self._replica_failed(error)
+        return True
+    
+    async def _read(self, allow_stale: bool, read: Callable[[asyncpg.Connection], Awaitable[T]],
+                    maintenance: bool = False) -> T:
+        """Run a read on the pool picked by _read_pool, once more on the primary if the replica fails"""
+        pool = self._read_pool(allow_stale)
+        if pool is not self.pool:
+            try:
+                async with self.acquire(pool, maintenance=maintenance) as conn:
+                    return await read(conn)
+            except TRANSIENT_ERRORS as e:
+                if not self._falls_back(e, maintenance):
+                    raise
+        async with self.acquire(maintenance=maintenance) as conn:
+            return await read(conn)
+    
+    async def _read_fetch(self, allow_stale: bool, query: str, *args) -> List[asyncpg.Record]:
+        """conn.fetch through _read"""
+        return await self._read(allow_stale, lambda conn: conn.fetch(query, *args))
+    
+    async def _read_stream(self, allow_stale: bool, stream: Callable[[object], AsyncIterator[T]],
+                           maintenance: bool = False) -> AsyncIterator[T]:
+        """Like _read for a stream taking a pool; it moves to the primary only if nothing was yielded yet"""
+        pool = self._read_pool(allow_stale)
+        if pool is not self.pool:
+            started = False
+            try:
+                async for item in stream(pool):
+                    started = True
+                    yield item
+                return
+            except TRANSIENT_ERRORS as e:
+                if started or not self._falls_back(e, maintenance):
+                    raise
+        async for item in stream(self.pool):
+            yield item
+    
+    async def ensure_partitions(self, months_ahead: int = LOGS_PARTITIONS_AHEAD):
+        """Create partitions for the current month and the next few months"""
+        now = datetime.now(TIMEZONE)
+        async with self.acquire(maintenance=True) as conn:
+            for offset in range(months_ahead + 1):
+                year, month = shift_month(now.year, now.month, offset)
+                await create_partition(conn, year, month)
+    
+    async def ensure_partition(self, year: int, month: int):
+        """Create the partition for a specific month if it is missing"""
+        async with self.acquire(maintenance=True) as conn:
+            await create_partition(conn, year, month)
+    
+    async def load_archived_months(self):
+        """Load the set of months that are served from the summaries"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch("SELECT year, month FROM log_archive")
+            self.archived_months = {(row['year'], row['month']) for row in rows}
+    
+    def is_archived(self, year: int, month: int) -> bool:
+        """Check if month's raw logs were compacted into the summaries"""
+        return (year, month) in self.archived_months
+    
+    async def archive_old_partitions(self, retention_months: int = LOGS_RETENTION_MONTHS) -> List[Tuple[int, int]]:
+        """Compact partitions older than the retention window into the summaries"""
+        now = datetime.now(TIMEZONE)
+        cutoff = shift_month(now.year, now.month, -retention_months)
+        archived = []
+        
+        async with self.acquire(maintenance=True) as conn:
+            rows = await conn.fetch("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'user_module_logs'::regclass
             """)
+            months = []
+            for row in rows:
+                match = PARTITION_NAME_RE.match(row['relname'])
+                if match:
+                    months.append((int(match.group(1)), int(match.group(2))))
             
-            # Create indexes for better performance
+            for year, month in sorted(months):
+                if (year, month) >= cutoff:
+                    continue
+                await self._archive_partition(conn, year, month)
+                archived.append((year, month))
+        
+        if archived:
+            await self.load_archived_months()
+            logger.info(f"Archived {len(archived)} log partitions: {archived}")
+        return archived
+    
+    async def _archive_partition(self, conn, year: int, month: int):
+        """Roll one monthly partition up into daily and monthly summaries, then detach it"""
+        name = partition_name(year, month)
+        start, end = month_bounds(year, month)
+        
+        async with conn.transaction():
+            await conn.execute(f"""
+                INSERT INTO user_daily_summary (user_id, date, points_tenths, completions)
+                SELECT user_id, date, SUM(points_tenths), COUNT(*)
+                FROM {name}
+                GROUP BY user_id, date
+                ON CONFLICT (user_id, date) DO UPDATE SET
+                    points_tenths = user_daily_summary.points_tenths + EXCLUDED.points_tenths,
+                    completions = user_daily_summary.completions + EXCLUDED.completions
+            """, timeout=DB_MAINTENANCE_TIMEOUT)
+            await conn.execute(f"""
+                INSERT INTO chat_daily_summary (chat_id, user_id, date, points_tenths, completions)
+                SELECT chat_id, user_id, date, SUM(points_tenths), COUNT(*)
+                FROM {name}
+                WHERE chat_id IS NOT NULL
+                GROUP BY chat_id, user_id, date
+                ON CONFLICT (chat_id, date, user_id) DO UPDATE SET
+                    points_tenths = chat_daily_summary.points_tenths + EXCLUDED.points_tenths,
+                    completions = chat_daily_summary.completions + EXCLUDED.completions
+            """, timeout=DB_MAINTENANCE_TIMEOUT)
             await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_user_module_logs_user_date 
-                ON user_module_logs(user_id, date)
-            """)
-            
+                INSERT INTO monthly_summary (user_id, year, month, total_points_tenths, completions, archived)
+                SELECT user_id, $1, $2, SUM(points_tenths), SUM(completions), TRUE
+                FROM user_daily_summary
+                WHERE date >= $3 AND date < $4
+                GROUP BY user_id
+                ON CONFLICT (user_id, year, month) DO UPDATE SET
+                    total_points_tenths = EXCLUDED.total_points_tenths,
+                    completions = EXCLUDED.completions,
+                    archived = TRUE
+            """, year, month, start, end, timeout=DB_MAINTENANCE_TIMEOUT)
             await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_monthly_summary_user_year_month 
-                ON monthly_summary(user_id, year, month)
-            """)
-    
-    async def populate_default_modules(self):
-        """Populate database with default modules if empty"""
-        async with self.pool.acquire() as conn:
-            count = await conn.fetchval("SELECT COUNT(*) FROM modules")
-            if count == 0:
-                for name, points in DEFAULT_MODULES:
-                    await conn.execute(
-                        "INSERT INTO modules (name, points) VALUES ($1, $2)",
-                        name, points
-                    )
-                logger.info("Default modules populated")
+                INSERT INTO log_archive (year, month) VALUES ($1, $2)
+                ON CONFLICT (year, month) DO UPDATE SET archived_at = CURRENT_TIMESTAMP
+            """, year, month)
+            await conn.execute(f"ALTER TABLE user_module_logs DETACH PARTITION {name}")
+            if ARCHIVE_DROP_PARTITIONS:
+                await conn.execute(f"DROP TABLE {name}")
+            else:
+                await conn.execute(f"DROP TABLE IF EXISTS archived_{name}")
+                await conn.execute(f"ALTER TABLE {name} RENAME TO archived_{name}")
     
     async def get_modules(self) -> List[Dict]:
         """Get all available modules"""
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch("SELECT id, name, points FROM modules ORDER BY name")
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT id, name, points, ROUND(points * 10)::INT AS points_tenths
+                FROM modules ORDER BY name
+            """)
             return [dict(row) for row in rows]
     
     async def get_module_by_name(self, name: str) -> Optional[Dict]:
         """Get module by name"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT id, name, points FROM modules WHERE LOWER(name) = LOWER($1)",
+                "SELECT id, name, points, ROUND(points * 10)::INT AS points_tenths "
+                "FROM modules WHERE LOWER(name) = LOWER($1)",
                 name
             )
             return dict(row) if row else None
     
-    async def add_module_completion(self, user_id: int, module_id: int, date_completed: date = None):
-        """Add a module completion for a user"""
+    async def add_module_completion(self, user_id: int, module_id: int, date_completed: date = None,
+                                    request_id: Optional[str] = None, chat_id: Optional[int] = None) -> bool:
+        """Add a module completion for a user, attributed to the chat it was logged in
+        
+        With a request_id, repeating the same request on the same day is a no-op.
+        Returns whether a row was inserted.
+        """
         if date_completed is None:
-            date_completed = date.today()
+            date_completed = datetime.now(TIMEZONE).date()
         
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO user_module_logs (user_id, module_id, date) VALUES ($1, $2, $3)",
-                user_id, module_id, date_completed
-            )
+        with self._writing_stats(user_id):
+            async with self.acquire() as conn:
+                points_tenths = await conn.fetchval("""
+                    INSERT INTO user_module_logs (user_id, module_id, date, points_tenths, request_id, chat_id)
+                    SELECT $1, id, $3, ROUND(points * 10)::INT, $4, $5 FROM modules WHERE id = $2
+                    ON CONFLICT (request_id, date) DO NOTHING
+                    RETURNING points_tenths
+                """, user_id, module_id, date_completed, request_id, chat_id)
+            
+            if points_tenths is None:
+                return False
+            self._patch_user_stats(user_id, date_completed, points_tenths)
+            return True
     
-    async def get_user_points_for_month(self, user_id: int, year: int, month: int) -> float:
-        """Get total points for user in specific month"""
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchval("""
-                SELECT COALESCE(SUM(m.points), 0)
-                FROM user_module_logs uml
-                JOIN modules m ON uml.module_id = m.id
-                WHERE uml.user_id = $1 
-                AND EXTRACT(YEAR FROM uml.date) = $2 
-                AND EXTRACT(MONTH FROM uml.date) = $3
-            """, user_id, year, month)
-            return float(result) if result else 0.0
-    
-    async def get_user_daily_stats(self, user_id: int, year: int, month: int) -> Dict[int, float]:
-        """Get daily points breakdown for user in specific month"""
-        async with self.pool.acquire() as conn:
+    async def record_completion(self, user_id: int, module_id: int, request_id: Optional[str] = None,
+                                chat_id: Optional[int] = None) -> str:
+        """Add a completion for today, queueing it for retry if the database is unavailable
+        
+        Returns 'added', 'duplicate' or 'queued'. Every completion gets a
+        request id, so a retry of a write that did land is a no-op. Raises
+        DatabaseUnavailable when the retry queue is full.
+        """
+        request_id = request_id or f"w:{uuid.uuid4().hex}"
+        day = datetime.now(TIMEZONE).date()
+        try:
+            added = await self.add_module_completion(user_id, module_id, day, request_id, chat_id)
+        except TRANSIENT_ERRORS as e:
+            if len(self.pending_writes) >= WRITE_RETRY_QUEUE_SIZE:
+                raise DatabaseUnavailable("Write retry queue is full") from e
+            entry = (user_id, module_id, day, request_id, chat_id)
+            async with self._pending_lock:
+                self.pending_writes.append(entry)
+                if self.pending_path:
+                    await asyncio.to_thread(self._append_pending_file, entry)
+            logger.warning(f"Completion of user {user_id} queued for retry ({len(self.pending_writes)} pending): {e!r}")
+            return 'queued'
+        return 'added' if added else 'duplicate'
+    
+    async def flush_pending_writes(self) -> int:
+        """Write queued completions in order, stopping at the first transient failure; return count written"""
+        flushed = 0
+        while self.pending_writes:
+            user_id, module_id, day, request_id, chat_id = self.pending_writes[0]
+            try:
+                await self.add_module_completion(user_id, module_id, day, request_id, chat_id)
+            except TRANSIENT_ERRORS:
+                break
+            except Exception as e:
+                logger.error(f"Dropping queued completion {request_id} of user {user_id}: {e}")
+            self.pending_writes.popleft()
+            flushed += 1
+        
+        if flushed and self.pending_path:
+            async with self._pending_lock:
+                await asyncio.to_thread(self._rewrite_pending_file, list(self.pending_writes))
+        return flushed
+    
+    def load_pending_writes(self):
+        """Queue completions a previous run could not write; they are retried by flush_pending_writes"""
+        if not self.pending_path or not os.path.exists(self.pending_path):
+            return
+        with open(self.pending_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    user_id, module_id, day, request_id, chat_id = json.loads(line)
+                    self.pending_writes.append((user_id, module_id, date.fromisoformat(day), request_id, chat_id))
+        if self.pending_writes:
+            logger.warning(f"{len(self.pending_writes)} queued completions loaded from {self.pending_path}")
+    
+    def _append_pending_file(self, entry: Tuple[int, int, date, str, Optional[int]]):
+        """Durably append one queued completion (runs in a worker thread)"""
+        user_id, module_id, day, request_id, chat_id = entry
+        with open(self.pending_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps([user_id, module_id, day.isoformat(), request_id, chat_id]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _rewrite_pending_file(self, entries: List[Tuple[int, int, date, str, Optional[int]]]):
+        """Replace the file with the completions still queued (runs in a worker thread)"""
+        if not entries:
+            if os.path.exists(self.pending_path):
+                os.remove(self.pending_path)
+            return
+        temporary = f"{self.pending_path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            for user_id, module_id, day, request_id, chat_id in entries:
+                f.write(json.dumps([user_id, module_id, day.isoformat(), request_id, chat_id]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.pending_path)
+    
+    @contextmanager
+    def _writing_stats(self, user_id: int):
+        """Mark a write of the user's logs in flight until its cache patch is applied
+        
+        A stats read that ends meanwhile may already see the new rows, while
+        the patch would add them once more, so such reads are not cached.
+        """
+        self._stats_writes[user_id] = self._stats_writes.get(user_id, 0) + 1
+        self._stats_writing[user_id] = self._stats_writing.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            self._stats_writing[user_id] -= 1
+            if not self._stats_writing[user_id]:
+                del self._stats_writing[user_id]
+    
+    def _patch_user_stats(self, user_id: int, day: date, delta_tenths: int, delta_completions: int = 1):
+        """Apply logged or removed completions to the cached month stats of a user"""
+        self._patch_user_stats_days(user_id, {day: (delta_tenths, delta_completions)})
+    
+    def _patch_user_stats_days(self, user_id: int, deltas: Dict[date, Tuple[int, int]]):
+        """Apply (points tenths, completions) deltas per day to the cached month stats of a user"""
+        self._stats_writes[user_id] = self._stats_writes.get(user_id, 0) + 1
+        months: Dict[Tuple[int, int], Dict[date, Tuple[int, int]]] = {}
+        for day, delta in deltas.items():
+            months.setdefault((day.year, day.month), {})[day] = delta
+        
+        for (year, month), days in months.items():
+            key = (user_id, year, month)
+            stats = self.user_stats.pop(key)
+            if stats is None:
+                continue
+            
+            daily = dict(stats['daily'])
+            points, completions = stats['points'], stats['completions']
+            for day, (delta_tenths, delta_completions) in days.items():
+                daily[day.day] = daily.get(day.day, 0) + delta_tenths
+                if daily[day.day] <= 0:
+                    del daily[day.day]
+                points += delta_tenths
+                completions += delta_completions
+            self.user_stats.set(key, {'points': points, 'completions': completions, 'daily': daily})
+    
+    def invalidate_user_stats(self, user_id: Optional[int] = None):
+        """Drop cached month stats of one user or of everyone"""
+        if user_id is None:
+            self.user_stats.clear()
+            self._stats_writes.clear()
+            return
+        self._stats_writes[user_id] = self._stats_writes.get(user_id, 0) + 1
+        for key in [key for key in self.user_stats.keys() if key[0] == user_id]:
+            self.user_stats.pop(key)
+    
+    def user_stats_info(self) -> Dict:
+        """Hit ratio counters of the per-user stats cache"""
+        return {
+            'size': len(self.user_stats),
+            'hits': self.user_stats.hits,
+            'misses': self.user_stats.misses,
+            'hit_ratio': self.user_stats.hit_ratio
+        }
+    
+    async def _get_months_stats(self, user_id: int, months: List[Tuple[int, int]],
+                                allow_stale: bool = False) -> Dict[Tuple[int, int], Dict]:
+        """Get {'points': tenths, 'completions', 'daily': {day: tenths}} per (year, month)
+        
+        Cached months are served from memory, the rest are read in one query
+        over live logs and archived daily summaries. Months read from the
+        replica are not cached.
+        """
+        result = {}
+        missing = []
+        for year, month in months:
+            stats = self.user_stats.get((user_id, year, month))
+            if stats is None:
+                missing.append((year, month))
+            else:
+                result[(year, month)] = stats
+        if not missing:
+            return result
+        
+        writes = self._stats_writes.get(user_id, 0)
+        start = month_bounds(*min(missing))[0]
+        end = month_bounds(*max(missing))[1]
+        from_replica = self._read_pool(allow_stale) is not self.pool
+        # Month rows of the rollup carry totals, day rows the breakdown
+        rows = await self._read_fetch(allow_stale, """
+            SELECT
+                date_trunc('month', date)::DATE as month_start,
+                EXTRACT(DAY FROM date)::INT as day,
+                SUM(points_tenths)::BIGINT as points_tenths,
+                SUM(completions)::BIGINT as completions
+            FROM (
+                SELECT date, points_tenths, completions
+                FROM user_daily_summary
+                WHERE user_id = $1 AND date >= $2 AND date < $3
+                UNION ALL
+                SELECT date, points_tenths, 1
+                FROM user_module_logs
+                WHERE user_id = $1 AND date >= $2 AND date < $3
+            ) days
+            GROUP BY ROLLUP (date_trunc('month', date), date)
+            HAVING GROUPING(date_trunc('month', date)) = 0
+        """, user_id, start, end)
+        
+        fetched = {key: {'points': 0, 'completions': 0, 'daily': {}} for key in missing}
+        for row in rows:
+            stats = fetched.get((row['month_start'].year, row['month_start'].month))
+            if stats is None:
+                continue
+            if row['day'] is None:
+                stats['points'] = row['points_tenths']
+                stats['completions'] = row['completions']
+            else:
+                stats['daily'][row['day']] = row['points_tenths']
+        
+        # Skip caching if a write for this user landed while we were reading or is not patched in yet
+        cacheable = (not from_replica and self._stats_writes.get(user_id, 0) == writes
+                     and user_id not in self._stats_writing)
+        for (year, month), stats in fetched.items():
+            if cacheable:
+                self.user_stats.set((user_id, year, month), stats)
+            result[(year, month)] = stats
+        return result
+    
+    async def get_user_month_stats(self, user_id: int, year: int, month: int, allow_stale: bool = False) -> Dict:
+        """Get {'points': tenths, 'completions', 'daily': {day: tenths}} for a user's month, read through the cache"""
+        stats = await self._get_months_stats(user_id, [(year, month)], allow_stale)
+        return stats[(year, month)]
+    
+    async def get_user_summary(self, user_id: int, months: int = 2,
+                               year: int = None, month: int = None, allow_stale: bool = False) -> List[Dict]:
+        """Get points_tenths, completions and daily tenths of the last N months, newest first
+        
+        Months end with the given one (current month by default) and are
+        fetched in a single round trip unless already cached. If the database
+        is unavailable, expired cache entries are served with 'stale': True.
+        """
+        if year is None or month is None:
+            today = datetime.now(TIMEZONE).date()
+            year, month = today.year, today.month
+        
+        keys = [shift_month(year, month, -offset) for offset in range(months)]
+        stale = False
+        try:
+            stats = await self._get_months_stats(user_id, keys, allow_stale)
+        except TRANSIENT_ERRORS:
+            stats = {key: self.user_stats.get_stale((user_id, *key)) for key in keys}
+            if any(value is None for value in stats.values()):
+                raise
+            stale = True
+        return [
+            {
+                'year': key[0],
+                'month': key[1],
+                'points_tenths': stats[key]['points'],
+                'completions': stats[key]['completions'],
+                'daily': dict(sorted(stats[key]['daily'].items())),
+                'stale': stale
+            }
+            for key in keys
+        ]
+    
+    async def get_user_points_for_month(self, user_id: int, year: int, month: int,
+                                        allow_stale: bool = False) -> int:
+        """Get total points for user in specific month, in tenths"""
+        stats = await self.get_user_month_stats(user_id, year, month, allow_stale)
+        return stats['points']
+    
+    async def get_user_daily_stats(self, user_id: int, year: int, month: int,
+                                   allow_stale: bool = False) -> Dict[int, int]:
+        """Get daily points breakdown (tenths) for user in specific month"""
+        stats = await self.get_user_month_stats(user_id, year, month, allow_stale)
+        return dict(sorted(stats['daily'].items()))
+    
+    async def get_leaderboard(self, year: int, month: int, limit: int = 20, allow_stale: bool = True) -> List[Dict]:
+        """Get leaderboard for specific month, totals in tenths"""
+        if self.is_archived(year, month):
+            rows = await self._read_fetch(allow_stale, """
+                SELECT user_id, total_points_tenths, completions
+                FROM monthly_summary
+                WHERE year = $1 AND month = $2 AND archived
+                ORDER BY total_points_tenths DESC
+                LIMIT $3
+            """, year, month, limit)
+            return [dict(row) for row in rows]
+        
+        start, end = month_bounds(year, month)
+        rows = await self._read_fetch(allow_stale, """
+            SELECT 
+                user_id,
+                SUM(points_tenths) as total_points_tenths,
+                COUNT(*) as completions
+            FROM user_module_logs
+            WHERE date >= $1 AND date < $2
+            GROUP BY user_id
+            ORDER BY total_points_tenths DESC
+            LIMIT $3
+        """, start, end, limit)
+        return [dict(row) for row in rows]
+    
+    async def get_user_daily_points_range(self, user_id: int, start: date, end: date) -> List[Tuple[date, int]]:
+        """Get (date, tenths) for user's active days in [start, end), live and archived months alike"""
+        async with self.acquire() as conn:
             rows = await conn.fetch("""
-                SELECT EXTRACT(DAY FROM uml.date)::INT as day, SUM(m.points) as points
-                FROM user_module_logs uml
-                JOIN modules m ON uml.module_id = m.id
-                WHERE uml.user_id = $1 
-                AND EXTRACT(YEAR FROM uml.date) = $2 
-                AND EXTRACT(MONTH FROM uml.date) = $3
-                GROUP BY EXTRACT(DAY FROM uml.date)
-                ORDER BY day
-            """, user_id, year, month)
-            return {row['day']: float(row['points']) for row in rows}
-    
-    async def get_leaderboard(self, year: int, month: int, limit: int = 20) -> List[Dict]:
-        """Get leaderboard for specific month"""
-        async with self.pool.acquire() as conn:
+                SELECT date, points_tenths
+                FROM user_daily_summary
+                WHERE user_id = $1 AND date >= $2 AND date < $3
+                UNION ALL
+                SELECT date, SUM(points_tenths)
+                FROM user_module_logs
+                WHERE user_id = $1 AND date >= $2 AND date < $3
+                GROUP BY date
+            """, user_id, start, end)
+            return [(row['date'], row['points_tenths']) for row in rows]
+    
+    async def get_user_monthly_points(self, user_id: int, start: date, end: date) -> Dict[Tuple[int, int], int]:
+        """Get tenths per (year, month) in [start, end): archived months from monthly_summary, the rest from logs"""
+        async with self.acquire() as conn:
             rows = await conn.fetch("""
-                SELECT 
-                    uml.user_id,
-                    SUM(m.points) as total_points,
-                    COUNT(*) as completions
-                FROM user_module_logs uml
-                JOIN modules m ON uml.module_id = m.id
-                WHERE EXTRACT(YEAR FROM uml.date) = $1 
-                AND EXTRACT(MONTH FROM uml.date) = $2
-                GROUP BY uml.user_id
-                ORDER BY total_points DESC
+                SELECT year, month, total_points_tenths AS points_tenths
+                FROM monthly_summary
+                WHERE user_id = $1 AND archived
+                AND make_date(year, month, 1) >= $2 AND make_date(year, month, 1) < $3
+                UNION ALL
+                SELECT EXTRACT(YEAR FROM date)::INT, EXTRACT(MONTH FROM date)::INT, SUM(points_tenths)
+                FROM user_module_logs
+                WHERE user_id = $1 AND date >= $2 AND date < $3
+                GROUP BY 1, 2
+            """, user_id, start, end)
+            result: Dict[Tuple[int, int], int] = {}
+            for row in rows:
+                key = (row['year'], row['month'])
+                result[key] = result.get(key, 0) + row['points_tenths']
+            return result
+    
+    async def get_cohort_stats(self, year: int, month: int, allow_stale: bool = True) -> List[Dict]:
+        """Get points (tenths), active days and longest streak of every active user in a month"""
+        start, end = month_bounds(year, month)
+        if self.is_archived(year, month):
+            days_query = """
+                SELECT user_id, date, points_tenths
+                FROM user_daily_summary
+                WHERE date >= $1 AND date < $2
+            """
+        else:
+            days_query = """
+                SELECT user_id, date, SUM(points_tenths) AS points_tenths
+                FROM user_module_logs
+                WHERE date >= $1 AND date < $2
+                GROUP BY user_id, date
+            """
+        
+        rows = await self._read_fetch(allow_stale, f"""
+            WITH days AS ({days_query}),
+            islands AS (
+                SELECT user_id, points_tenths,
+                       date - (ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY date))::INT AS grp
+                FROM days
+            ),
+            streaks AS (
+                SELECT user_id, SUM(points_tenths) AS points_tenths, COUNT(*) AS days
+                FROM islands
+                GROUP BY user_id, grp
+            )
+            SELECT user_id,
+                   SUM(points_tenths)::BIGINT AS points_tenths,
+                   SUM(days)::INT AS active_days,
+                   MAX(days)::INT AS longest_streak
+            FROM streaks
+            GROUP BY user_id
+        """, start, end)
+        return [dict(row) for row in rows]
+    
+    async def get_leaderboard_refresh(self, period: str) -> Optional[Dict]:
+        """When the period's snapshot was built, its age in seconds and how many users it ranks"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT refreshed_at, participants, EXTRACT(EPOCH FROM now() - refreshed_at)::FLOAT8 AS age
+                FROM leaderboard_refresh
+                WHERE period = $1
+            """, period)
+            return dict(row) if row else None
+    
+    async def refresh_leaderboard_snapshot(self, period: str, start: date, end: date, max_age: float,
+                                           allow_stale: bool = True) -> Dict:
+        """Rebuild the ranked totals of [start, end) under a period key unless younger than max_age
+        
+        Totals are ranked on the read pool and written to the primary, so the
+        aggregation does not compete with the write path when a replica is set.
+        The period's leaderboard_refresh row is locked while writing: of several
+        instances ranking the same period at once, only the first writes.
+        Returns the period's refresh row.
+        """
+        current = await self.get_leaderboard_refresh(period)
+        if current and current['age'] < max_age:
+            return current
+        
+        rows = await self._read_fetch(allow_stale, """
+            SELECT user_id,
+                   RANK() OVER (ORDER BY SUM(points_tenths) DESC)::INT AS rank,
+                   ROW_NUMBER() OVER (ORDER BY SUM(points_tenths) DESC, user_id)::INT AS position,
+                   SUM(points_tenths)::BIGINT AS total_points_tenths,
+                   SUM(completions)::INT AS completions
+            FROM (
+                SELECT user_id, SUM(points_tenths) AS points_tenths, COUNT(*) AS completions
+                FROM user_module_logs
+                WHERE date >= $1 AND date < $2
+                GROUP BY user_id
+                UNION ALL
+                SELECT user_id, total_points_tenths, COALESCE(completions, 0)
+                FROM monthly_summary
+                WHERE archived
+                AND make_date(year, month, 1) >= $1 AND make_date(year, month, 1) < $2
+            ) totals
+            GROUP BY user_id
+            ORDER BY position
+        """, start, end)
+        
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""
+                    INSERT INTO leaderboard_refresh (period, refreshed_at, participants)
+                    VALUES ($1, 'epoch', 0)
+                    ON CONFLICT (period) DO NOTHING
+                """, period)
+                age = await conn.fetchval("""
+                    SELECT EXTRACT(EPOCH FROM now() - refreshed_at)::FLOAT8
+                    FROM leaderboard_refresh
+                    WHERE period = $1
+                    FOR UPDATE
+                """, period)
+                # Otherwise another instance wrote a snapshot while we were ranking
+                if age >= max_age:
+                    await conn.execute("DELETE FROM leaderboard_snapshot WHERE period = $1", period)
+                    await conn.copy_records_to_table(
+                        'leaderboard_snapshot',
+                        records=[(period, row['user_id'], row['rank'], row['position'],
+                                  row['total_points_tenths'], row['completions'])
+                                 for row in rows],
+                        columns=['period', 'user_id', 'rank', 'position', 'total_points_tenths', 'completions']
+                    )
+                    await conn.execute("""
+                        UPDATE leaderboard_refresh SET refreshed_at = now(), participants = $2
+                        WHERE period = $1
+                    """, period, len(rows))
+                    logger.info(f"Leaderboard snapshot {period} rebuilt: {len(rows)} users")
+                row = await conn.fetchrow("""
+                    SELECT refreshed_at, participants, EXTRACT(EPOCH FROM now() - refreshed_at)::FLOAT8 AS age
+                    FROM leaderboard_refresh
+                    WHERE period = $1
+                """, period)
+        return dict(row)
+    
+    async def get_leaderboard_page(self, period: str, after_position: int, limit: int) -> List[Dict]:
+        """Snapshot rows of a period following a position, read as a range of the (period, position) index"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT user_id, rank, position, total_points_tenths, completions
+                FROM leaderboard_snapshot
+                WHERE period = $1 AND position > $2
+                ORDER BY position
                 LIMIT $3
-            """, year, month, limit)
+            """, period, after_position, limit)
             return [dict(row) for row in rows]
     
+    async def get_leaderboard_position(self, period: str, user_id: int) -> Optional[Dict]:
+        """Position and rank of a user in the period's snapshot"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT position, rank
+                FROM leaderboard_snapshot
+                WHERE period = $1 AND user_id = $2
+            """, period, user_id)
+            return dict(row) if row else None
+    
+    async def get_chat_leaderboard(self, chat_id: int, start: date, end: date,
+                                   allow_stale: bool = True) -> List[Dict]:
+        """Rank users by points logged in one chat within [start, end)
+        
+        Reads only the chat's slice of live logs (chat_id, date index) and
+        of the archived per-chat daily summaries.
+        """
+        rows = await self._read_fetch(allow_stale, """
+            SELECT user_id,
+                   RANK() OVER (ORDER BY SUM(points_tenths) DESC)::INT AS rank,
+                   SUM(points_tenths)::BIGINT AS total_points_tenths,
+                   SUM(completions)::INT AS completions
+            FROM (
+                SELECT user_id, SUM(points_tenths) AS points_tenths, COUNT(*) AS completions
+                FROM user_module_logs
+                WHERE chat_id = $1 AND date >= $2 AND date < $3
+                GROUP BY user_id
+                UNION ALL
+                SELECT user_id, SUM(points_tenths), SUM(completions)
+                FROM chat_daily_summary
+                WHERE chat_id = $1 AND date >= $2 AND date < $3
+                GROUP BY user_id
+            ) totals
+            GROUP BY user_id
+            ORDER BY rank, user_id
+        """, chat_id, start, end)
+        return [dict(row) for row in rows]
+    
     async def get_user_last_action(self, user_id: int) -> Optional[Dict]:
         """Get user's last module completion for undo functionality"""
-        async with self.pool.acquire() as conn:
-            row = await conn.fetchrow("""
-                SELECT uml.id, uml.module_id, m.name, m.points, uml.date
+        rows = await self.get_user_history(user_id, limit=1)
+        return rows[0] if rows else None
+    
+    async def get_user_history(self, user_id: int, limit: int = 10,
+                               before: Optional[Tuple[datetime, int]] = None) -> List[Dict]:
+        """Get user's completions newest first, continuing after a (created_at, id) cursor"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT uml.id, uml.module_id, m.name, uml.points_tenths,
+                       uml.date, uml.created_at
                 FROM user_module_logs uml
                 JOIN modules m ON uml.module_id = m.id
                 WHERE uml.user_id = $1
-                ORDER BY uml.created_at DESC
-                LIMIT 1
-            """, user_id)
-            return dict(row) if row else None
+                AND ($2::TIMESTAMP IS NULL OR (uml.created_at, uml.id) < ($2, $3))
+                ORDER BY uml.created_at DESC, uml.id DESC
+                LIMIT $4
+            """, user_id, before[0] if before else None, before[1] if before else None, limit)
+            return [dict(row) for row in rows]
+    
+    async def delete_user_logs(self, user_id: int, entries: List[Tuple[int, date]]) -> List[Dict]:
+        """Delete a user's completions by (id, date) in one statement, returning the deleted rows"""
+        if not entries:
+            return []
+        with self._writing_stats(user_id):
+            async with self.acquire() as conn:
+                rows = await conn.fetch("""
+                    WITH deleted AS (
+                        DELETE FROM user_module_logs
+                        WHERE user_id = $1
+                        AND (id, date) IN (SELECT * FROM unnest($2::INT[], $3::DATE[]))
+                        RETURNING id, module_id, date, points_tenths
+                    )
+                    SELECT d.id, d.date, d.points_tenths, m.name
+                    FROM deleted d
+                    JOIN modules m ON d.module_id = m.id
+                """, user_id, [entry[0] for entry in entries], [entry[1] for entry in entries])
+            
+            self._apply_deleted(user_id, rows)
+        return [dict(row) for row in rows]
+    
+    async def undo_last_actions(self, user_id: int, count: int = 1) -> List[Dict]:
+        """Delete user's last N completions in one statement, returning them newest first"""
+        with self._writing_stats(user_id):
+            async with self.acquire() as conn:
+                rows = await conn.fetch("""
+                    WITH deleted AS (
+                        DELETE FROM user_module_logs
+                        WHERE (id, date) IN (
+                            SELECT id, date
+                            FROM user_module_logs
+                            WHERE user_id = $1
+                            ORDER BY created_at DESC, id DESC
+                            LIMIT $2
+                        )
+                        RETURNING id, module_id, date, created_at, points_tenths
+                    )
+                    SELECT d.id, d.date, d.points_tenths, m.name
+                    FROM deleted d
+                    JOIN modules m ON d.module_id = m.id
+                    ORDER BY d.created_at DESC, d.id DESC
+                """, user_id, count)
+            
+            self._apply_deleted(user_id, rows)
+        return [dict(row) for row in rows]
+    
+    def _apply_deleted(self, user_id: int, rows):
+        """Patch cached stats once for a batch of deleted completions"""
+        if not rows:
+            return
+        deltas: Dict[date, Tuple[int, int]] = {}
+        for row in rows:
+            tenths, completions = deltas.get(row['date'], (0, 0))
+            deltas[row['date']] = (tenths - row['points_tenths'], completions - 1)
+        self._patch_user_stats_days(user_id, deltas)
     
     async def undo_last_action(self, user_id: int) -> bool:
         """Undo user's last module completion"""
-        async with self.pool.acquire() as conn:
-            last_action = await self.get_user_last_action(user_id)
-            if not last_action:
-                return False
-            
-            await conn.execute(
-                "DELETE FROM user_module_logs WHERE id = $1",
-                last_action['id']
-            )
-            return True
+        return bool(await self.undo_last_actions(user_id, 1))
     
     async def is_admin(self, user_id: int) -> bool:
         """Check if user is admin"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             result = await conn.fetchval(
                 "SELECT 1 FROM admins WHERE user_id = $1",
                 user_id
@@ -200,27 +1011,187 @@ class Database:
     
     async def add_admin(self, user_id: int):
         """Add user as admin"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 "INSERT INTO admins (user_id) VALUES ($1) ON CONFLICT DO NOTHING",
                 user_id
             )
     
-    async def get_all_users(self) -> List[int]:
+    async def get_all_users(self, allow_stale: bool = True) -> List[int]:
         """Get all users who have logged modules"""
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch("SELECT DISTINCT user_id FROM user_module_logs")
+        rows = await self._read_fetch(allow_stale, """
+            SELECT user_id FROM user_module_logs
+            UNION
+            SELECT user_id FROM monthly_summary WHERE archived
+        """)
+        return [row['user_id'] for row in rows]
+    
+    async def get_reminder_setting(self, user_id: int) -> Optional[Dict]:
+        """Get user's reminder preference, None if never set"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT remind_at, enabled FROM reminder_settings WHERE user_id = $1",
+                user_id
+            )
+            return dict(row) if row else None
+    
+    async def set_reminder_setting(self, user_id: int, remind_at: Optional[time], enabled: bool):
+        """Save user's reminder time (None for the default window) or disable reminders"""
+        async with self.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO reminder_settings (user_id, remind_at, enabled)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    remind_at = EXCLUDED.remind_at,
+                    enabled = EXCLUDED.enabled,
+                    updated_at = CURRENT_TIMESTAMP
+            """, user_id, remind_at, enabled)
+    
+    async def iter_reminder_audience(self, today: date, active_since: date,
+                                     allow_stale: bool = True) -> AsyncIterator[Dict]:
+        """Stream (user_id, remind_at) of users to remind today: recently active, reminders on, nothing logged today
+        
+        Lag is harmless here: every batch is re-checked on the primary by filter_not_logged before sending.
+        """
+        async def stream(pool) -> AsyncIterator[Dict]:
+            async with self.acquire(pool) as conn:
+                async with conn.transaction():
+                    async for row in conn.cursor("""
+                        SELECT a.user_id, r.remind_at
+                        FROM (
+                            SELECT DISTINCT user_id FROM user_module_logs WHERE date >= $2
+                            UNION
+                            SELECT user_id FROM reminder_settings WHERE enabled AND updated_at >= $2
+                        ) a
+                        LEFT JOIN reminder_settings r ON r.user_id = a.user_id
+                        WHERE COALESCE(r.enabled, TRUE)
+                        AND NOT EXISTS (
+                            SELECT 1 FROM user_module_logs t
+                            WHERE t.user_id = a.user_id AND t.date = $1
+                        )
+                    """, today, active_since, prefetch=1000):
+                        yield dict(row)
+        
+        async for row in self._read_stream(allow_stale, stream):
+            yield row
+    
+    async def filter_not_logged(self, user_ids: List[int], day: date) -> List[int]:
+        """Keep only users without completions on a day"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT u.user_id
+                FROM unnest($1::BIGINT[]) AS u(user_id)
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM user_module_logs t
+                    WHERE t.user_id = u.user_id AND t.date = $2
+                )
+            """, user_ids, day)
             return [row['user_id'] for row in rows]
     
-    async def save_monthly_summary(self, user_id: int, year: int, month: int, total_points: float):
-        """Save monthly summary for user"""
-        async with self.pool.acquire() as conn:
+    async def save_monthly_summary(self, user_id: int, year: int, month: int, total_points_tenths: int):
+        """Save monthly summary (total in tenths) for user"""
+        async with self.acquire() as conn:
             await conn.execute("""
-                INSERT INTO monthly_summary (user_id, year, month, total_points) 
+                INSERT INTO monthly_summary (user_id, year, month, total_points_tenths) 
                 VALUES ($1, $2, $3, $4)
                 ON CONFLICT (user_id, year, month) 
-                DO UPDATE SET total_points = $4
-            """, user_id, year, month, total_points)
+                DO UPDATE SET total_points_tenths = $4
+                WHERE NOT monthly_summary.archived
+            """, user_id, year, month, total_points_tenths)
+
+    async def bulk_insert_logs(self, records: Union[Iterable[Tuple[int, int, date, int]],
+                                                    AsyncIterable[Tuple[int, int, date, int]]]) -> int:
+        """Load (user_id, module_id, date, points_tenths) records, sync or async iterable, with COPY in one transaction"""
+        async with self.acquire(maintenance=True) as conn:
+            async with conn.transaction():
+                status = await conn.copy_records_to_table(
+                    'user_module_logs',
+                    records=records,
+                    columns=['user_id', 'module_id', 'date', 'points_tenths'],
+                    timeout=DB_MAINTENANCE_TIMEOUT
+                )
+        return int(status.split()[-1])
+    
+    async def refresh_rollups(self, months: Iterable[Tuple[int, int]]):
+        """Bring partitions and summaries up to date after a bulk load into given months"""
+        for year, month in sorted(set(months)):
+            await self.ensure_partition(year, month)
+        await self.archive_old_partitions()
+        self.invalidate_user_stats()
+    
+    def _export_query(self, kind: str, year: int, month: int) -> Tuple[str, tuple]:
+        """Build the query and arguments for a month export ('payroll' or 'logs')"""
+        start, end = month_bounds(year, month)
+        archived = self.is_archived(year, month)
+        
+        if kind == 'payroll' and archived:
+            return """
+                SELECT user_id, (total_points_tenths / 10.0)::FLOAT8 AS points, completions,
+                       (total_points_tenths * $3 / 10.0)::FLOAT8 AS money
+                FROM monthly_summary
+                WHERE year = $1 AND month = $2 AND archived
+                ORDER BY user_id
+            """, (year, month, POINTS_TO_MONEY_RATE)
+        if kind == 'payroll':
+            return """
+                SELECT user_id, (SUM(points_tenths) / 10.0)::FLOAT8 AS points, COUNT(*) AS completions,
+                       (SUM(points_tenths) * $3 / 10.0)::FLOAT8 AS money
+                FROM user_module_logs
+                WHERE date >= $1 AND date < $2
+                GROUP BY user_id
+                ORDER BY user_id
+            """, (start, end, POINTS_TO_MONEY_RATE)
+        if kind == 'logs' and archived:
+            return """
+                SELECT user_id, date, (points_tenths / 10.0)::FLOAT8 AS points, completions
+                FROM user_daily_summary
+                WHERE date >= $1 AND date < $2
+                ORDER BY date, user_id
+            """, (start, end)
+        if kind == 'logs':
+            return """
+                SELECT uml.id, uml.user_id, m.name AS module, (uml.points_tenths / 10.0)::FLOAT8 AS points,
+                       uml.date, uml.created_at
+                FROM user_module_logs uml
+                JOIN modules m ON uml.module_id = m.id
+                WHERE uml.date >= $1 AND uml.date < $2
+                ORDER BY uml.date, uml.id
+            """, (start, end)
+        raise ValueError(f"Unknown export kind: {kind}")
+    
+    async def copy_month_export(self, kind: str, year: int, month: int, output, allow_stale: bool = True) -> int:
+        """Stream a month export as CSV into a seekable file-like object via COPY, return row count"""
+        query, args = self._export_query(kind, year, month)
+        start = output.tell()
+        
+        async def copy(conn) -> str:
+            # Drop whatever a failed attempt on the replica wrote
+            output.seek(start)
+            output.truncate()
+            return await conn.copy_from_query(
+                query, *args, output=output, format='csv', header=True, timeout=DB_MAINTENANCE_TIMEOUT
+            )
+        
+        status = await self._read(allow_stale, copy, maintenance=True)
+        return int(status.split()[-1])
+    
+    async def iter_month_export(self, kind: str, year: int, month: int, batch_size: int = 5000,
+                                allow_stale: bool = True) -> AsyncIterator[List[Dict]]:
+        """Stream a month export in batches through a server-side cursor"""
+        query, args = self._export_query(kind, year, month)
+        
+        async def stream(pool) -> AsyncIterator[List[Dict]]:
+            async with self.acquire(pool, maintenance=True) as conn:
+                async with conn.transaction():
+                    cursor = await conn.cursor(query, *args, timeout=DB_MAINTENANCE_TIMEOUT)
+                    while True:
+                        rows = await cursor.fetch(batch_size, timeout=DB_MAINTENANCE_TIMEOUT)
+                        if not rows:
+                            break
+                        yield [dict(row) for row in rows]
+        
+        async for batch in self._read_stream(allow_stale, stream, maintenance=True):
+            yield batch
 
 # Global database instance
 db = Database()
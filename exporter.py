@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import tempfile
+from typing import AsyncGenerator, List
+
+from aiogram.types.input_file import InputFile, DEFAULT_CHUNK_SIZE
+
+from database import db
+from config import EXPORT_SPOOL_MAX_SIZE
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_KINDS = ('payroll', 'logs')
+EXPORT_FORMATS = ('csv', 'parquet')
+
+def parquet_available() -> bool:
+    """Check if pyarrow is installed for columnar exports"""
+    return pq is not None
+
+class SpooledInputFile(InputFile):
+    """Upload a spooled temporary file chunk by chunk without loading it into memory"""
+
+    def __init__(self, file, filename: str, rows: int, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+        self.rows = rows
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.file.seek, 0)
+        while chunk := await loop.run_in_executor(None, self.file.read, self.chunk_size):
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+async def _export_csv(kind: str, year: int, month: int) -> SpooledInputFile:
+    """Export one dataset as CSV using COPY ... TO STDOUT"""
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    try:
+        rows = await db.copy_month_export(kind, year, month, spool)
+    except Exception:
+        spool.close()
+        raise
+    return SpooledInputFile(spool, f"{kind}_{year}_{month:02d}.csv", rows)
+
+async def _export_parquet(kind: str, year: int, month: int) -> SpooledInputFile:
+    """Export one dataset as Parquet, one row group per cursor batch"""
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    writer = None
+    rows = 0
+    loop = asyncio.get_running_loop()
+    try:
+        async for batch in db.iter_month_export(kind, year, month):
+            table = pa.Table.from_pylist(batch)
+            if writer is None:
+                writer = pq.ParquetWriter(spool, table.schema)
+            else:
+                table = table.cast(writer.schema)
+            await loop.run_in_executor(None, writer.write_table, table)
+            rows += len(batch)
+        if writer is not None:
+            writer.close()
+    except Exception:
+        spool.close()
+        raise
+    return SpooledInputFile(spool, f"{kind}_{year}_{month:02d}.parquet", rows)
+
+async def export_month(year: int, month: int, fmt: str = 'csv') -> List[SpooledInputFile]:
+    """Export payroll summary and raw logs for a month, skipping empty datasets"""
+    if fmt == 'parquet' and not parquet_available():
+        raise RuntimeError("pyarrow is not installed")
+
+    export = _export_parquet if fmt == 'parquet' else _export_csv
+    files = []
+    for kind in EXPORT_KINDS:
+        file = await export(kind, year, month)
+        if file.rows == 0:
+            file.close()
+            continue
+        files.append(file)
+
+    logger.info(f"Exported {year}-{month:02d} as {fmt}: " + ", ".join(f"{f.filename} ({f.rows} rows)" for f in files))
+    return files
@@ -2,12 +2,20 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 from datetime import datetime, date
+from typing import List, Optional, Tuple
 import re
 import logging
 
 from database import db
-from config import TIMEZONE, POINTS_TO_MONEY_RATE
-from utils import format_points, get_user_display_name, create_modules_keyboard
+from config import (
+    TIMEZONE, POINTS_TO_MONEY_RATE, ALLOWED_HOUR_START, ALLOWED_HOUR_END,
+    REMINDER_WINDOW_START, REMINDER_WINDOW_END, UNDO_MAX_COUNT
+)
+from utils import format_points, format_tenths, get_user_display_name, STALE_NOTICE, POINTS_SCALE
+from catalog import catalog
+from reminders import reminders
+from middleware import callback_dedup
+from history import render_history_page
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -22,10 +30,14 @@ async def cmd_start(message: Message):
         "📋 Доступные команды:\n"
         "/modules - Выбрать модуль для добавления\n"
         "/add - Добавить модуль командой\n"
+        "@бот <модуль> - Добавить модуль из любого чата\n"
         "/points - Мои баллы за месяц\n"
         "/graph - График выполнения\n"
         "/insight - ИИ-анализ прогресса\n"
-        "/leaderboard - Лидерборд\n\n"
+        "/leaderboard - Лидерборд\n"
+        "/history - История и удаление записей\n"
+        "/undo - Отменить последние записи\n"
+        "/remind - Настроить напоминания\n\n"
         "⏰ Добавление модулей доступно с 18:00 до 23:59"
     )
 
@@ -33,56 +45,49 @@ async def cmd_start(message: Message):
 async def cmd_modules(message: Message):
     """Show modules selection menu"""
     try:
-        modules = await db.get_modules()
-        if not modules:
+        await catalog.ensure_fresh()
+        if not catalog.modules:
             await message.answer("❌ Модули не найдены. Обратитесь к администратору.")
             return
         
-        keyboard = create_modules_keyboard(modules)
-        await message.answer(
-            "📚 Выберите модуль для добавления:",
-            reply_markup=keyboard
-        )
+        keyboard = catalog.keyboard(0)
+        text = "📚 Выберите модуль для добавления:"
+        if catalog.stale:
+            text += f"\n\n{STALE_NOTICE}"
+        await message.answer(text, reply_markup=keyboard)
     except Exception as e:
         logger.error(f"Error in cmd_modules: {e}")
         await message.answer("❌ Произошла ошибка при загрузке модулей.")
 
 @router.callback_query(F.data.startswith("module_"))
-async def handle_module_selection(callback: CallbackQuery):
+async def handle_module_selection(callback: CallbackQuery, request_id: Optional[str] = None):
     """Handle module selection from inline keyboard"""
     try:
         module_id = int(callback.data.split("_")[1])
         user_id = callback.from_user.id
         
         # Get module info
-        modules = await db.get_modules()
-        module = next((m for m in modules if m['id'] == module_id), None)
+        await catalog.ensure_fresh()
+        module = catalog.index.get(module_id)
         
         if not module:
             await callback.answer("❌ Модуль не найден!", show_alert=True)
             return
         
-        # Add module completion
-        await db.add_module_completion(user_id, module_id)
-        
-        # Create undo keyboard
-        undo_keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[[
-                InlineKeyboardButton(text="↩️ Отменить последнее", callback_data="undo_last")
-            ]]
-        )
+        # Add module completion; a repeated request id means this tap was already recorded
+        result = await db.record_completion(user_id, module_id, request_id, callback.message.chat.id)
+        text, keyboard = completion_reply(module, [result])
+        if text is None:
+            await callback.answer("✅ Уже обработано")
+            return
         
-        await callback.message.edit_text(
-            f"✅ Модуль '{module['name']}' добавлен!\n"
-            f"💎 Получено баллов: {format_points(module['points'])}\n"
-            f"💰 Деньги: {format_points(module['points'] * POINTS_TO_MONEY_RATE)} ₽",
-            reply_markup=undo_keyboard
-        )
+        await callback.message.edit_text(text, reply_markup=keyboard)
         
         await callback.answer()
         
     except Exception as e:
         logger.error(f"Error in handle_module_selection: {e}")
+        callback_dedup.forget(callback)
         await callback.answer("❌ Произошла ошибка при добавлении модуля!", show_alert=True)
 
 @router.callback_query(F.data == "undo_last")
@@ -90,27 +95,122 @@ async def handle_undo_last(callback: CallbackQuery):
     """Handle undo last action"""
     try:
         user_id = callback.from_user.id
-        last_action = await db.get_user_last_action(user_id)
+        deleted = await db.undo_last_actions(user_id, 1)
         
-        if not last_action:
+        if not deleted:
             await callback.answer("❌ Нет действий для отмены!", show_alert=True)
             return
         
-        success = await db.undo_last_action(user_id)
-        
-        if success:
-            await callback.message.edit_text(
-                f"↩️ Действие отменено!\n"
-                f"Удален модуль: '{last_action['name']}' ({format_points(last_action['points'])} баллов)"
-            )
-            await callback.answer("✅ Действие отменено!")
-        else:
-            await callback.answer("❌ Не удалось отменить действие!", show_alert=True)
+        await callback.message.edit_text(
+            f"↩️ Действие отменено!\n"
+            f"Удален модуль: '{deleted[0]['name']}' ({format_tenths(deleted[0]['points_tenths'])} баллов)"
+        )
+        await callback.answer("✅ Действие отменено!")
             
     except Exception as e:
         logger.error(f"Error in handle_undo_last: {e}")
+        callback_dedup.forget(callback)
         await callback.answer("❌ Произошла ошибка при отмене!", show_alert=True)
 
+@router.message(Command("undo"))
+async def cmd_undo(message: Message):
+    """Undo last completions: /undo [N]"""
+    try:
+        args = message.text.split()[1:]
+        if args and (not args[0].isdigit() or not 1 <= int(args[0]) <= UNDO_MAX_COUNT):
+            await message.answer(f"📝 Использование: /undo [количество от 1 до {UNDO_MAX_COUNT}]")
+            return
+        count = int(args[0]) if args else 1
+        
+        deleted = await db.undo_last_actions(message.from_user.id, count)
+        if not deleted:
+            await message.answer("❌ Нет действий для отмены!")
+            return
+        
+        total_tenths = sum(row['points_tenths'] for row in deleted)
+        text = f"↩️ Отменено записей: {len(deleted)} (−{format_tenths(total_tenths)} баллов)\n\n"
+        text += "\n".join(f"• {row['date'].strftime('%d.%m')} {row['name']}" for row in deleted)
+        await message.answer(text)
+        
+    except Exception as e:
+        logger.error(f"Error in cmd_undo: {e}")
+        await message.answer("❌ Произошла ошибка при отмене.")
+
+@router.message(Command("history"))
+async def cmd_history(message: Message):
+    """Show paginated completion history"""
+    try:
+        text, keyboard = await render_history_page(message.from_user.id)
+        await message.answer(text, reply_markup=keyboard)
+    except Exception as e:
+        logger.error(f"Error in cmd_history: {e}")
+        await message.answer("❌ Произошла ошибка при загрузке истории.")
+
+@router.callback_query(F.data.startswith("hist_page_"))
+async def handle_history_page(callback: CallbackQuery):
+    """Open history page by keyset cursor"""
+    try:
+        cursor = callback.data[len("hist_page_"):]
+        text, keyboard = await render_history_page(callback.from_user.id, cursor)
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Error in handle_history_page: {e}")
+        await callback.answer("❌ Произошла ошибка!", show_alert=True)
+
+@router.callback_query(F.data.startswith("hist_del_"))
+async def handle_history_delete(callback: CallbackQuery):
+    """Delete one completion from history and redraw the page"""
+    try:
+        # hist_del_<id>_<YYYYMMDD>_<page cursor>
+        _, _, log_id, day, cursor = callback.data.split("_", 4)
+        log_date = datetime.strptime(day, "%Y%m%d").date()
+        
+        deleted = await db.delete_user_logs(callback.from_user.id, [(int(log_id), log_date)])
+        
+        text, keyboard = await render_history_page(callback.from_user.id, cursor)
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        if deleted:
+            await callback.answer(f"🗑 Удалено: {deleted[0]['name']}")
+        else:
+            await callback.answer("Запись уже удалена")
+    except Exception as e:
+        logger.error(f"Error in handle_history_delete: {e}")
+        await callback.answer("❌ Произошла ошибка при удалении!", show_alert=True)
+
+def undo_keyboard() -> InlineKeyboardMarkup:
+    """Keyboard with the undo button shown after adding modules"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[
+            InlineKeyboardButton(text="↩️ Отменить последнее", callback_data="undo_last")
+        ]]
+    )
+
+def completion_text(module: dict, count: int) -> str:
+    """Confirmation text for added module completions"""
+    total_tenths = module['points_tenths'] * count
+    total_money = total_tenths * POINTS_TO_MONEY_RATE / POINTS_SCALE
+    count_text = f" (x{count})" if count > 1 else ""
+    return (
+        f"✅ Модуль '{module['name']}'{count_text} добавлен!\n"
+        f"💎 Получено баллов: {format_tenths(total_tenths)}\n"
+        f"💰 Деньги: {format_points(total_money)} ₽"
+    )
+
+def completion_reply(module: dict, results: List[str]) -> Tuple[Optional[str], Optional[InlineKeyboardMarkup]]:
+    """Text and keyboard for db.record_completion results; no text if every row was a duplicate"""
+    added = results.count('added')
+    queued = results.count('queued')
+    if not added and not queued:
+        return None, None
+    
+    text = completion_text(module, added + queued)
+    if queued:
+        # Undo would remove an older row while these are still waiting
+        text += "\n\n⏳ База данных недоступна: запись сохранена и будет добавлена автоматически"
+        return text, None
+    return text, undo_keyboard()
+
 @router.message(Command("add"))
 async def cmd_add(message: Message):
     """Add module by command: /add <module_name> <count>"""
@@ -127,47 +227,80 @@ async def cmd_add(message: Message):
             )
             return
         
-        # Parse count if provided
+        await catalog.ensure_fresh()
+        
+        # Parse count if provided, unless the number is part of the name ("Практика 1")
         count = 1
-        if args[-1].isdigit():
+        module_name = " ".join(args)
+        if args[-1].isdigit() and len(args) > 1 and not catalog.index.lookup(module_name):
             count = int(args[-1])
             module_name = " ".join(args[:-1])
-        else:
-            module_name = " ".join(args)
         
-        # Find module
-        module = await db.get_module_by_name(module_name)
+        # Find module in the in-memory catalog, tolerating typos
+        module, suggestions = catalog.index.resolve(module_name)
         if not module:
-            await message.answer(f"❌ Модуль '{module_name}' не найден!")
+            if not suggestions:
+                await message.answer(f"❌ Модуль '{module_name}' не найден!")
+                return
+            
+            keyboard = InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [InlineKeyboardButton(
+                        text=f"{m['name']} ({format_tenths(m['points_tenths'])})",
+                        callback_data=f"add_{m['id']}_{count}"
+                    )]
+                    for m in suggestions
+                ]
+            )
+            await message.answer(
+                f"🤔 Модуль '{module_name}' не найден. Возможно, вы имели в виду:",
+                reply_markup=keyboard
+            )
             return
         
         # Add multiple completions
         user_id = message.from_user.id
-        for _ in range(count):
-            await db.add_module_completion(user_id, module['id'])
+        results = [await db.record_completion(user_id, module['id'], chat_id=message.chat.id) for _ in range(count)]
         
-        total_points = module['points'] * count
-        total_money = total_points * POINTS_TO_MONEY_RATE
-        
-        # Create undo keyboard
-        undo_keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[[
-                InlineKeyboardButton(text="↩️ Отменить последнее", callback_data="undo_last")
-            ]]
-        )
-        
-        count_text = f" (x{count})" if count > 1 else ""
-        await message.answer(
-            f"✅ Модуль '{module['name']}'{count_text} добавлен!\n"
-            f"💎 Получено баллов: {format_points(total_points)}\n"
-            f"💰 Деньги: {format_points(total_money)} ₽",
-            reply_markup=undo_keyboard
-        )
+        text, keyboard = completion_reply(module, results)
+        await message.answer(text, reply_markup=keyboard)
         
     except Exception as e:
         logger.error(f"Error in cmd_add: {e}")
         await message.answer("❌ Произошла ошибка при добавлении модуля.")
 
+@router.callback_query(F.data.startswith("add_"))
+async def handle_add_suggestion(callback: CallbackQuery, request_id: Optional[str] = None):
+    """Add module picked from /add suggestions"""
+    try:
+        _, module_id, count = callback.data.split("_")
+        count = int(count)
+        
+        await catalog.ensure_fresh()
+        module = catalog.index.get(int(module_id))
+        if not module:
+            await callback.answer("❌ Модуль не найден!", show_alert=True)
+            return
+        
+        user_id = callback.from_user.id
+        results = []
+        for index in range(count):
+            row_request_id = f"{request_id}:{index}" if request_id else None
+            results.append(await db.record_completion(user_id, module['id'], row_request_id, callback.message.chat.id))
+        
+        text, keyboard = completion_reply(module, results)
+        if text is None:
+            await callback.answer("✅ Уже обработано")
+            return
+        
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer()
+        
+    except Exception as e:
+        logger.error(f"Error in handle_add_suggestion: {e}")
+        callback_dedup.forget(callback)
+        await callback.answer("❌ Произошла ошибка при добавлении модуля!", show_alert=True)
+
 @router.message(Command("points"))
 async def cmd_points(message: Message):
     """Show user's points for current month"""
@@ -175,25 +308,81 @@ async def cmd_points(message: Message):
         user_id = message.from_user.id
         now = datetime.now(TIMEZONE)
         
-        points = await db.get_user_points_for_month(user_id, now.year, now.month)
-        money = points * POINTS_TO_MONEY_RATE
-        
-        # Get previous month for comparison
-        prev_month = now.month - 1 if now.month > 1 else 12
-        prev_year = now.year if now.month > 1 else now.year - 1
-        prev_points = await db.get_user_points_for_month(user_id, prev_year, prev_month)
+        # Current and previous month for comparison, in one query
+        current, previous = await db.get_user_summary(user_id, 2, now.year, now.month)
+        points = current['points_tenths']
+        prev_points = previous['points_tenths']
+        money = points * POINTS_TO_MONEY_RATE / POINTS_SCALE
         
         change = points - prev_points
         change_symbol = "📈" if change > 0 else "📉" if change < 0 else "➡️"
-        change_text = f"{change_symbol} {'+' if change > 0 else ''}{format_points(change)} баллов к прошлому месяцу"
+        change_text = f"{change_symbol} {'+' if change > 0 else ''}{format_tenths(change)} баллов к прошлому месяцу"
         
-        await message.answer(
+        text = (
             f"💎 Ваши баллы за {now.strftime('%B %Y')}:\n\n"
-            f"🎯 Баллы: {format_points(points)}\n"
+            f"🎯 Баллы: {format_tenths(points)}\n"
             f"💰 Деньги: {format_points(money)} ₽\n\n"
             f"{change_text}"
         )
+        if current['stale']:
+            text += f"\n\n{STALE_NOTICE}"
+        await message.answer(text)
         
     except Exception as e:
         logger.error(f"Error in cmd_points: {e}")
         await message.answer("❌ Произошла ошибка при получении баллов.")
+
+@router.message(Command("remind"))
+async def cmd_remind(message: Message):
+    """Configure daily reminder: /remind [HH:MM|on|off]"""
+    try:
+        user_id = message.from_user.id
+        args = message.text.split()[1:]
+        window = f"{REMINDER_WINDOW_START.strftime('%H:%M')}–{REMINDER_WINDOW_END.strftime('%H:%M')}"
+        
+        if not args:
+            setting = await db.get_reminder_setting(user_id)
+            if setting and not setting['enabled']:
+                status = "🔕 Напоминания выключены"
+            elif setting and setting['remind_at']:
+                status = f"⏰ Напоминание в {setting['remind_at'].strftime('%H:%M')}"
+            else:
+                status = f"⏰ Напоминание в промежутке {window}"
+            await message.answer(
+                f"{status}\n\n"
+                "📝 Использование:\n"
+                "/remind 19:30 - напоминать в выбранное время\n"
+                "/remind on - время по умолчанию\n"
+                "/remind off - выключить напоминания"
+            )
+            return
+        
+        arg = args[0].lower()
+        if arg == "off":
+            remind_at, enabled = None, False
+            reply = "🔕 Напоминания выключены. Включить снова: /remind on"
+        elif arg == "on":
+            remind_at, enabled = None, True
+            reply = f"🔔 Напоминания включены, время по умолчанию: {window}"
+        else:
+            try:
+                remind_at = datetime.strptime(arg, "%H:%M").time()
+            except ValueError:
+                await message.answer("❌ Укажите время в формате ЧЧ:ММ, например /remind 19:30")
+                return
+            if not ALLOWED_HOUR_START <= remind_at.hour <= ALLOWED_HOUR_END:
+                await message.answer(
+                    f"❌ Модули можно добавлять только с {ALLOWED_HOUR_START}:00 до {ALLOWED_HOUR_END}:59, "
+                    "выберите время в этом промежутке."
+                )
+                return
+            enabled = True
+            reply = f"⏰ Буду напоминать каждый день в {remind_at.strftime('%H:%M')}"
+        
+        await db.set_reminder_setting(user_id, remind_at, enabled)
+        reminders.reschedule(user_id, remind_at, enabled)
+        await message.answer(reply)
+        
+    except Exception as e:
+        logger.error(f"Error in cmd_remind: {e}")
+        await message.answer("❌ Произошла ошибка при настройке напоминаний.")
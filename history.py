@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from database import db
+from config import HISTORY_PAGE_SIZE
+from utils import format_tenths
+
+EPOCH = datetime(1970, 1, 1)
+
+def encode_cursor(row: Optional[Dict]) -> str:
+    """Encode a (created_at, id) keyset cursor for callback data, "0" for the first page"""
+    if row is None:
+        return "0"
+    micros = (row['created_at'] - EPOCH) // timedelta(microseconds=1)
+    return f"{micros}-{row['id']}"
+
+def decode_cursor(value: str) -> Optional[Tuple[datetime, int]]:
+    """Decode a cursor produced by encode_cursor"""
+    if value == "0":
+        return None
+    micros, row_id = value.split("-")
+    return EPOCH + timedelta(microseconds=int(micros)), int(row_id)
+
+async def render_history_page(user_id: int, cursor: str = "0") -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Render one page of user's completions with delete buttons
+    
+    Pages are fetched by keyset: the cursor is the last row of the previous
+    page, so every page is one short index range scan.
+    """
+    # One extra row tells whether there is a next page
+    rows = await db.get_user_history(user_id, HISTORY_PAGE_SIZE + 1, decode_cursor(cursor))
+    has_next = len(rows) > HISTORY_PAGE_SIZE
+    rows = rows[:HISTORY_PAGE_SIZE]
+    
+    if not rows:
+        if cursor != "0":
+            return "📜 Больше записей нет.", _navigation_keyboard(cursor, None, [])
+        return "📜 История пуста. Добавьте модуль через /modules или /add.", None
+    
+    text = "📜 История выполнения\n\n"
+    for number, row in enumerate(rows, 1):
+        text += (
+            f"{number}. {row['date'].strftime('%d.%m.%Y')} — {row['name']} "
+            f"({format_tenths(row['points_tenths'])} б.)\n"
+        )
+    text += "\n🗑 Нажмите номер записи, чтобы удалить её. /undo N — отменить N последних."
+    
+    next_cursor = encode_cursor(rows[-1]) if has_next else None
+    return text, _navigation_keyboard(cursor, next_cursor, rows)
+
+def _navigation_keyboard(cursor: str, next_cursor: Optional[str], rows: List[Dict]) -> InlineKeyboardMarkup:
+    """Per-row delete buttons and keyset navigation"""
+    keyboard = []
+    buttons = [
+        InlineKeyboardButton(
+            text=f"🗑 {number}",
+            callback_data=f"hist_del_{row['id']}_{row['date'].strftime('%Y%m%d')}_{cursor}"
+        )
+        for number, row in enumerate(rows, 1)
+    ]
+    for i in range(0, len(buttons), 4):
+        keyboard.append(buttons[i:i + 4])
+    
+    navigation_row = []
+    if cursor != "0":
+        navigation_row.append(InlineKeyboardButton(text="⏮ В начало", callback_data="hist_page_0"))
+    if next_cursor:
+        navigation_row.append(InlineKeyboardButton(text="Дальше ➡️", callback_data=f"hist_page_{next_cursor}"))
+    if navigation_row:
+        keyboard.append(navigation_row)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
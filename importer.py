@@ -0,0 +1,145 @@
+import asyncio
+import csv
+import io
+import itertools
+import logging
+import sys
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import AsyncIterator, Iterable, Iterator, List, Set, Tuple
+
+from database import db
+from catalog import ModuleIndex
+
+logger = logging.getLogger(__name__)
+
+MAX_COUNT_PER_ROW = 1000
+MAX_REPORTED_ERRORS = 20
+PARSE_BATCH_SIZE = 5000  # Records parsed per worker thread hop
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y")
+
+class ImportValidationError(Exception):
+    """Raised when the CSV contains invalid rows; nothing is imported"""
+
+    def __init__(self, result: "ImportResult"):
+        super().__init__(f"{result.error_count} invalid rows")
+        self.result = result
+
+@dataclass
+class ImportResult:
+    """Outcome of a bulk import"""
+    rows: int = 0
+    records: int = 0
+    error_count: int = 0
+    errors: List[str] = field(default_factory=list)
+    months: Set[Tuple[int, int]] = field(default_factory=set)
+
+    def add_error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Строка {line}: {message}")
+
+def parse_date(value: str) -> date:
+    """Parse ISO or DD.MM.YYYY date"""
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(value)
+
+def iter_records(lines: Iterable[str], index: ModuleIndex, result: ImportResult) -> Iterator[Tuple[int, int, date, int]]:
+    """Validate CSV rows (user_id, module_name, date, count) and yield one record per completion"""
+    reader = csv.reader(lines)
+    for row in reader:
+        line = reader.line_num
+        if not row or all(not cell.strip() for cell in row):
+            continue
+        if line == 1 and not row[0].strip().lstrip('-').isdigit():
+            continue  # Header
+
+        result.rows += 1
+        if len(row) < 3:
+            result.add_error(line, "ожидается user_id, module_name, date[, count]")
+            continue
+
+        try:
+            user_id = int(row[0])
+        except ValueError:
+            result.add_error(line, f"неверный user_id '{row[0]}'")
+            continue
+
+        module = index.lookup(row[1])
+        if not module:
+            result.add_error(line, f"модуль '{row[1]}' не найден")
+            continue
+
+        try:
+            completed = parse_date(row[2].strip())
+        except ValueError:
+            result.add_error(line, f"неверная дата '{row[2]}'")
+            continue
+
+        count_cell = row[3].strip() if len(row) > 3 else ""
+        if not count_cell:
+            count = 1
+        elif count_cell.isdigit() and 1 <= int(count_cell) <= MAX_COUNT_PER_ROW:
+            count = int(count_cell)
+        else:
+            result.add_error(line, f"неверное количество '{count_cell}'")
+            continue
+
+        # Keep streaming after errors so the report covers the whole file
+        if result.error_count:
+            continue
+
+        result.months.add((completed.year, completed.month))
+        result.records += count
+        for _ in range(count):
+            yield user_id, module['id'], completed, module['points_tenths']
+
+async def import_csv(stream: io.TextIOBase) -> ImportResult:
+    """Validate and load a CSV of completions in one transaction, then refresh rollups"""
+    index = ModuleIndex(await db.get_modules())
+    result = ImportResult()
+
+    async def records() -> AsyncIterator[Tuple[int, int, date, int]]:
+        # Reading and validating run in a worker thread, one batch at a time,
+        # so a large file does not stall other updates during the COPY
+        parsed = iter_records(stream, index, result)
+        while True:
+            batch = await asyncio.to_thread(list, itertools.islice(parsed, PARSE_BATCH_SIZE))
+            if not batch:
+                break
+            for record in batch:
+                yield record
+        if result.error_count:
+            # Raised inside the COPY stream, so the whole transaction rolls back
+            raise ImportValidationError(result)
+
+    await db.bulk_insert_logs(records())
+    await db.refresh_rollups(result.months)
+    logger.info(f"Imported {result.records} completions from {result.rows} rows")
+    return result
+
+async def main(path: str):
+    """CLI entry point: python importer.py <file.csv>"""
+    await db.init()
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            result = await import_csv(f)
+        print(f"Imported {result.records} completions from {result.rows} rows")
+    except ImportValidationError as e:
+        print(f"Import aborted: {e.result.error_count} invalid rows", file=sys.stderr)
+        for error in e.result.errors:
+            print(f"  {error}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python importer.py <file.csv>", file=sys.stderr)
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(sys.argv[1]))
@@ -0,0 +1,86 @@
+from aiogram import Bot, Router
+from aiogram.types import (
+    InlineQuery, ChosenInlineResult, InlineQueryResultArticle, InputTextMessageContent, Update
+)
+import html
+import logging
+
+from database import db
+from config import INLINE_CACHE_TIME, INLINE_RESULTS_LIMIT
+from utils import format_tenths
+from catalog import catalog
+from middleware import seconds_until_close
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+def module_result(module: dict) -> InlineQueryResultArticle:
+    """Inline result logging a module; its id is the module id
+
+    The posted text only names the module: the completion is recorded
+    afterwards from the chosen result and may still be refused.
+    """
+    name = html.escape(module['name'])
+    return InlineQueryResultArticle(
+        id=str(module['id']),
+        title=module['name'],
+        description=f"💎 {format_tenths(module['points_tenths'])} баллов",
+        input_message_content=InputTextMessageContent(
+            message_text=f"📚 Модуль '{name}' ({format_tenths(module['points_tenths'])} баллов)"
+        )
+    )
+
+@router.inline_query()
+async def inline_modules(inline_query: InlineQuery):
+    """Answer @bot <name> with matching modules from the in-memory catalog
+
+    Results do not depend on the user, so Telegram serves repeated queries
+    from its cache for everyone without asking the bot again. The cache
+    never outlives the logging window.
+    """
+    try:
+        await catalog.ensure_fresh()
+        modules = catalog.index.search(inline_query.query, INLINE_RESULTS_LIMIT)
+        await inline_query.answer(
+            [module_result(module) for module in modules],
+            cache_time=min(INLINE_CACHE_TIME, seconds_until_close()),
+            is_personal=False
+        )
+    except Exception as e:
+        logger.error(f"Error in inline_modules: {e}")
+
+@router.chosen_inline_result()
+async def inline_module_chosen(chosen: ChosenInlineResult, event_update: Update, bot: Bot):
+    """Record the completion of a module picked in inline mode
+
+    Needs inline feedback enabled for the bot in @BotFather. Telegram does
+    not say which chat the result was sent to, so it is not attributed.
+    The message is already posted by then, so the user gets a private
+    message whenever the completion is not recorded right away.
+    """
+    user_id = chosen.from_user.id
+    notice = None
+    try:
+        await catalog.ensure_fresh()
+        module = catalog.index.get(int(chosen.result_id))
+        if not module:
+            logger.warning(f"Unknown module {chosen.result_id} chosen inline by {user_id}")
+            notice = "❌ Модуль не найден и не записан"
+        else:
+            # The update id makes a redelivered choice a no-op
+            result = await db.record_completion(user_id, module['id'], f"inline:{event_update.update_id}")
+            logger.info(f"Inline completion of '{module['name']}' by {user_id}: {result}")
+            if result == 'queued':
+                notice = (
+                    f"⏳ База данных недоступна: модуль '{html.escape(module['name'])}' "
+                    "будет записан автоматически"
+                )
+    except Exception as e:
+        logger.error(f"Error in inline_module_chosen: {e}")
+        notice = "❌ Не удалось записать модуль, добавьте его через /modules"
+
+    if notice:
+        try:
+            await bot.send_message(user_id, notice)
+        except Exception as e:
+            logger.warning(f"Could not notify {user_id} about inline completion: {e}")
@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from database import db
+from cache import TTLCache
+from config import (
+    TIMEZONE, POINTS_TO_MONEY_RATE, LEADERBOARD_PAGE_SIZE, LEADERBOARD_REFRESH_INTERVAL, CHAT_LEADERBOARD_TTL
+)
+from utils import format_points, format_tenths, get_user_display_name, get_rank_emoji, month_bounds, MonthNames, STALE_NOTICE, POINTS_SCALE
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('week', 'month', 'year', 'all')
+PERIOD_ALIASES = {
+    'неделя': 'week', 'месяц': 'month', 'год': 'year', 'все': 'all', 'всё': 'all',
+}
+PERIOD_BUTTONS = {'week': "Неделя", 'month': "Месяц", 'year': "Год", 'all': "Всё время"}
+
+def parse_period(value: Optional[str]) -> Optional[str]:
+    """Resolve period argument, defaulting to month"""
+    if not value:
+        return 'month'
+    value = value.lower()
+    value = PERIOD_ALIASES.get(value, value)
+    return value if value in PERIODS else None
+
+def period_range(period: str, now: datetime) -> Tuple[date, date]:
+    """Get [start, end) dates of a period containing now"""
+    today = now.date()
+    if period == 'week':
+        start = today - timedelta(days=today.weekday())
+        return start, start + timedelta(days=7)
+    if period == 'month':
+        return month_bounds(today.year, today.month)
+    if period == 'year':
+        return date(today.year, 1, 1), date(today.year + 1, 1, 1)
+    return date(1, 1, 1), date(9999, 12, 31)
+
+def period_title(period: str, now: datetime) -> str:
+    """Human-readable period title"""
+    if period == 'week':
+        start, end = period_range(period, now)
+        return f"неделю {start.strftime('%d.%m')}–{(end - timedelta(days=1)).strftime('%d.%m')}"
+    if period == 'month':
+        return f"{MonthNames.get_full_month_name(now.month)} {now.year}"
+    if period == 'year':
+        return f"{now.year} год"
+    return "всё время"
+
+@dataclass
+class LeaderboardSnapshot:
+    """One period's ranking: global rows stay in leaderboard_snapshot, group rows are held here"""
+    period: str
+    size: int
+    title: str
+    version: int
+    expires_at: float = 0.0  # Monotonic time after which the snapshot is checked again
+    rows: Optional[List[Dict]] = None
+    positions: Dict[int, int] = field(default_factory=dict)
+    stale: bool = False  # A refresh failed after this snapshot was built
+    chat_id: Optional[int] = None  # Set for the ranking of one group chat
+
+    def __post_init__(self):
+        if self.rows is not None:
+            self.positions = {row['user_id']: index for index, row in enumerate(self.rows)}
+
+    @property
+    def total_pages(self) -> int:
+        return max(1, math.ceil(self.size / LEADERBOARD_PAGE_SIZE))
+
+class LeaderboardService:
+    """Serves paginated leaderboards from periodically materialized snapshots
+
+    Global snapshots are rebuilt in the database at most once per interval
+    by whichever instance gets there first; pages are read from the table.
+    Rendered page text is cached per snapshot version.
+    """
+
+    def __init__(self):
+        self.snapshots: Dict[str, LeaderboardSnapshot] = {}
+        self.chat_snapshots = TTLCache(maxsize=1024, ttl=CHAT_LEADERBOARD_TTL)
+        self.pages = TTLCache(maxsize=256, ttl=LEADERBOARD_REFRESH_INTERVAL)
+        self.names = TTLCache(maxsize=4096, ttl=24 * 3600)
+        self._version = 0
+        self._lock: Optional[asyncio.Lock] = None  # Created on first use, inside the running loop
+        self._chat_locks: Dict[Tuple[int, str], List] = {}  # (chat, period) -> [lock, requests holding or waiting]
+
+    async def refresh(self, period: Optional[str] = None):
+        """Bring snapshots of one or all periods up to date, rebuilding those older than the interval"""
+        now = datetime.now(TIMEZONE)
+        for name in ([period] if period else PERIODS):
+            start, end = period_range(name, now)
+            state = await db.refresh_leaderboard_snapshot(name, start, end, LEADERBOARD_REFRESH_INTERVAL)
+            # The build time is the same for every instance, so it versions the page cache
+            self.snapshots[name] = LeaderboardSnapshot(
+                name, state['participants'], period_title(name, now),
+                int(state['refreshed_at'].timestamp() * 1_000_000),
+                expires_at=time.monotonic() + max(0.0, LEADERBOARD_REFRESH_INTERVAL - state['age'])
+            )
+
+    async def get_snapshot(self, period: str, chat_id: Optional[int] = None) -> LeaderboardSnapshot:
+        """Get a period snapshot (of one group if chat_id is set), refreshing it if missing or stale
+
+        If the refresh fails, the previous snapshot is returned marked stale.
+        """
+        if chat_id is not None:
+            return await self._get_chat_snapshot(chat_id, period)
+
+        snapshot = self.snapshots.get(period)
+        if snapshot and time.monotonic() < snapshot.expires_at:
+            return snapshot
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            snapshot = self.snapshots.get(period)
+            if not snapshot or time.monotonic() >= snapshot.expires_at:
+                try:
+                    await self.refresh(period)
+                except Exception as e:
+                    if snapshot is None:
+                        raise
+                    # Retried after the next interval rather than by every waiting request
+                    snapshot.expires_at = time.monotonic() + LEADERBOARD_REFRESH_INTERVAL
+                    snapshot.stale = True
+                    logger.warning(f"Leaderboard refresh failed, serving the previous {period} snapshot: {e}")
+            return self.snapshots[period]
+
+    async def _get_chat_snapshot(self, chat_id: int, period: str) -> LeaderboardSnapshot:
+        """Ranking of users who logged in a group, from a small indexed query cached briefly
+
+        Concurrent requests for the same group and period wait for one query.
+        """
+        key = (chat_id, period)
+        snapshot = self.chat_snapshots.get(key)
+        if snapshot is not None:
+            return snapshot
+
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                # Another request may have filled the cache while we waited
+                snapshot = self.chat_snapshots.get(key)
+                if snapshot is not None:
+                    return snapshot
+                return await self._load_chat_snapshot(chat_id, period)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[key]
+
+    async def _load_chat_snapshot(self, chat_id: int, period: str) -> LeaderboardSnapshot:
+        key = (chat_id, period)
+        now = datetime.now(TIMEZONE)
+        start, end = period_range(period, now)
+        try:
+            rows = await db.get_chat_leaderboard(chat_id, start, end)
+        except Exception as e:
+            snapshot = self.chat_snapshots.get_stale(key)
+            if snapshot is None:
+                raise
+            snapshot.stale = True
+            logger.warning(f"Chat leaderboard refresh failed, serving the previous {period} snapshot of {chat_id}: {e}")
+            return snapshot
+
+        self._version += 1
+        snapshot = LeaderboardSnapshot(
+            period, len(rows), period_title(period, now), self._version, rows=rows, chat_id=chat_id
+        )
+        self.chat_snapshots.set(key, snapshot)
+        return snapshot
+
+    async def find_user(self, snapshot: LeaderboardSnapshot, user_id: int) -> Optional[Tuple[int, int]]:
+        """Page and rank of a user in the snapshot, None if not ranked"""
+        if snapshot.rows is not None:
+            index = snapshot.positions.get(user_id)
+            if index is None:
+                return None
+            return index // LEADERBOARD_PAGE_SIZE, snapshot.rows[index]['rank']
+        row = await db.get_leaderboard_position(snapshot.period, user_id)
+        if row is None:
+            return None
+        return (row['position'] - 1) // LEADERBOARD_PAGE_SIZE, row['rank']
+
+    async def _page_rows(self, snapshot: LeaderboardSnapshot, page: int) -> List[Dict]:
+        start = page * LEADERBOARD_PAGE_SIZE
+        if snapshot.rows is not None:
+            return snapshot.rows[start:start + LEADERBOARD_PAGE_SIZE]
+        return await db.get_leaderboard_page(snapshot.period, start, LEADERBOARD_PAGE_SIZE)
+
+    async def get_name(self, bot: Bot, user_id: int) -> str:
+        """Get cached display name of a user"""
+        name = self.names.get(user_id)
+        if name is None:
+            try:
+                name = get_user_display_name(await bot.get_chat(user_id))
+            except Exception:
+                name = f"User{user_id}"
+            self.names.set(user_id, name)
+        return name
+
+    async def render_page(self, bot: Bot, period: str, page: int,
+                          chat_id: Optional[int] = None) -> Tuple[str, InlineKeyboardMarkup]:
+        """Get page text and keyboard, rendering each snapshot page once"""
+        snapshot = await self.get_snapshot(period, chat_id)
+        page = max(0, min(page, snapshot.total_pages - 1))
+        key = (chat_id, period, snapshot.version, page)
+
+        text = self.pages.get(key)
+        if text is None:
+            try:
+                text = await self._render_text(bot, snapshot, page)
+            except Exception:
+                # Pages of a snapshot never change, an expired copy is still right
+                text = self.pages.get_stale(key)
+                if text is None:
+                    raise
+            self.pages.set(key, text)
+
+        if snapshot.stale:
+            text += f"\n\n{STALE_NOTICE}"
+        return text, self._build_keyboard(snapshot, page)
+
+    async def _render_text(self, bot: Bot, snapshot: LeaderboardSnapshot, page: int) -> str:
+        """Render leaderboard page text"""
+        scope = "чата " if snapshot.chat_id is not None else ""
+        if not snapshot.size:
+            return f"📊 Пока нет данных для лидерборда {scope}за {snapshot.title}."
+
+        rows = await self._page_rows(snapshot, page)
+        names = await asyncio.gather(*(self.get_name(bot, row['user_id']) for row in rows))
+
+        text = f"🏆 Лидерборд {scope}за {snapshot.title}\n\n"
+        for row, name in zip(rows, names):
+            tenths = row['total_points_tenths']
+            text += f"{get_rank_emoji(row['rank'])} {name}\n"
+            text += f"   💎 {format_tenths(tenths)} баллов\n"
+            text += f"   💰 {format_points(tenths * POINTS_TO_MONEY_RATE / POINTS_SCALE)} ₽\n\n"
+        text += f"👥 Участников: {snapshot.size}"
+        return text
+
+    def _build_keyboard(self, snapshot: LeaderboardSnapshot, page: int) -> InlineKeyboardMarkup:
+        """Build paging, position and period switch buttons"""
+        period = snapshot.period
+        keyboard = []
+
+        if snapshot.total_pages > 1:
+            pagination_row = []
+            if page > 0:
+                pagination_row.append(InlineKeyboardButton(text="⬅️", callback_data=f"lb_{period}_{page-1}"))
+            pagination_row.append(InlineKeyboardButton(text=f"{page+1}/{snapshot.total_pages}", callback_data="noop"))
+            if page < snapshot.total_pages - 1:
+                pagination_row.append(InlineKeyboardButton(text="➡️", callback_data=f"lb_{period}_{page+1}"))
+            keyboard.append(pagination_row)
+
+        if snapshot.size:
+            keyboard.append([InlineKeyboardButton(text="📍 Моя позиция", callback_data=f"lb_me_{period}")])
+
+        keyboard.append([
+            InlineKeyboardButton(
+                text=f"• {label} •" if name == period else label,
+                callback_data=f"lb_{name}_0"
+            )
+            for name, label in PERIOD_BUTTONS.items()
+        ])
+        return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+# Global leaderboard service instance
+leaderboards = LeaderboardService()
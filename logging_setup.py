@@ -0,0 +1,138 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import traceback
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from config import (
+    LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_WHEN, LOG_QUEUE_SIZE
+)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Update being handled in the current task, set by UpdateOrderingMiddleware
+current_update_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('current_update_id', default=None)
+
+class UpdateContextFilter(logging.Filter):
+    """Stamp records with the id of the update being handled; runs on the emitting thread"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'update_id'):
+            record.update_id = current_update_id.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and update context"""
+
+    EXTRA_FIELDS = ('update_id', 'latency_ms')
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name in self.EXTRA_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LoopQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks the caller
+
+    Messages and tracebacks are rendered here, so records cross threads
+    without references to live objects. Records are dropped, not waited
+    for, when the queue is full; the count is reported with the next one.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip('\n')
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(self._dropped_record())
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _dropped_record(self) -> logging.LogRecord:
+        return logging.LogRecord(
+            __name__, logging.WARNING, __file__, 0,
+            f"Log queue full, {self.dropped} records dropped", None, None
+        )
+
+class LogListener(logging.handlers.QueueListener):
+    """Queue listener that waits for room for its stop marker and can be stopped twice"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+def build_handlers(log_format: str = LOG_FORMAT, log_file: Optional[str] = LOG_FILE) -> List[logging.Handler]:
+    """Stdout and rotating file handlers with the configured formatter (run by the listener thread)"""
+    formatter = JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers: List[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        if LOG_ROTATE_WHEN:
+            handlers.append(logging.handlers.TimedRotatingFileHandler(
+                log_file, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+            ))
+        else:
+            handlers.append(logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+            ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+def setup_logging(handlers: Optional[List[logging.Handler]] = None,
+                  level: str = LOG_LEVEL) -> LogListener:
+    """Route all logging through a bounded queue to a listener thread doing the I/O
+
+    The event loop only copies records into the queue; formatting, writes and
+    rotation happen on the listener thread. The listener is flushed and
+    stopped at exit.
+    """
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = LoopQueueHandler(log_queue)
+    queue_handler.addFilter(UpdateContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = LogListener(
+        log_queue, *(handlers if handlers is not None else build_handlers()), respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,31 +1,52 @@
 import asyncio
 import logging
 import sys
+from typing import Optional
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
-from config import BOT_TOKEN, ADMIN_IDS
+from config import BOT_TOKEN, ADMIN_IDS, CAPTURE_UPDATES_PATH
 from database import db
-from middleware import TimeRestrictionMiddleware
+from middleware import TimeRestrictionMiddleware, update_ordering, callback_dedup
+from capture import UpdateCaptureMiddleware
+from logging_setup import setup_logging
+from ratelimit import outbound_limiter
 from scheduler import Scheduler
 
 # Import all handlers
-import handlers
+import handles
 import advanced_handlers
 import admin_handlers
+import inline_handlers
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('bot.log')
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def create_dispatcher(capture_path: Optional[str] = None, time_restricted: bool = True) -> Dispatcher:
+    """Build the dispatcher with all middleware and routers (shared by the bot and replay.py)"""
+    dp = Dispatcher()
+    
+    # Add middleware; capture goes first to timestamp updates before any queueing
+    if capture_path:
+        capture = UpdateCaptureMiddleware(capture_path)
+        dp.update.outer_middleware(capture)
+        dp.shutdown.register(capture.close)
+        logger.info(f"Capturing updates to {capture_path}")
+    dp.update.outer_middleware(update_ordering)
+    if time_restricted:
+        dp.message.middleware(TimeRestrictionMiddleware())
+        dp.callback_query.middleware(TimeRestrictionMiddleware())
+        dp.inline_query.middleware(TimeRestrictionMiddleware())
+        dp.chosen_inline_result.middleware(TimeRestrictionMiddleware())
+    dp.callback_query.middleware(callback_dedup)
+    
+    # Register routers
+    dp.include_router(handles.router)
+    dp.include_router(advanced_handlers.router)
+    dp.include_router(admin_handlers.router)
+    dp.include_router(inline_handlers.router)
+    return dp
+
 async def main():
     """Main function to start the bot"""
     
@@ -39,18 +60,10 @@ async def main():
         token=BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
+    bot.session.middleware(outbound_limiter)
     
     # Initialize dispatcher
-    dp = Dispatcher()
-    
-    # Add middleware
-    dp.message.middleware(TimeRestrictionMiddleware())
-    dp.callback_query.middleware(TimeRestrictionMiddleware())
-    
-    # Register routers
-    dp.include_router(handlers.router)
-    dp.include_router(advanced_handlers.router)
-    dp.include_router(admin_handlers.router)
+    dp = create_dispatcher(capture_path=CAPTURE_UPDATES_PATH)
     
     # Initialize database
     try:
@@ -106,6 +119,7 @@ async def main():
         logger.info("Bot stopped and cleaned up")
 
 if __name__ == "__main__":
+    setup_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
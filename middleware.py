@@ -1,18 +1,35 @@
 from aiogram import BaseMiddleware
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, InlineQuery, ChosenInlineResult, InlineQueryResultsButton
+import asyncio
+import time
+from collections import deque
 from datetime import datetime
-from config import TIMEZONE, ALLOWED_HOUR_START, ALLOWED_HOUR_END
+from typing import Dict, List, Optional, Tuple
+from cache import TTLCache
+from config import (
+    TIMEZONE, ALLOWED_HOUR_START, ALLOWED_HOUR_END, QUEUE_DELAY_WARNING,
+    IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS, SLOW_UPDATE_WARNING
+)
+from logging_setup import current_update_id
 import logging
 
 logger = logging.getLogger(__name__)
 
+def seconds_until_close(now: Optional[datetime] = None) -> int:
+    """Seconds left in today's logging window, 0 outside of it"""
+    now = now or datetime.now(TIMEZONE)
+    if not ALLOWED_HOUR_START <= now.hour <= ALLOWED_HOUR_END:
+        return 0
+    close = now.replace(hour=ALLOWED_HOUR_END, minute=59, second=59, microsecond=0)
+    return max(0, int((close - now).total_seconds()))
+
 class TimeRestrictionMiddleware(BaseMiddleware):
     """Middleware to restrict bot usage to specific hours (18:00-23:59)"""
     
     def __init__(self):
         super().__init__()
-        self.restricted_commands = ['/modules', '/add']
-        self.restricted_callbacks = ['module_', 'add_', 'undo']
+        self.restricted_commands = ['/modules', '/add', '/undo']
+        self.restricted_callbacks = ['module_', 'add_', 'undo', 'hist_del_']
     
     async def __call__(self, handler, event, data):
         # Allow admin commands and non-restricted commands always
@@ -39,6 +56,28 @@ class TimeRestrictionMiddleware(BaseMiddleware):
                     )
                     return
         
+        elif isinstance(event, InlineQuery):
+            # Inline mode only logs modules; the short cache lets the answer change when the window opens
+            if not self._is_allowed_time():
+                await event.answer(
+                    [], cache_time=60, is_personal=False,
+                    button=InlineQueryResultsButton(text="⏰ Добавление модулей с 18:00 до 23:59", start_parameter="time")
+                )
+                return
+        
+        elif isinstance(event, ChosenInlineResult):
+            if not self._is_allowed_time():
+                # The result was already posted, so tell the user it did not count
+                logger.info(f"Inline completion by {event.from_user.id} outside allowed hours ignored")
+                try:
+                    await data["bot"].send_message(
+                        event.from_user.id,
+                        "⏰ Модуль не записан: добавление модулей доступно только с 18:00 до 23:59"
+                    )
+                except Exception as e:
+                    logger.warning(f"Could not notify {event.from_user.id} about ignored inline completion: {e}")
+                return
+        
         return await handler(event, data)
     
     def _is_allowed_time(self) -> bool:
@@ -46,3 +85,140 @@ class TimeRestrictionMiddleware(BaseMiddleware):
         now = datetime.now(TIMEZONE)
         current_hour = now.hour
         return ALLOWED_HOUR_START <= current_hour <= ALLOWED_HOUR_END
+
+class UpdateOrderingMiddleware(BaseMiddleware):
+    """Outer update middleware: one update per user at a time
+    
+    Updates of the same user are processed in arrival order, so a double tap
+    or a tap followed by undo cannot interleave. Locks exist only while a user
+    has updates in flight. Concurrency across users is only bounded where it
+    matters, by the connection slots of Database.acquire.
+    """
+    
+    def __init__(self, window: int = 1000):
+        super().__init__()
+        self.locks: Dict[int, List] = {}  # user_id -> [lock, updates holding or waiting for it]
+        self.in_flight = 0
+        self.processed = 0
+        self.max_delay = 0.0
+        self.delays = deque(maxlen=window)  # Recent queueing delays, seconds
+    
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        received = time.monotonic()
+        
+        if user is None:
+            self._record_delay(0.0)
+            return await self._run(handler, event, data)
+        
+        entry = self.locks.get(user.id)
+        if entry is None:
+            entry = self.locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                self._record_delay(time.monotonic() - received)
+                return await self._run(handler, event, data)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[user.id]
+    
+    async def _run(self, handler, event, data):
+        self.in_flight += 1
+        # Log records emitted while handling carry the update id
+        token = current_update_id.set(getattr(event, 'update_id', None))
+        started = time.monotonic()
+        try:
+            return await handler(event, data)
+        finally:
+            latency = time.monotonic() - started
+            extra = {'latency_ms': round(latency * 1000, 1)}
+            if latency >= SLOW_UPDATE_WARNING:
+                logger.warning(f"Update handled in {latency:.2f}s", extra=extra)
+            else:
+                logger.debug(f"Update handled in {latency * 1000:.0f} ms", extra=extra)
+            current_update_id.reset(token)
+            self.in_flight -= 1
+            self.processed += 1
+    
+    def _record_delay(self, delay: float):
+        self.delays.append(delay)
+        self.max_delay = max(self.max_delay, delay)
+        if delay >= QUEUE_DELAY_WARNING:
+            logger.warning(f"Update waited {delay:.2f}s for processing")
+    
+    def stats(self) -> Dict:
+        """Queueing delay percentiles over recent updates and current load"""
+        delays = sorted(self.delays)
+        
+        def percentile(q: float) -> float:
+            return delays[min(len(delays) - 1, int(q * len(delays)))] if delays else 0.0
+        
+        return {
+            'processed': self.processed,
+            'in_flight': self.in_flight,
+            'users_waiting': sum(1 for _, count in self.locks.values() if count > 1),
+            'delay_p50': percentile(0.5),
+            'delay_p95': percentile(0.95),
+            'delay_max': self.max_delay
+        }
+
+# Global update ordering middleware, registered in main.py and read by admin stats
+update_ordering = UpdateOrderingMiddleware()
+
+class CallbackIdempotencyMiddleware(BaseMiddleware):
+    """Drop repeated deliveries of state-changing callbacks before they reach the database
+    
+    A callback is a duplicate if its query id was already seen (redelivery) or
+    if the same action was already taken on the same message by the same user
+    (double tap, laggy client). The action key is also passed to handlers as
+    `request_id`, so inserts stay idempotent after the in-memory entry expires.
+    Handlers catch their own errors and call forget() when the action may
+    be tapped again.
+    """
+    
+    def __init__(self, prefixes: Tuple[str, ...] = ('module_', 'add_', 'undo'),
+                 ttl: float = IDEMPOTENCY_TTL, maxsize: int = IDEMPOTENCY_MAX_KEYS):
+        super().__init__()
+        self.prefixes = prefixes
+        self.seen = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.duplicates = 0
+    
+    @staticmethod
+    def action_key(callback: CallbackQuery) -> Optional[str]:
+        """Key of the tapped action: callback prefix, message and user"""
+        if callback.message is not None:
+            target = f"{callback.message.chat.id}:{callback.message.message_id}"
+        elif callback.inline_message_id:
+            target = callback.inline_message_id
+        else:
+            return None
+        action = callback.data.split("_")[0]
+        return f"{action}:{target}:{callback.from_user.id}"
+    
+    def forget(self, callback: CallbackQuery):
+        """Allow the action to be retried; called by handlers when it failed"""
+        key = self.action_key(callback)
+        if key:
+            self.seen.pop(key)
+    
+    async def __call__(self, handler, event, data):
+        if not isinstance(event, CallbackQuery) or not event.data or not event.data.startswith(self.prefixes):
+            return await handler(event, data)
+        
+        key = self.action_key(event)
+        if event.id in self.seen or (key and key in self.seen):
+            self.duplicates += 1
+            await event.answer("✅ Уже обработано")
+            return
+        
+        # Marked before the handler runs, so copies arriving meanwhile are dropped too
+        self.seen.set(event.id, True)
+        if key:
+            self.seen.set(key, True)
+            data["request_id"] = key
+        return await handler(event, data)
+
+# Global callback idempotency middleware, registered in main.py
+callback_dedup = CallbackIdempotencyMiddleware()
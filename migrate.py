@@ -0,0 +1,37 @@
+import asyncio
+import logging
+import sys
+
+import asyncpg
+
+from config import DATABASE_URL
+from migrations import LATEST_VERSION, current_version, discover, migrate
+
+USAGE = "Usage: python migrate.py [status | up [version]]"
+
+async def main(command: str, target: int = None):
+    """CLI entry point: show or apply schema migrations"""
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        version = await current_version(conn)
+        if command == "status":
+            print(f"Schema version: {version}, latest: {LATEST_VERSION}")
+            for number, name in discover():
+                print(f"  {'applied' if number <= version else 'pending'}  {name}")
+            return
+        
+        applied = await migrate(conn, target)
+        if applied:
+            print(f"Applied migrations: {', '.join(str(number) for number in applied)}")
+        else:
+            print(f"Schema is up to date (version {version})")
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    args = sys.argv[1:] or ["up"]
+    if args[0] not in ("status", "up") or len(args) > 2 or (len(args) == 2 and not args[1].isdigit()):
+        print(USAGE, file=sys.stderr)
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args[0], int(args[1]) if len(args) == 2 else None))
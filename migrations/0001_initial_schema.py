@@ -0,0 +1,171 @@
+"""Tables of the bot, including conversion of a legacy unpartitioned log table"""
+import logging
+
+from config import DEFAULT_MODULES
+from database import create_partition
+from utils import shift_month
+
+logger = logging.getLogger(__name__)
+
+async def up(conn):
+    # Modules table
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS modules (
+            id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL,
+            points NUMERIC NOT NULL
+        )
+    """)
+    
+    # User module logs table, range-partitioned by month
+    relkind = await conn.fetchval(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass('user_module_logs')"
+    )
+    if relkind is None:
+        await create_partitioned_logs(conn)
+    elif relkind == 'r':
+        await convert_logs_to_partitioned(conn)
+    
+    # Points awarded are snapshotted at insert time as integer tenths
+    await conn.execute(
+        "ALTER TABLE user_module_logs ADD COLUMN IF NOT EXISTS points_tenths INT"
+    )
+    backfilled = await conn.execute("""
+        UPDATE user_module_logs uml
+        SET points_tenths = ROUND(m.points * 10)::INT
+        FROM modules m
+        WHERE uml.module_id = m.id AND uml.points_tenths IS NULL
+    """)
+    if backfilled != "UPDATE 0":
+        logger.info(f"Backfilled points_tenths: {backfilled}")
+    await conn.execute(
+        "ALTER TABLE user_module_logs ALTER COLUMN points_tenths SET NOT NULL"
+    )
+    
+    # Optional client-supplied id that makes repeated inserts of one action no-ops
+    await conn.execute(
+        "ALTER TABLE user_module_logs ADD COLUMN IF NOT EXISTS request_id TEXT"
+    )
+    
+    # Admins table
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id BIGINT PRIMARY KEY
+        )
+    """)
+    
+    # Monthly summary table
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS monthly_summary (
+            user_id BIGINT,
+            year INT,
+            month INT,
+            total_points NUMERIC,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, year, month)
+        )
+    """)
+    await conn.execute("""
+        ALTER TABLE monthly_summary
+        ADD COLUMN IF NOT EXISTS completions INT,
+        ADD COLUMN IF NOT EXISTS archived BOOLEAN NOT NULL DEFAULT FALSE
+    """)
+    
+    # Daily rollup of archived months
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_daily_summary (
+            user_id BIGINT NOT NULL,
+            date DATE NOT NULL,
+            points NUMERIC NOT NULL,
+            completions INT NOT NULL,
+            PRIMARY KEY (user_id, date)
+        )
+    """)
+    
+    # Months whose raw logs were compacted into the summaries
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS log_archive (
+            year INT,
+            month INT,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (year, month)
+        )
+    """)
+    
+    # Per-user reminder preferences (NULL time = default evening window)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS reminder_settings (
+            user_id BIGINT PRIMARY KEY,
+            remind_at TIME,
+            enabled BOOLEAN NOT NULL DEFAULT TRUE,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Ranked leaderboard snapshots per period
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS leaderboard_snapshot (
+            period TEXT NOT NULL,
+            user_id BIGINT NOT NULL,
+            rank INT NOT NULL,
+            total_points NUMERIC NOT NULL,
+            completions INT NOT NULL,
+            refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (period, user_id)
+        )
+    """)
+    
+    # Default modules for an empty catalog
+    if await conn.fetchval("SELECT COUNT(*) FROM modules") == 0:
+        await conn.executemany(
+            "INSERT INTO modules (name, points) VALUES ($1, $2)", DEFAULT_MODULES
+        )
+        logger.info("Default modules populated")
+
+async def create_partitioned_logs(conn):
+    """Create the partitioned user_module_logs table with a default partition"""
+    await conn.execute("""
+        CREATE TABLE user_module_logs (
+            id SERIAL,
+            user_id BIGINT NOT NULL,
+            module_id INT NOT NULL REFERENCES modules(id),
+            date DATE NOT NULL DEFAULT CURRENT_DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            points_tenths INT NOT NULL,
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date)
+    """)
+    await conn.execute(
+        "CREATE TABLE user_module_logs_default PARTITION OF user_module_logs DEFAULT"
+    )
+
+async def convert_logs_to_partitioned(conn):
+    """Move a legacy plain user_module_logs table into monthly partitions"""
+    await conn.execute("ALTER TABLE user_module_logs RENAME TO user_module_logs_legacy")
+    await conn.execute("DROP INDEX IF EXISTS idx_user_module_logs_user_date")
+    await create_partitioned_logs(conn)
+    
+    bounds = await conn.fetchrow(
+        "SELECT MIN(date) AS first, MAX(date) AS last FROM user_module_logs_legacy"
+    )
+    if bounds['first'] is not None:
+        year, month = bounds['first'].year, bounds['first'].month
+        while (year, month) <= (bounds['last'].year, bounds['last'].month):
+            await create_partition(conn, year, month)
+            year, month = shift_month(year, month, 1)
+    
+    await conn.execute("""
+        INSERT INTO user_module_logs (id, user_id, module_id, date, created_at, points_tenths)
+        SELECT l.id, l.user_id, l.module_id, l.date, l.created_at, ROUND(m.points * 10)::INT
+        FROM user_module_logs_legacy l
+        JOIN modules m ON l.module_id = m.id
+    """)
+    await conn.execute("""
+        SELECT setval(
+            pg_get_serial_sequence('user_module_logs', 'id'),
+            COALESCE((SELECT MAX(id) FROM user_module_logs_legacy), 0) + 1,
+            false
+        )
+    """)
+    await conn.execute("DROP TABLE user_module_logs_legacy")
+    logger.info("user_module_logs converted to a partitioned table")
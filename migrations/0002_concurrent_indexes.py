@@ -0,0 +1,27 @@
+"""Secondary indexes, built without blocking writes"""
+from migrations import create_index_concurrently
+
+TRANSACTIONAL = False
+
+async def up(conn):
+    await create_index_concurrently(
+        conn, "idx_user_module_logs_user_date", "user_module_logs", "user_id, date"
+    )
+    
+    # Unique indexes on a partitioned table must include the partition key
+    await create_index_concurrently(
+        conn, "idx_user_module_logs_request", "user_module_logs", "request_id, date", unique=True
+    )
+    
+    # Newest-first scans of one user's completions (history, undo)
+    await create_index_concurrently(
+        conn, "idx_user_module_logs_user_created", "user_module_logs", "user_id, created_at DESC, id DESC"
+    )
+    
+    await create_index_concurrently(
+        conn, "idx_monthly_summary_user_year_month", "monthly_summary", "user_id, year, month"
+    )
+    
+    await create_index_concurrently(
+        conn, "idx_leaderboard_snapshot_period_rank", "leaderboard_snapshot", "period, rank"
+    )
@@ -0,0 +1,24 @@
+"""Attribute completions to the chat they were logged in, for per-group leaderboards"""
+from migrations import create_index_concurrently
+
+TRANSACTIONAL = False
+
+async def up(conn):
+    # Nullable without a default: a catalog-only change, existing rows stay unattributed
+    await conn.execute("ALTER TABLE user_module_logs ADD COLUMN IF NOT EXISTS chat_id BIGINT")
+    
+    # Per-chat daily totals of archived months, filled alongside user_daily_summary
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_daily_summary (
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            date DATE NOT NULL,
+            points NUMERIC NOT NULL,
+            completions INT NOT NULL,
+            PRIMARY KEY (chat_id, date, user_id)
+        )
+    """)
+    
+    await create_index_concurrently(
+        conn, "idx_user_module_logs_chat_date", "user_module_logs", "chat_id, date"
+    )
@@ -0,0 +1,16 @@
+"""Store rollup and snapshot totals as integer tenths, like user_module_logs.points_tenths"""
+
+# (table, NUMERIC column, integer tenths column)
+COLUMNS = (
+    ("user_daily_summary", "points", "points_tenths"),
+    ("chat_daily_summary", "points", "points_tenths"),
+    ("monthly_summary", "total_points", "total_points_tenths"),
+    ("leaderboard_snapshot", "total_points", "total_points_tenths"),
+)
+
+async def up(conn):
+    for table, column, tenths in COLUMNS:
+        await conn.execute(f"""
+            ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT USING ROUND({column} * 10)::BIGINT
+        """)
+        await conn.execute(f"ALTER TABLE {table} RENAME COLUMN {column} TO {tenths}")
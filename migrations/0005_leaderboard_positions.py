@@ -0,0 +1,26 @@
+"""Serve leaderboard pages from leaderboard_snapshot, shared by every bot instance"""
+
+async def up(conn):
+    # Snapshots are rebuilt on the next refresh, nothing to keep
+    await conn.execute("DELETE FROM leaderboard_snapshot")
+    
+    # Position is the unique row order within a period (ranks tie), pages are ranges of it
+    await conn.execute("ALTER TABLE leaderboard_snapshot ADD COLUMN position INT NOT NULL")
+    await conn.execute("DROP INDEX IF EXISTS idx_leaderboard_snapshot_period_rank")
+    # A plain build is safe here, unlike the CONCURRENTLY rule for index migrations: the
+    # table was emptied above and ALTER TABLE already holds ACCESS EXCLUSIVE on it until
+    # commit, so the build is instant and blocks nothing more. The DELETE and the NOT NULL
+    # column must share one transaction, which CONCURRENTLY cannot run in.
+    await conn.execute("""
+        CREATE UNIQUE INDEX idx_leaderboard_snapshot_period_position
+        ON leaderboard_snapshot (period, position)
+    """)
+    
+    # One row per period: when its snapshot was built, locked while it is rebuilt
+    await conn.execute("""
+        CREATE TABLE leaderboard_refresh (
+            period TEXT PRIMARY KEY,
+            refreshed_at TIMESTAMPTZ NOT NULL,
+            participants INT NOT NULL
+        )
+    """)
@@ -0,0 +1,130 @@
+"""Versioned schema migrations
+
+Each migration is a module named NNNN_description.py with an `async def up(conn)`.
+Migrations run in a transaction unless the module sets TRANSACTIONAL = False
+(required for CREATE INDEX CONCURRENTLY); those must be safe to re-run.
+"""
+import importlib
+import logging
+import pkgutil
+import re
+from typing import List, Optional, Sequence, Tuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_RE = re.compile(r"^(\d{4})_(\w+)$")
+MIGRATIONS_LOCK_ID = 7_302_481_116  # pg advisory lock key shared by all migration runners
+
+def discover() -> List[Tuple[int, str]]:
+    """List (version, module name) of available migrations in order, without importing them"""
+    migrations = []
+    for info in pkgutil.iter_modules(__path__):
+        match = MIGRATION_RE.match(info.name)
+        if match:
+            migrations.append((int(match.group(1)), info.name))
+    migrations.sort()
+    versions = [version for version, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions: {versions}")
+    return migrations
+
+LATEST_VERSION = max((version for version, _ in discover()), default=0)
+
+async def current_version(conn: asyncpg.Connection) -> int:
+    """Applied schema version, 0 for a database that was never migrated"""
+    try:
+        return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+async def migrate(conn: asyncpg.Connection, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to target (latest by default), returning applied versions
+    
+    A session advisory lock makes concurrent runners (several bot instances,
+    the CLI) wait for each other; whoever gets the lock second sees the
+    migrations already applied.
+    """
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_ID)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        applied_versions = {row['version'] for row in await conn.fetch("SELECT version FROM schema_version")}
+        
+        applied = []
+        for version, name in discover():
+            if version in applied_versions or (target is not None and version > target):
+                continue
+            
+            module = importlib.import_module(f"{__name__}.{name}")
+            logger.info(f"Applying migration {name}")
+            if getattr(module, "TRANSACTIONAL", True):
+                async with conn.transaction():
+                    await module.up(conn)
+                    await _record(conn, version, name)
+            else:
+                await module.up(conn)
+                await _record(conn, version, name)
+            applied.append(version)
+        return applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
+
+async def _record(conn: asyncpg.Connection, version: int, name: str):
+    await conn.execute("INSERT INTO schema_version (version, name) VALUES ($1, $2)", version, name)
+
+async def create_index_concurrently(conn: asyncpg.Connection, name: str, table: str,
+                                    columns: str, unique: bool = False):
+    """Create an index without blocking writes, re-runnable after a failure
+    
+    Partitioned tables do not support CONCURRENTLY, so the parent index is
+    created ON ONLY the parent, each partition is indexed concurrently and
+    attached; the parent index becomes valid once every partition is attached.
+    """
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    relkind = await conn.fetchval("SELECT relkind FROM pg_class WHERE oid = to_regclass($1)", table)
+    
+    if relkind != 'p':
+        # A failed concurrent build leaves an invalid index behind: rebuild it
+        valid = await conn.fetchval("""
+            SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)
+        """, name)
+        if valid is False:
+            await conn.execute(f"DROP INDEX CONCURRENTLY {name}")
+        await conn.execute(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+        return
+    
+    await conn.execute(f"CREATE {kind} IF NOT EXISTS {name} ON ONLY {table} ({columns})")
+    partitions = await _unindexed_partitions(conn, name, table)
+    for partition in partitions:
+        child = f"{partition}_{name.removeprefix('idx_')}"[:63]
+        valid = await conn.fetchval("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", child)
+        if valid is False:
+            await conn.execute(f"DROP INDEX CONCURRENTLY {child}")
+        await conn.execute(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {child} ON {partition} ({columns})")
+        await conn.execute(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+    if partitions:
+        logger.info(f"Index {name} built on {len(partitions)} partitions")
+
+async def _unindexed_partitions(conn: asyncpg.Connection, name: str, table: str) -> Sequence[str]:
+    """Partitions of a table that have no child of the given partitioned index attached"""
+    rows = await conn.fetch("""
+        SELECT part.relname
+        FROM pg_inherits inh
+        JOIN pg_class part ON part.oid = inh.inhrelid
+        WHERE inh.inhparent = to_regclass($1)
+        AND NOT EXISTS (
+            SELECT 1
+            FROM pg_inherits idx_inh
+            JOIN pg_index idx ON idx.indexrelid = idx_inh.inhrelid
+            WHERE idx_inh.inhparent = to_regclass($2) AND idx.indrelid = part.oid
+        )
+        ORDER BY part.relname
+    """, table, name)
+    return [row['relname'] for row in rows]
@@ -0,0 +1,141 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from config import PROFILE_SAMPLE_INTERVAL
+
+MAX_STACK_DEPTH = 64
+
+def frame_label(code) -> str:
+    """Stack frame label: file and function"""
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+@dataclass
+class ProfileResult:
+    """Collapsed stacks of a profiling run"""
+    seconds: float
+    interval: float
+    samples: int = 0
+    stacks: Counter = field(default_factory=Counter)  # "thread;outer;...;leaf" -> samples
+    loop_samples: int = 0
+    loop_idle_samples: int = 0
+    
+    def collapsed(self) -> str:
+        """Stacks in collapsed format (flamegraph.pl, speedscope)"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+    
+    def top_functions(self, limit: int = 15) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        """Top (function, samples) by self time and by inclusive time, idle waits excluded"""
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames or frames[-1] == "<idle>":
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        return own.most_common(limit), inclusive.most_common(limit)
+    
+    @property
+    def loop_busy(self) -> float:
+        """Share of samples in which the event loop thread was running code"""
+        if not self.loop_samples:
+            return 0.0
+        return 1 - self.loop_idle_samples / self.loop_samples
+
+class SamplingProfiler:
+    """Samples Python stacks of all threads from a background thread
+    
+    Nothing is installed in the interpreter (no sys.setprofile hooks), so
+    there is no cost while the profiler is not running. Coroutines show up
+    on the event loop thread's stack while they execute; work moved off the
+    loop with asyncio.to_thread appears under its worker thread.
+    """
+    
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._result: Optional[ProfileResult] = None
+        self._started = 0.0
+    
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+    
+    def start(self):
+        """Start sampling; the calling thread is treated as the event loop thread"""
+        if self._thread is not None:
+            raise RuntimeError("Profiler is already running")
+        self._stop.clear()
+        self._result = ProfileResult(seconds=0.0, interval=self.interval)
+        self._started = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._run, args=(threading.get_ident(),), name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+    
+    def stop(self) -> ProfileResult:
+        """Stop sampling and return collected stacks"""
+        if self._thread is None:
+            raise RuntimeError("Profiler is not running")
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._result.seconds = time.monotonic() - self._started
+        return self._result
+    
+    def _run(self, loop_thread_id: int):
+        own_id = threading.get_ident()
+        result = self._result
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = self._collapse(frame)
+                idle = stack[-1] == "<idle>"
+                if thread_id == loop_thread_id:
+                    result.loop_samples += 1
+                    result.loop_idle_samples += idle
+                elif idle:
+                    # Idle worker threads only add noise
+                    continue
+                result.stacks[";".join([names.get(thread_id, str(thread_id))] + stack)] += 1
+            result.samples += 1
+    
+    @staticmethod
+    def _collapse(frame) -> List[str]:
+        """Frames from outermost to innermost; waiting in a selector or a lock is marked idle"""
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(frame_label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        leaf = stack[-1] if stack else ""
+        if leaf.startswith(("selectors.py:", "threading.py:wait", "queue.py:get")):
+            stack.append("<idle>")
+        return stack
+
+def format_summary(result: ProfileResult, limit: int = 15) -> str:
+    """Plain text summary of the hottest functions"""
+    own, inclusive = result.top_functions(limit)
+    total = max(1, sum(count for _, count in own))
+    
+    lines = [
+        f"Profile: {result.seconds:.1f}s, {result.samples} samples every {result.interval * 1000:.0f} ms",
+        f"Event loop busy: {result.loop_busy:.0%}",
+        "",
+        "Top by self time:"
+    ]
+    lines += [f"{count / total:6.1%}  {name}" for name, count in own]
+    lines += ["", "Top by inclusive time:"]
+    lines += [f"{count / total:6.1%}  {name}" for name, count in inclusive]
+    return "\n".join(lines)
+
+# Global profiler instance, one run at a time
+profiler = SamplingProfiler()
@@ -0,0 +1,151 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE, TELEGRAM_CHAT_BURST,
+    TELEGRAM_RETRY_ATTEMPTS, TELEGRAM_MAX_RETRY_AFTER
+)
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BROADCAST = 0, 1
+
+# Priority of API calls made by the current task; handlers reply at INTERACTIVE
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar('outbound_priority', default=INTERACTIVE)
+
+# Methods that post into a chat and count against its per-chat limit
+CHAT_METHOD_PREFIXES = ('Send', 'Edit', 'Copy', 'Forward')
+
+@contextmanager
+def broadcast_priority():
+    """Mark API calls made inside the block as background traffic that yields to user replies"""
+    token = _priority.set(BROADCAST)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """Session middleware pacing every Bot API call of the process
+
+    Calls pass a global rate limit in priority order (replies before
+    broadcasts) and, when they post into a chat, a per-chat token bucket
+    (private chats and groups have separate rates). A RetryAfter from
+    Telegram pauses the chat (or everything, if the call had no chat) and
+    the call is queued again instead of failing.
+    """
+
+    def __init__(self, rate: float = TELEGRAM_GLOBAL_RATE, max_chats: int = 10000):
+        self.interval = 1.0 / rate
+        self.max_chats = max_chats
+        self.next_slot = 0.0
+        self.paused_until = 0.0
+        self.heap: List[Tuple[int, int, asyncio.Future]] = []
+        self.chats: Dict[int, Tuple[float, float]] = {}  # chat_id -> (tokens, updated at)
+        self.sent = [0, 0]  # Per priority
+        self.retries = 0
+        self._seq = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = self._chat_of(method)
+        priority = _priority.get()
+        for attempt in range(TELEGRAM_RETRY_ATTEMPTS + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == TELEGRAM_RETRY_ATTEMPTS or e.retry_after > TELEGRAM_MAX_RETRY_AFTER:
+                    raise
+                self.retries += 1
+                logger.warning(f"Flood limit on {type(method).__name__} to chat {chat_id}, retrying in {e.retry_after}s")
+                self._pause(chat_id, e.retry_after)
+
+    def _chat_of(self, method) -> Optional[int]:
+        chat_id = getattr(method, 'chat_id', None)
+        if isinstance(chat_id, int) and type(method).__name__.startswith(CHAT_METHOD_PREFIXES):
+            return chat_id
+        return None
+
+    def _chat_rate(self, chat_id: int) -> float:
+        return TELEGRAM_CHAT_RATE if chat_id > 0 else TELEGRAM_GROUP_RATE
+
+    async def _acquire(self, chat_id: Optional[int], priority: int):
+        if chat_id is not None:
+            delay = self._reserve_chat(chat_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        now = time.monotonic()
+        if not self.heap and now >= self.next_slot and now >= self.paused_until:
+            self.next_slot = now + self.interval
+            self.sent[priority] += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.heap, (priority, next(self._seq), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+        self.sent[priority] += 1
+
+    async def _pump(self):
+        """Release queued calls one global slot at a time, lowest priority value first"""
+        while self.heap:
+            wait = max(self.next_slot, self.paused_until) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self.heap)
+            if future.done():  # Caller was cancelled while queued
+                continue
+            future.set_result(None)
+            self.next_slot = time.monotonic() + self.interval
+
+    def _reserve_chat(self, chat_id: int) -> float:
+        """Take a token from the chat's bucket, return how long to wait for it"""
+        rate = self._chat_rate(chat_id)
+        now = time.monotonic()
+        bucket = self.chats.get(chat_id)
+        tokens = TELEGRAM_CHAT_BURST if bucket is None else min(
+            TELEGRAM_CHAT_BURST, bucket[0] + (now - bucket[1]) * rate
+        )
+        tokens -= 1
+        if bucket is None and len(self.chats) >= self.max_chats:
+            self._prune(now)
+        self.chats[chat_id] = (tokens, now)
+        return -tokens / rate if tokens < 0 else 0.0
+
+    def _prune(self, now: float):
+        """Forget chats whose buckets have refilled"""
+        for chat_id, (tokens, updated) in list(self.chats.items()):
+            if tokens + (now - updated) * self._chat_rate(chat_id) >= TELEGRAM_CHAT_BURST:
+                del self.chats[chat_id]
+
+    def _pause(self, chat_id: Optional[int], seconds: float):
+        now = time.monotonic()
+        if chat_id is None:
+            self.paused_until = max(self.paused_until, now + seconds)
+        else:
+            self.chats[chat_id] = (-seconds * self._chat_rate(chat_id), now)
+
+    def stats(self) -> Dict:
+        """Queue length and calls sent per priority since start"""
+        return {
+            'queued': sum(1 for _, _, future in self.heap if not future.done()),
+            'interactive': self.sent[INTERACTIVE],
+            'broadcast': self.sent[BROADCAST],
+            'retries': self.retries,
+        }
+
+# Global limiter shared by every Bot session of the process, registered in main.py
+outbound_limiter = OutboundLimiter()
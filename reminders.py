@@ -0,0 +1,139 @@
+import asyncio
+import heapq
+import logging
+import time as _time
+from datetime import date, datetime, time, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from database import db
+from config import (
+    TIMEZONE, REMINDER_WINDOW_START, REMINDER_WINDOW_END,
+    REMINDER_BATCH_SIZE, REMINDER_AUDIENCE_BUILD_AT, REMINDER_ACTIVE_DAYS
+)
+
+logger = logging.getLogger(__name__)
+
+def default_offset(user_id: int) -> float:
+    """Stable position (0..1) of a user inside the default reminder window"""
+    return (user_id * 2654435761 % 2 ** 32) / 2 ** 32
+
+def fire_time(user_id: int, remind_at: Optional[time], day: date) -> datetime:
+    """Moment to remind a user on a day: chosen time or a spread slot in the default window"""
+    if remind_at is not None:
+        return TIMEZONE.localize(datetime.combine(day, remind_at))
+
+    start = TIMEZONE.localize(datetime.combine(day, REMINDER_WINDOW_START))
+    end = TIMEZONE.localize(datetime.combine(day, REMINDER_WINDOW_END))
+    return start + (end - start) * default_offset(user_id)
+
+class ReminderDispatcher:
+    """Single task sending per-user reminders from a min-heap of next fire times"""
+
+    def __init__(self):
+        self.sender: Optional[Callable[[List[int]], Awaitable[None]]] = None
+        self.heap: List[Tuple[float, int]] = []
+        self.scheduled: Dict[int, float] = {}  # user_id -> valid fire timestamp, stale heap entries are skipped
+        self.reminded: Set[int] = set()  # Users whose reminder for self.day already fired
+        self.day: Optional[date] = None
+        self.running = False
+        self._wakeup: Optional[asyncio.Event] = None  # Created by run(), inside the running loop
+
+    def push(self, user_id: int, fire_at: datetime):
+        """Schedule a reminder if it is still ahead today and today's has not fired yet"""
+        if user_id in self.reminded:
+            return
+        timestamp = fire_at.timestamp()
+        if timestamp <= _time.time():
+            self.scheduled.pop(user_id, None)
+            return
+        self.scheduled[user_id] = timestamp
+        heapq.heappush(self.heap, (timestamp, user_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, user_id: int):
+        """Drop today's reminder of a user"""
+        self.scheduled.pop(user_id, None)
+
+    def reschedule(self, user_id: int, remind_at: Optional[time], enabled: bool):
+        """Apply a changed preference to today's schedule, if it is already built"""
+        if not enabled or self.day != datetime.now(TIMEZONE).date():
+            self.cancel(user_id)
+            return
+        self.push(user_id, fire_time(user_id, remind_at, self.day))
+
+    async def load_day(self, day: date):
+        """Rebuild the heap from today's audience, streamed from the database"""
+        self.day = day
+        self.heap = []
+        self.scheduled = {}
+        self.reminded = set()
+        now = _time.time()
+        active_since = day - timedelta(days=REMINDER_ACTIVE_DAYS)
+        async for row in db.iter_reminder_audience(day, active_since):
+            timestamp = fire_time(row['user_id'], row['remind_at'], day).timestamp()
+            if timestamp > now:
+                self.scheduled[row['user_id']] = timestamp
+                self.heap.append((timestamp, row['user_id']))
+        heapq.heapify(self.heap)
+        logger.info(f"Reminder heap loaded for {day}: {len(self.heap)} pending")
+
+    def pop_due(self) -> List[int]:
+        """Pop up to a batch of due reminders, skipping stale entries"""
+        now = _time.time()
+        batch = []
+        while self.heap and self.heap[0][0] <= now and len(batch) < REMINDER_BATCH_SIZE:
+            timestamp, user_id = heapq.heappop(self.heap)
+            if self.scheduled.get(user_id) == timestamp:
+                del self.scheduled[user_id]
+                self.reminded.add(user_id)
+                batch.append(user_id)
+        return batch
+
+    async def _sleep(self, seconds: float):
+        """Sleep until timeout or until the schedule changes"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, seconds))
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        """Dispatch reminders until stopped"""
+        self.running = True
+        self._wakeup = asyncio.Event()
+        while self.running:
+            try:
+                # Cleared before reading the heap, so pushes made after this point wake us up
+                self._wakeup.clear()
+                now = datetime.now(TIMEZONE)
+                if self.day != now.date():
+                    build_at = TIMEZONE.localize(datetime.combine(now.date(), REMINDER_AUDIENCE_BUILD_AT))
+                    if now < build_at:
+                        await self._sleep(build_at.timestamp() - _time.time())
+                        continue
+                    await self.load_day(now.date())
+
+                batch = self.pop_due()
+                if batch:
+                    # Users who logged since the audience was built are skipped
+                    batch = await db.filter_not_logged(batch, self.day)
+                    if batch:
+                        await self.sender(batch)
+                    continue
+
+                # Sleep until the next reminder, but wake up for the next day's reload
+                midnight = TIMEZONE.localize(datetime.combine(now.date() + timedelta(days=1), time()))
+                next_fire = self.heap[0][0] if self.heap else midnight.timestamp()
+                await self._sleep(min(next_fire, midnight.timestamp()) - _time.time())
+
+            except Exception as e:
+                logger.error(f"Error in ReminderDispatcher.run: {e}")
+                await asyncio.sleep(60)
+
+    def stop(self):
+        self.running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+# Global reminder dispatcher instance
+reminders = ReminderDispatcher()
@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import logging
+import time
+import typing
+from collections import Counter, defaultdict
+from datetime import datetime
+from itertools import islice
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
+from aiogram.enums import ParseMode
+from aiogram.types import Chat, Message, Update
+
+from config import DATABASE_URL, REPLAY_DATABASE_URL
+from database import db
+from capture import read_capture
+from middleware import update_ordering
+from ratelimit import outbound_limiter
+from main import create_dispatcher
+
+logger = logging.getLogger(__name__)
+
+class FakeSession(BaseSession):
+    """Telegram session answering every API call locally after a fixed latency"""
+    
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_id = 0
+    
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None) -> Any:
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._fake_result(bot, method)
+    
+    def _fake_result(self, bot: Bot, method) -> Any:
+        returning = method.__returning__
+        options = typing.get_args(returning) if typing.get_origin(returning) is typing.Union else (returning,)
+        chat_id = getattr(method, 'chat_id', None)
+        chat_id = chat_id if isinstance(chat_id, int) else 0
+        
+        if Message in options:
+            self._message_id += 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=chat_id, type='private'),
+                text=getattr(method, 'text', None)
+            ).as_(bot)
+        if bool in options:
+            return True
+        if typing.get_origin(returning) is list:
+            return []
+        if hasattr(returning, 'model_construct'):
+            # Enough for handlers that read names of chats (leaderboards, admin views)
+            return returning.model_construct(id=chat_id, type='private', first_name=f"User{chat_id}").as_(bot)
+        return None
+    
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+    
+    async def close(self):
+        pass
+
+def update_kind(update: Update) -> str:
+    """Group updates by command or callback prefix for the report"""
+    if update.message and update.message.text and update.message.text.startswith('/'):
+        return update.message.text.split()[0].split('@')[0]
+    if update.callback_query and update.callback_query.data:
+        return f"cb:{update.callback_query.data.split('_')[0]}"
+    return update.event_type
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+async def replay(path: str, speed: float = 1.0, api_latency: float = 0.05,
+                 limit: Optional[int] = None, time_restricted: bool = False,
+                 rate_limited: bool = True) -> Dict:
+    """Feed captured updates into the real dispatcher, keeping their original spacing / speed
+    
+    speed=0 sends all updates at once. Latency of an update is measured from
+    its scheduled arrival to the end of its handling.
+    """
+    records = list(islice(read_capture(path), limit))
+    if not records:
+        raise ValueError(f"No updates in {path}")
+    
+    session = FakeSession(api_latency)
+    bot = Bot(token="42:REPLAY", session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    if rate_limited:
+        session.middleware(outbound_limiter)
+    dp = create_dispatcher(time_restricted=time_restricted)
+    
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors = 0
+    
+    async def run_one(update: Update, arrival: float):
+        nonlocal errors
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            errors += 1
+            logger.error(f"Replayed update {update.update_id} failed: {e}")
+        latencies[update_kind(update)].append(time.monotonic() - arrival)
+    
+    first = records[0][0]
+    started = time.monotonic()
+    tasks = []
+    for timestamp, raw in records:
+        arrival = started + (timestamp - first) / speed if speed > 0 else time.monotonic()
+        delay = arrival - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        update = Update.model_validate(raw, context={"bot": bot})
+        tasks.append(asyncio.create_task(run_one(update, arrival)))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        'updates': len(records),
+        'errors': errors,
+        'elapsed': elapsed,
+        'captured_span': records[-1][0] - first,
+        'throughput': len(records) / elapsed if elapsed else 0.0,
+        'p50': percentile(all_latencies, 0.5),
+        'p95': percentile(all_latencies, 0.95),
+        'p99': percentile(all_latencies, 0.99),
+        'max': max(all_latencies),
+        'by_kind': {
+            kind: (len(values), percentile(values, 0.5), percentile(values, 0.95))
+            for kind, values in sorted(latencies.items(), key=lambda item: -len(item[1]))
+        },
+        'api_calls': dict(session.calls.most_common()),
+        'queue': update_ordering.stats()
+    }
+
+def format_report(report: Dict) -> str:
+    lines = [
+        f"Updates: {report['updates']} ({report['errors']} errors)",
+        f"Elapsed: {report['elapsed']:.1f}s for {report['captured_span']:.1f}s of captured traffic",
+        f"Throughput: {report['throughput']:.1f} updates/s",
+        f"Latency: p50 {report['p50'] * 1000:.0f} ms, p95 {report['p95'] * 1000:.0f} ms, "
+        f"p99 {report['p99'] * 1000:.0f} ms, max {report['max'] * 1000:.0f} ms",
+        f"Queue delay: p50 {report['queue']['delay_p50'] * 1000:.0f} ms, "
+        f"p95 {report['queue']['delay_p95'] * 1000:.0f} ms",
+        "",
+        f"{'kind':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}"
+    ]
+    for kind, (count, p50, p95) in report['by_kind'].items():
+        lines.append(f"{kind:<24}{count:>8}{p50 * 1000:>10.0f}{p95 * 1000:>10.0f}")
+    lines += ["", "API calls:"]
+    lines += [f"  {method}: {count}" for method, count in report['api_calls'].items()]
+    return "\n".join(lines)
+
+async def main(args: argparse.Namespace):
+    """CLI entry point: python replay.py <capture.jsonl.gz> --database-url <scratch db> [--speed N]"""
+    # Replayed updates write completions, so the production database is never a target
+    database_url = args.database_url or REPLAY_DATABASE_URL
+    if not database_url:
+        raise SystemExit("Pass --database-url or set REPLAY_DATABASE_URL to a scratch database")
+    if database_url == DATABASE_URL:
+        raise SystemExit("Refusing to replay against DATABASE_URL, use a scratch database")
+    # The bot's queued completions belong to the production database, never replay them here
+    await db.init(database_url, replica_dsn=None, pending_path=None)
+    try:
+        report = await replay(args.path, args.speed, args.api_latency, args.limit, args.time_window,
+                              not args.no_rate_limit)
+        print(format_report(report))
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured updates against the real dispatcher")
+    parser.add_argument("path", help="capture file written with CAPTURE_UPDATES_PATH")
+    parser.add_argument("--database-url", help="scratch database to replay into (default REPLAY_DATABASE_URL)")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression, 0 = all at once")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="seconds per fake Telegram API call")
+    parser.add_argument("--limit", type=int, default=None, help="replay only the first N updates")
+    parser.add_argument("--time-window", action="store_true", help="keep the 18:00-23:59 restriction")
+    parser.add_argument("--no-rate-limit", action="store_true", help="skip outbound Bot API pacing")
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parser.parse_args()))
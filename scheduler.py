@@ -1,10 +1,17 @@
 import asyncio
 import logging
-from datetime import datetime, time, date
+from datetime import datetime
+from typing import List
 from aiogram import Bot
 from database import db
-from config import TIMEZONE, POINTS_TO_MONEY_RATE
-from utils import format_points, MonthNames
+from leaderboard import leaderboards
+from reminders import reminders
+from config import (
+    TIMEZONE, POINTS_TO_MONEY_RATE, LEADERBOARD_REFRESH_INTERVAL, REPLICA_CHECK_INTERVAL, REPLICA_MAX_LAG,
+    WRITE_RETRY_INTERVAL
+)
+from ratelimit import broadcast_priority
+from utils import format_points, format_tenths, MonthNames, POINTS_SCALE
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +19,8 @@ class Scheduler:
     def __init__(self, bot: Bot):
         self.bot = bot
         self.running = False
+        # Held here so the loops are not garbage collected and can be cancelled on stop
+        self.tasks: List[asyncio.Task] = []
     
     async def start(self):
         """Start the scheduler"""
@@ -19,83 +28,138 @@ class Scheduler:
         logger.info("Scheduler started")
         
         # Start background tasks
-        asyncio.create_task(self.daily_reminder_task())
-        asyncio.create_task(self.monthly_report_task())
+        reminders.sender = self.send_daily_reminder
+        loops = [
+            reminders.run(), self.monthly_report_task(), self.log_maintenance_task(),
+            self.leaderboard_refresh_task(), self.write_retry_task()
+        ]
+        if db.replica_pool is not None:
+            loops.append(self.replica_monitor_task())
+        self.tasks = [asyncio.create_task(loop) for loop in loops]
     
     async def stop(self):
-        """Stop the scheduler"""
+        """Stop the scheduler, cancelling its background loops"""
         self.running = False
+        reminders.stop()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
         logger.info("Scheduler stopped")
     
-    async def daily_reminder_task(self):
-        """Task for daily reminders at 18:00"""
+    async def monthly_report_task(self):
+        """Task for monthly reports on 1st day at 10:00"""
         while self.running:
             try:
                 now = datetime.now(TIMEZONE)
-                target_time = time(18, 0)  # 18:00
                 
-                # Check if it's time for reminder
-                if (now.time().hour == target_time.hour and 
-                    now.time().minute == target_time.minute):
+                # Check if it's 1st day of month at 10:00
+                if (now.day == 1 and 
+                    now.time().hour == 10 and 
+                    now.time().minute == 0):
                     
-                    await self.send_daily_reminder()
+                    await self.send_monthly_reports()
                     
-                    # Wait until next minute to avoid duplicate sends
-                    await asyncio.sleep(60)
+                    # Wait until next hour to avoid duplicate sends
+                    await asyncio.sleep(3600)
                 else:
                     # Check every minute
                     await asyncio.sleep(60)
                     
             except Exception as e:
-                logger.error(f"Error in daily_reminder_task: {e}")
+                logger.error(f"Error in monthly_report_task: {e}")
                 await asyncio.sleep(60)
     
-    async def monthly_report_task(self):
-        """Task for monthly reports on 1st day at 10:00"""
+    async def log_maintenance_task(self):
+        """Task for log partition maintenance every day at 04:00"""
+        # Partitions for this month and the next ones are needed before the first 04:00 run
+        try:
+            await db.ensure_partitions()
+        except Exception as e:
+            logger.error(f"Error ensuring log partitions: {e}")
+        
         while self.running:
             try:
                 now = datetime.now(TIMEZONE)
                 
-                # Check if it's 1st day of month at 10:00
-                if (now.day == 1 and 
-                    now.time().hour == 10 and 
-                    now.time().minute == 0):
+                if now.time().hour == 4 and now.time().minute == 0:
+                    await self.run_log_maintenance()
                     
-                    await self.send_monthly_reports()
-                    
-                    # Wait until next hour to avoid duplicate sends
+                    # Wait until next hour to avoid duplicate runs
                     await asyncio.sleep(3600)
                 else:
                     # Check every minute
                     await asyncio.sleep(60)
                     
             except Exception as e:
-                logger.error(f"Error in monthly_report_task: {e}")
+                logger.error(f"Error in log_maintenance_task: {e}")
                 await asyncio.sleep(60)
     
-    async def send_daily_reminder(self):
-        """Send daily reminder to all users at 18:00"""
+    async def leaderboard_refresh_task(self):
+        """Task for refreshing leaderboard snapshots in the background"""
+        while self.running:
+            try:
+                await leaderboards.refresh()
+            except Exception as e:
+                logger.error(f"Error in leaderboard_refresh_task: {e}")
+            await asyncio.sleep(LEADERBOARD_REFRESH_INTERVAL)
+    
+    async def write_retry_task(self):
+        """Task for writing completions queued while the database was unavailable"""
+        while self.running:
+            try:
+                if db.pending_writes:
+                    flushed = await db.flush_pending_writes()
+                    if flushed:
+                        logger.info(f"Wrote {flushed} queued completions, {len(db.pending_writes)} still pending")
+            except Exception as e:
+                logger.error(f"Error in write_retry_task: {e}")
+            await asyncio.sleep(WRITE_RETRY_INTERVAL)
+    
+    async def replica_monitor_task(self):
+        """Task for tracking replica lag, so stale-tolerant reads leave a lagging replica"""
+        while self.running:
+            previous = db.replica_lag
+            lag = await db.check_replica_lag()
+            usable = lag is not None and lag <= REPLICA_MAX_LAG
+            was_usable = previous is not None and previous <= REPLICA_MAX_LAG
+            if usable != was_usable:
+                if usable:
+                    logger.info(f"Read replica back in use, lag {lag:.1f}s")
+                else:
+                    logger.warning(f"Read replica out of use, lag {lag}s, reading from primary")
+            await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+    
+    async def run_log_maintenance(self):
+        """Create upcoming partitions and archive months past the retention window"""
+        try:
+            await db.ensure_partitions()
+            archived = await db.archive_old_partitions()
+            logger.info(f"Log maintenance done, {len(archived)} months archived")
+        except Exception as e:
+            logger.error(f"Error in run_log_maintenance: {e}")
+    
+    async def send_daily_reminder(self, user_ids: List[int]):
+        """Send daily reminder to a batch of users popped by the reminder dispatcher"""
         try:
-            users = await db.get_all_users()
-            
             reminder_text = (
-                "⏰ Напоминание!\\n\\n"
-                "Время добавлять модули! ⚡\\n"
-                "Используйте /modules или /add для записи выполненных заданий.\\n\\n"
-                "📈 Каждый балл приближает вас к цели!"
+                "⏰ Напоминание!\n\n"
+                "Время добавлять модули! ⚡\n"
+                "Используйте /modules или /add для записи выполненных заданий.\n\n"
+                "📈 Каждый балл приближает вас к цели!\n\n"
+                "🔕 Настроить время: /remind"
             )
             
             sent_count = 0
             error_count = 0
             
-            for user_id in users:
+            for user_id in user_ids:
                 try:
-                    await self.bot.send_message(user_id, reminder_text)
+                    # Paced by the outbound limiter, behind user replies
+                    with broadcast_priority():
+                        await self.bot.send_message(user_id, reminder_text)
                     sent_count += 1
                     
-                    # Small delay to avoid rate limits
-                    await asyncio.sleep(0.1)
-                    
                 except Exception as e:
                     logger.error(f"Error sending reminder to user {user_id}: {e}")
                     error_count += 1
@@ -107,6 +171,10 @@ class Scheduler:
     
     async def send_monthly_reports(self):
         """Send monthly reports to all users on 1st day of month"""
+        with broadcast_priority():
+            await self._send_monthly_reports()
+    
+    async def _send_monthly_reports(self):
         try:
             users = await db.get_all_users()
             now = datetime.now(TIMEZONE)
@@ -121,10 +189,10 @@ class Scheduler:
             for user_id in users:
                 try:
                     # Get user stats for previous month
-                    points = await db.get_user_points_for_month(user_id, prev_year, prev_month)
+                    points = await db.get_user_points_for_month(user_id, prev_year, prev_month, allow_stale=True)
                     
                     if points > 0:  # Send report only to active users
-                        money = points * POINTS_TO_MONEY_RATE
+                        money = points * POINTS_TO_MONEY_RATE / POINTS_SCALE
                         
                         # Save monthly summary
                         await db.save_monthly_summary(user_id, prev_year, prev_month, points)
@@ -137,18 +205,18 @@ class Scheduler:
                             name = f"User{user_id}"
                         
                         # Get daily stats for the month
-                        daily_stats = await db.get_user_daily_stats(user_id, prev_year, prev_month)
+                        daily_stats = await db.get_user_daily_stats(user_id, prev_year, prev_month, allow_stale=True)
                         active_days = len(daily_stats)
                         
                         # Calculate averages
-                        daily_average = points / active_days if active_days > 0 else 0
+                        daily_average = points / POINTS_SCALE / active_days if active_days > 0 else 0
                         
                         report_text = (
                             f"📊 Месячный отчет\\n\\n"
                             f"👤 {name}\\n"
                             f"📅 {MonthNames.get_full_month_name(prev_month)} {prev_year}\\n\\n"
                             f"🎯 Результаты:\\n"
-                            f"💎 Общие баллы: {format_points(points)}\\n"
+                            f"💎 Общие баллы: {format_tenths(points)}\\n"
                             f"💰 Денежный эквивалент: {format_points(money)} ₽\\n"
                             f"📈 Активных дней: {active_days}\\n"
                             f"📊 Среднее в день: {format_points(daily_average)}\\n\\n"
@@ -158,9 +226,6 @@ class Scheduler:
                         
                         await self.bot.send_message(user_id, report_text)
                         sent_count += 1
-                        
-                        # Small delay to avoid rate limits
-                        await asyncio.sleep(0.1)
                     
                 except Exception as e:
                     logger.error(f"Error sending monthly report to user {user_id}: {e}")
@@ -202,10 +267,10 @@ class Scheduler:
                 )
                 return
             
-            money = points * POINTS_TO_MONEY_RATE
+            money = points * POINTS_TO_MONEY_RATE / POINTS_SCALE
             daily_stats = await db.get_user_daily_stats(user_id, now.year, now.month)
             active_days = len(daily_stats)
-            daily_average = points / active_days if active_days > 0 else 0
+            daily_average = points / POINTS_SCALE / active_days if active_days > 0 else 0
             
             try:
                 user_info = await self.bot.get_chat(user_id)
@@ -218,7 +283,7 @@ class Scheduler:
                 f"👤 {name}\\n"
                 f"📅 {MonthNames.get_full_month_name(now.month)} {now.year} (текущий)\\n\\n"
                 f"🎯 Результаты:\\n"
-                f"💎 Общие баллы: {format_points(points)}\\n"
+                f"💎 Общие баллы: {format_tenths(points)}\\n"
                 f"💰 Денежный эквивалент: {format_points(money)} ₽\\n"
                 f"📈 Активных дней: {active_days}\\n"
                 f"📊 Среднее в день: {format_points(daily_average)}\\n\\n"
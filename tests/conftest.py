@@ -0,0 +1,39 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# The bot's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_real_sleep = asyncio.sleep
+
+class FakeClock:
+    """Monotonic time that only moves when a test advances it"""
+
+    def __init__(self, start: float = 100.0):
+        self.now = start
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float):
+        wake_at = self.now + delay
+        # Like asyncio.sleep(0), always give other tasks a turn
+        await _real_sleep(0)
+        while self.now < wake_at:
+            await _real_sleep(0)
+
+    async def advance(self, seconds: float = 0.0):
+        """Move time forward and let every task that became due run"""
+        self.now += seconds
+        for _ in range(20):
+            await _real_sleep(0)
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr("time.monotonic", fake.monotonic)
+    monkeypatch.setattr("asyncio.sleep", fake.sleep)
+    return fake
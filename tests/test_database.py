@@ -0,0 +1,291 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date
+
+import asyncpg
+import pytest
+
+from circuit import CircuitBreaker
+from database import Database, DatabaseUnavailable
+
+class FakeConnection:
+    def __init__(self, pool: "FakePool"):
+        self.pool = pool
+
+    async def fetch(self, query, *args):
+        return [self.pool.name]
+
+class FakePool:
+    """Pool whose acquire() fails with the queued errors, then hands out a connection"""
+
+    def __init__(self, *errors, name: str = "primary"):
+        self.errors = list(errors)
+        self.name = name
+        self.acquired = 0
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        self.acquired += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        yield FakeConnection(self)
+
+def make_db(pool, replica_pool=None) -> Database:
+    db = Database()
+    db.pool = pool
+    db.replica_pool = replica_pool
+    db.breaker = CircuitBreaker("database", failure_threshold=2, reset_timeout=30)
+    # What init() sets up besides the pools
+    db.slots = asyncio.Semaphore(4)
+    db.replica_slots = asyncio.Semaphore(4)
+    return db
+
+async def use(db, pool=None, error=None):
+    async with db.acquire(pool) as conn:
+        if error:
+            raise error
+        return conn
+
+def test_transient_errors_open_the_breaker(clock):
+    async def scenario():
+        pool = FakePool(asyncio.TimeoutError(), ConnectionResetError())
+        db = make_db(pool)
+        free = db.slots._value
+        for _ in range(2):
+            with pytest.raises((asyncio.TimeoutError, OSError)):
+                await use(db)
+        # Refused at once, the pool is not touched
+        with pytest.raises(DatabaseUnavailable):
+            await use(db)
+        assert pool.acquired == 2
+        assert db.breaker.stats()['state'] == 'open'
+
+        clock.now += 30
+        assert await use(db) is not None
+        assert db.breaker.stats()['state'] == 'closed'
+        assert db.slots._value == free
+
+    asyncio.run(scenario())
+
+def test_query_errors_do_not_count_against_the_database():
+    async def scenario():
+        db = make_db(FakePool())
+        db.breaker.record_failure()
+        for _ in range(3):
+            with pytest.raises(asyncpg.UniqueViolationError):
+                await use(db, error=asyncpg.UniqueViolationError("duplicate key"))
+        return db
+
+    db = asyncio.run(scenario())
+    assert db.breaker.stats() == {'state': 'closed', 'failures': 0, 'rejected': 0}
+
+def test_statement_timeout_counts_as_transient():
+    async def scenario():
+        db = make_db(FakePool())
+        for _ in range(2):
+            with pytest.raises(asyncpg.QueryCanceledError):
+                await use(db, error=asyncpg.QueryCanceledError("canceling statement due to statement timeout"))
+        return db
+
+    db = asyncio.run(scenario())
+    assert db.breaker.stats()['state'] == 'open'
+
+def test_replica_failures_leave_the_breaker_alone():
+    async def scenario():
+        replica = FakePool(OSError(), OSError(), OSError())
+        db = make_db(FakePool(), replica)
+        for _ in range(3):
+            with pytest.raises(OSError):
+                await use(db, replica)
+        return db
+
+    db = asyncio.run(scenario())
+    assert db.breaker.stats()['failures'] == 0
+
+def test_slots_are_released_after_failures():
+    async def scenario():
+        db = make_db(FakePool(OSError()))
+        free = db.slots._value
+        with pytest.raises(OSError):
+            await use(db)
+        with pytest.raises(ValueError):
+            await use(db, error=ValueError("bad row"))
+        await use(db)
+        return db, free
+
+    db, free = asyncio.run(scenario())
+    assert db.slots._value == free and db.waiting == 0
+
+def test_queued_completions_survive_a_restart(tmp_path):
+    path = str(tmp_path / "pending_writes.jsonl")
+    entry = (1, 2, date(2026, 10, 19), "inline:7", None)
+
+    db = Database()
+    db.pending_path = path
+    db._append_pending_file(entry)
+
+    restarted = Database()
+    restarted.pending_path = path
+    restarted.load_pending_writes()
+    assert list(restarted.pending_writes) == [entry]
+
+    restarted._rewrite_pending_file([])
+    again = Database()
+    again.pending_path = path
+    again.load_pending_writes()
+    assert not again.pending_writes
+
+def test_maintenance_statement_timeouts_leave_the_breaker_alone():
+    async def scenario():
+        db = make_db(FakePool(asyncio.TimeoutError()))
+        for _ in range(3):
+            with pytest.raises(asyncio.TimeoutError):
+                async with db.acquire(maintenance=True):
+                    raise asyncio.TimeoutError()
+        # Not getting a connection at all still counts
+        assert db.breaker.stats()['failures'] == 1
+        return db
+
+    db = asyncio.run(scenario())
+    assert db.breaker.stats()['state'] == 'closed'
+
+def test_queued_callers_fail_fast_once_the_breaker_opens(clock):
+    async def scenario():
+        pool = FakePool()
+        db = make_db(pool)
+        db.slots = asyncio.Semaphore(1)
+        release = asyncio.Event()
+
+        async def holder():
+            async with db.acquire():
+                await release.wait()
+                raise ConnectionResetError()
+
+        held = asyncio.create_task(holder())
+        await clock.advance()
+        queued = [asyncio.create_task(use(db)) for _ in range(4)]
+        await clock.advance()
+        assert db.waiting == 4
+        # The primary stalls: another failure, then the slot holder's connection drops
+        db.breaker.record_failure()
+        release.set()
+        with pytest.raises(OSError):
+            await held
+        results = await asyncio.gather(*queued, return_exceptions=True)
+        return pool, db, results
+
+    pool, db, results = asyncio.run(scenario())
+    assert all(isinstance(result, DatabaseUnavailable) for result in results)
+    assert pool.acquired == 1
+    assert db.slots._value == 1
+
+def test_failed_replica_read_retries_on_the_primary():
+    async def scenario():
+        db = make_db(FakePool(), FakePool(ConnectionRefusedError(), name="replica"))
+        db.replica_lag = 0.0
+        first = await db._read_fetch(True, "SELECT 1")
+        # Later reads skip the replica until the monitor measures it again
+        second = await db._read_fetch(True, "SELECT 1")
+        return db, first, second
+
+    db, first, second = asyncio.run(scenario())
+    assert first == second == ["primary"]
+    assert db.replica_lag is None
+    assert db.replica_pool.acquired == 1
+    assert db.breaker.stats()['failures'] == 0
+
+def test_replica_stream_falls_back_only_before_the_first_item():
+    async def scenario():
+        db = make_db(FakePool(), FakePool(name="replica"))
+        attempts = []
+
+        def failing_after(count):
+            async def stream(pool):
+                attempts.append(pool.name)
+                for index in range(count):
+                    yield f"{pool.name} {index}"
+                if pool is db.replica_pool:
+                    raise ConnectionResetError()
+            return stream
+
+        db.replica_lag = 0.0
+        items = [item async for item in db._read_stream(True, failing_after(0))]
+        assert items == []
+
+        db.replica_lag = 0.0
+        received = []
+        with pytest.raises(ConnectionResetError):
+            async for item in db._read_stream(True, failing_after(1)):
+                received.append(item)
+        return attempts, received
+
+    attempts, received = asyncio.run(scenario())
+    assert attempts == ["replica", "primary", "replica"]
+    assert received == ["replica 0"]
+
+def test_maintenance_timeout_on_the_replica_is_not_retried():
+    async def scenario():
+        db = make_db(FakePool(), FakePool(name="replica"))
+        db.replica_lag = 0.0
+
+        async def slow(conn):
+            if conn.pool is db.replica_pool:
+                raise asyncio.TimeoutError()
+            return conn.pool.name
+
+        with pytest.raises(asyncio.TimeoutError):
+            await db._read(True, slow, maintenance=True)
+        return db
+
+    db = asyncio.run(scenario())
+    assert db.pool.acquired == 0
+    assert db.replica_lag == 0.0
+
+class LoggingConnection:
+    """Connection to a table of one user's completions, with hooks to interleave a write and a read"""
+
+    def __init__(self, logs, inserted, patched):
+        self.logs = logs
+        self.inserted = inserted
+        self.patched = patched
+
+    async def fetchval(self, query, user_id, module_id, day, request_id, chat_id):
+        self.logs.append((day, 15))
+        self.inserted.set()
+        # The pool still resets the connection after the INSERT committed
+        await self.patched.wait()
+        return 15
+
+    async def fetch(self, query, user_id, start, end):
+        month_start = start.replace(day=1)
+        total = sum(tenths for _, tenths in self.logs)
+        rows = [{'month_start': month_start, 'day': None, 'points_tenths': total, 'completions': len(self.logs)}]
+        rows += [{'month_start': month_start, 'day': day.day, 'points_tenths': tenths} for day, tenths in self.logs]
+        return rows
+
+class LoggingPool:
+    def __init__(self, connection):
+        self.connection = connection
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        yield self.connection
+
+def test_stats_read_during_a_write_is_not_cached_twice():
+    async def scenario():
+        day = date(2026, 10, 19)
+        inserted, patched = asyncio.Event(), asyncio.Event()
+        db = make_db(LoggingPool(LoggingConnection([(day, 10)], inserted, patched)))
+
+        write = asyncio.create_task(db.add_module_completion(1, 2, day, "r"))
+        await inserted.wait()
+        # Reads the committed row before the writer patched the cache
+        during = await db.get_user_month_stats(1, 2026, 10)
+        patched.set()
+        await write
+        after = await db.get_user_month_stats(1, 2026, 10)
+        return during, after
+
+    during, after = asyncio.run(scenario())
+    assert during['points'] == 25
+    assert after['points'] == 25 and after['completions'] == 2
@@ -0,0 +1,93 @@
+import asyncio
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage
+
+from ratelimit import OutboundLimiter, broadcast_priority
+
+def recorder(calls, label, clock):
+    async def make_request(bot, method):
+        calls.append((label, clock.now))
+        return label
+    return make_request
+
+def test_replies_jump_ahead_of_queued_broadcasts(clock):
+    async def scenario():
+        limiter = OutboundLimiter(rate=1)
+        calls = []
+
+        async def broadcast(label):
+            with broadcast_priority():
+                return await limiter(recorder(calls, label, clock), None, GetMe())
+
+        await limiter(recorder(calls, "first", clock), None, GetMe())
+        queued = [asyncio.create_task(broadcast(f"broadcast {n}")) for n in (1, 2)]
+        await clock.advance()
+        reply = asyncio.create_task(limiter(recorder(calls, "reply", clock), None, GetMe()))
+        await clock.advance()
+        assert limiter.stats()['queued'] == 3
+
+        for _ in range(3):
+            await clock.advance(1)
+        await asyncio.gather(reply, *queued)
+        return calls, limiter.stats()
+
+    calls, stats = asyncio.run(scenario())
+    assert [label for label, _ in calls] == ["first", "reply", "broadcast 1", "broadcast 2"]
+    assert [at for _, at in calls] == [100, 101, 102, 103]
+    assert stats['interactive'] == 2 and stats['broadcast'] == 2
+
+def test_retry_after_pauses_everything_for_calls_without_chat(clock):
+    async def scenario():
+        limiter = OutboundLimiter(rate=10)
+        calls = []
+
+        async def flooded(bot, method):
+            calls.append(clock.now)
+            if len(calls) == 1:
+                raise TelegramRetryAfter(method, "Flood control exceeded", retry_after=5)
+            return "ok"
+
+        task = asyncio.create_task(limiter(flooded, None, GetMe()))
+        await clock.advance()
+        other = asyncio.create_task(limiter(recorder([], "other", clock), None, GetMe()))
+        await clock.advance(4)
+        assert len(calls) == 1 and not other.done()
+        await clock.advance(1)
+        assert task.done() and task.result() == "ok"
+        await clock.advance(1)
+        assert other.done()
+        return calls, limiter.stats()
+
+    calls, stats = asyncio.run(scenario())
+    assert calls == [100, 105]
+    assert stats['retries'] == 1
+
+def test_retry_after_pauses_only_the_flooded_chat(clock):
+    async def scenario():
+        limiter = OutboundLimiter(rate=10)
+        calls = []
+
+        async def flooded(bot, method):
+            calls.append((method.chat_id, clock.now))
+            if len(calls) == 1:
+                raise TelegramRetryAfter(method, "Flood control exceeded", retry_after=5)
+            return "ok"
+
+        task = asyncio.create_task(limiter(flooded, None, SendMessage(chat_id=42, text="report")))
+        await clock.advance()
+        # Another chat is not held back by the pause
+        other = asyncio.create_task(limiter(flooded, None, SendMessage(chat_id=7, text="reply")))
+        await clock.advance(0.5)
+        assert other.done() and not task.done()
+        await clock.advance(3.5)
+        assert not task.done()
+        # The resend also takes a token from the chat's bucket
+        await clock.advance(2)
+        assert task.done() and task.result() == "ok"
+        return calls
+
+    calls = asyncio.run(scenario())
+    assert calls[0] == (42, 100)
+    assert calls[1][0] == 7 and calls[1][1] == 100.5
+    assert calls[2][0] == 42 and calls[2][1] >= 105
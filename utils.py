@@ -1,12 +1,28 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, User
-from typing import List, Dict
+from typing import List, Dict, Tuple, Iterable, Optional, TYPE_CHECKING
+from datetime import date
 import math
 
-def format_points(points: float) -> str:
-    """Format points with proper decimal display"""
-    if points == int(points):
-        return str(int(points))
-    return f"{points:.1f}"
+if TYPE_CHECKING:
+    from analytics import CohortDistribution
+
+POINTS_SCALE = 10  # Points are stored as integer tenths
+
+STALE_NOTICE = "⚠️ База данных недоступна, данные могут быть устаревшими"
+
+def to_tenths(points) -> int:
+    """Convert points (int, float or Decimal) to integer tenths"""
+    return int(round(points * POINTS_SCALE))
+
+def format_tenths(tenths: int) -> str:
+    """Format integer tenths of a point without float rounding"""
+    sign = "-" if tenths < 0 else ""
+    whole, fraction = divmod(abs(tenths), POINTS_SCALE)
+    return f"{sign}{whole}" if fraction == 0 else f"{sign}{whole}.{fraction}"
+
+def format_points(points) -> str:
+    """Format derived point values (averages, money, module prices) rounded to tenths"""
+    return format_tenths(to_tenths(points))
 
 def get_user_display_name(user: User) -> str:
     """Get user display name (first name or username)"""
@@ -17,8 +33,8 @@ def get_user_display_name(user: User) -> str:
     else:
         return f"User{user.id}"
 
-def create_modules_keyboard(modules: List[Dict], page: int = 0, per_page: int = 8) -> InlineKeyboardMarkup:
-    """Create inline keyboard for module selection with pagination"""
+def create_modules_keyboard(modules: List[Dict], page: int = 0, per_page: int = 8, version: int = 0) -> InlineKeyboardMarkup:
+    """Create inline keyboard for module selection with pagination (callbacks carry catalog version)"""
     keyboard = []
     
     # Calculate pagination
@@ -32,7 +48,7 @@ def create_modules_keyboard(modules: List[Dict], page: int = 0, per_page: int =
         
         # First module in row
         module = modules[i]
-        button_text = f"{module['name']} ({format_points(module['points'])})"
+        button_text = f"{module['name']} ({format_tenths(module['points_tenths'])})"
         row.append(InlineKeyboardButton(
             text=button_text, 
             callback_data=f"module_{module['id']}"
@@ -41,7 +57,7 @@ def create_modules_keyboard(modules: List[Dict], page: int = 0, per_page: int =
         # Second module in row (if exists)
         if i + 1 < end_idx:
             module = modules[i + 1]
-            button_text = f"{module['name']} ({format_points(module['points'])})"
+            button_text = f"{module['name']} ({format_tenths(module['points_tenths'])})"
             row.append(InlineKeyboardButton(
                 text=button_text, 
                 callback_data=f"module_{module['id']}"
@@ -56,7 +72,7 @@ def create_modules_keyboard(modules: List[Dict], page: int = 0, per_page: int =
         if page > 0:
             pagination_row.append(InlineKeyboardButton(
                 text="⬅️ Назад", 
-                callback_data=f"modules_page_{page-1}"
+                callback_data=f"modules_page_{version}_{page-1}"
             ))
         
         pagination_row.append(InlineKeyboardButton(
@@ -67,13 +83,33 @@ def create_modules_keyboard(modules: List[Dict], page: int = 0, per_page: int =
         if page < total_pages - 1:
             pagination_row.append(InlineKeyboardButton(
                 text="Вперед ➡️", 
-                callback_data=f"modules_page_{page+1}"
+                callback_data=f"modules_page_{version}_{page+1}"
             ))
         
         keyboard.append(pagination_row)
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+def shift_month(year: int, month: int, delta: int) -> Tuple[int, int]:
+    """Shift (year, month) by delta months"""
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+def month_bounds(year: int, month: int) -> Tuple[date, date]:
+    """Get [first day, first day of next month) range for a month"""
+    next_year, next_month = shift_month(year, month, 1)
+    return date(year, month, 1), date(next_year, next_month, 1)
+
+def longest_streak(days: Iterable[int]) -> int:
+    """Get the longest run of consecutive days"""
+    best = current = 0
+    previous = None
+    for day in sorted(days):
+        current = current + 1 if previous is not None and day == previous + 1 else 1
+        best = max(best, current)
+        previous = day
+    return best
+
 def get_rank_emoji(position: int) -> str:
     """Get emoji for leaderboard position"""
     if position == 1:
@@ -128,10 +164,18 @@ def calculate_monthly_progress_score(current_points: float, previous_points: flo
     
     return final_score
 
-def generate_progress_insights(user_id: int, current_points: float, previous_points: float, 
-                             daily_stats: Dict[int, float], days_in_month: int, current_day: int) -> str:
-    """Generate AI-like insights based on user statistics"""
+def format_cohort_position(percentile: float, z_score: float) -> str:
+    """Format user's place in the cohort distribution"""
+    return f"{percentile:.0f}-й перцентиль (z = {z_score:+.1f})"
+
+def generate_progress_insights(user_id: int, current_tenths: int, previous_tenths: int, 
+                             daily_stats: Dict[int, int], days_in_month: int, current_day: int,
+                             cohort: Optional["CohortDistribution"] = None) -> str:
+    """Generate AI-like insights based on user statistics (points in tenths)"""
     
+    # Thresholds below are in points
+    current_points = current_tenths / POINTS_SCALE
+    previous_points = previous_tenths / POINTS_SCALE
     score = calculate_monthly_progress_score(current_points, previous_points, days_in_month, current_day)
     
     # Calculate some stats
@@ -172,6 +216,19 @@ def generate_progress_insights(user_id: int, current_points: float, previous_poi
         else:
             insights.append(f"📊 Значительное снижение: {change_percent:.0f}%. Нужно срочно активизироваться!")
     
+    # Cohort comparison
+    if cohort is not None and cohort.size > 1:
+        streak = longest_streak(daily_stats.keys())
+        lines = [f"👥 Среди {cohort.size} участников месяца:"]
+        for metric, label, value in (
+            ('points_tenths', "🎯 Баллы", current_tenths),
+            ('active_days', "📅 Активные дни", active_days),
+            ('longest_streak', "🔥 Серия дней подряд", streak),
+        ):
+            position = format_cohort_position(cohort.percentile(metric, value), cohort.z_score(metric, value))
+            lines.append(f"{label}: {position}")
+        insights.append("\n".join(lines))
+    
     # Projection
     insights.append(f"🎯 Прогноз на месяц: {format_points(projected_monthly)} баллов.")
     